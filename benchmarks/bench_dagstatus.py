@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Benchmark DAGstatus parsing on synthetic DAG status files.
+
+Makes status files with the given numbers of nodes, then times parsing
+each one in full, and in summary-only mode.
+
+Usage: python benchmarks/bench_dagstatus.py [--sizes 10000 100000 1000000]
+"""
+
+
+import argparse
+import imp
+import os
+import random
+import shutil
+import tempfile
+import time
+
+
+DAGSTATUS = imp.load_source('DAGstatus',
+                            os.path.join(os.path.dirname(__file__), '..', 'bin', 'DAGstatus'))
+
+DAG_BLOCK = """[
+  Type = "DagStatus";
+  DagFiles = {
+    "bench.dag"
+  };
+  Timestamp = 1477564800; /* "Thu Oct 27 12:00:00 2016" */
+  DagStatus = 3; /* "STATUS_SUBMITTED ()" */
+  NodesTotal = {total}; /* "" */
+  NodesDone = {done}; /* "" */
+  NodesPre = 0; /* "" */
+  NodesQueued = {queued}; /* "" */
+  NodesPost = 0; /* "" */
+  NodesReady = 0; /* "" */
+  NodesUnready = {unready}; /* "" */
+  NodesFailed = {failed}; /* "" */
+  JobProcsHeld = 0; /* "" */
+  JobProcsIdle = {idle}; /* "" */
+]
+"""
+
+NODE_BLOCK = """[
+  Type = "NodeStatus";
+  Node = "job_{0}";
+  NodeStatus = {1}; /* "{2}" */
+  StatusDetails = "{3}";
+  RetryCount = {4};
+  JobProcsQueued = {5};
+  JobProcsHeld = 0;
+]
+"""
+
+END_BLOCK = """[
+  Type = "StatusEnd";
+  EndTime = 1477564800; /* "Thu Oct 27 12:00:00 2016" */
+  NextUpdate = 1477564830; /* "Thu Oct 27 12:00:30 2016" */
+]
+"""
+
+# (status number, status name, details, queued), chosen at random for each node
+NODE_STATES = [
+    (5, 'STATUS_DONE', '', 0),
+    (3, 'STATUS_SUBMITTED', 'idle', 1),
+    (3, 'STATUS_SUBMITTED', 'not_idle', 1),
+    (0, 'STATUS_NOT_READY', '', 0),
+    (6, 'STATUS_ERROR', 'Job proc (1.0.0) failed with status 1', 0),
+]
+
+
+def write_status_file(filename, n_nodes, seed=1):
+    """Write a synthetic status file with n_nodes nodes.
+
+    Returns
+    -------
+    int
+        Number of running nodes.
+    """
+    rand = random.Random(seed)
+    states = [rand.choice(NODE_STATES) for _ in xrange(n_nodes)]
+    names = [s[1] for s in states]
+    with open(filename, 'w') as sfile:
+        sfile.write(DAG_BLOCK.replace('{total}', str(n_nodes))
+                             .replace('{done}', str(names.count('STATUS_DONE')))
+                             .replace('{queued}', str(names.count('STATUS_SUBMITTED')))
+                             .replace('{unready}', str(names.count('STATUS_NOT_READY')))
+                             .replace('{failed}', str(names.count('STATUS_ERROR')))
+                             .replace('{idle}', str(sum(s[2] == 'idle' for s in states))))
+        for i, (num, name, details, queued) in enumerate(states):
+            sfile.write(NODE_BLOCK.format(i, num, name, details, rand.randint(0, 3), queued))
+        sfile.write(END_BLOCK)
+    return sum(s[2] == 'not_idle' for s in states)
+
+
+def time_call(func, *args):
+    """Return the result of func(*args), and how long it took in seconds."""
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def run_benchmark(sizes):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print '{0:>10} | {1:>8} | {2:>10} | {3:>12}'.format('Nodes', 'MB',
+                                                            'Full (s)', 'Summary (s)')
+        for n_nodes in sizes:
+            filename = os.path.join(tmp_dir, 'bench_%d.status' % n_nodes)
+            running = write_status_file(filename, n_nodes)
+            size_mb = os.path.getsize(filename) / 1024. / 1024.
+
+            (dag, nodes, end), t_full = time_call(DAGSTATUS.interpret_status_file, filename, False)
+            assert len(nodes) == n_nodes and dag.job_procs_running == running
+
+            (dag, nodes, end), t_summary = time_call(DAGSTATUS.interpret_status_file,
+                                                     filename, True)
+            assert not nodes and dag.job_procs_running == running
+
+            print '{0:>10} | {1:>8.1f} | {2:>10.2f} | {3:>12.2f}'.format(n_nodes, size_mb,
+                                                                         t_full, t_summary)
+            os.remove(filename)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="Numbers of nodes in each status file")
+    args = parser.parse_args()
+    run_benchmark(args.sizes)
@@ -0,0 +1,214 @@
+"""
+Classes/functions to read the archives of small output files made by
+JobSets with aggregate_outputs=True.
+"""
+
+
+import logging
+import os
+import struct
+import shutil
+import tempfile
+import zipfile
+import zlib
+from htcondenser.common import cp_hdfs, strip_codec_suffix
+
+
+log = logging.getLogger(__name__)
+
+
+# Zip local file header: signature, version, flags, compression, time, date,
+# CRC-32, compressed size, uncompressed size, filename length, extra field length
+_LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+_LOCAL_HEADER_SIGNATURE = b'PK\003\004'
+
+
+class OutputArchive(object):
+    """Read individual files from an output archive, without unpacking it.
+
+    Only the index at the end of the archive is read on opening. Each member
+    is then read by seeking straight to its offset.
+
+    Members are named by the full destination path they would have been
+    copied to, e.g. /hdfs/user/me/job1/results.txt. A leading / is optional.
+    Compressed outputs are stored without their codec suffix (e.g. .gz),
+    but can be looked up with or without it.
+
+    Parameters
+    ----------
+    filename : str
+        Archive filename, e.g. Job.output_archive. Files on HDFS are read
+        via the /hdfs mount.
+
+    Raises
+    ------
+    IOError
+        If the archive cannot be opened or is not a valid archive.
+    """
+
+    def __init__(self, filename):
+        super(OutputArchive, self).__init__()
+        self.filename = filename
+        try:
+            with open(filename, 'rb') as afile:
+                self._index = dict((info.filename, info)
+                                   for info in zipfile.ZipFile(afile).infolist())
+        except zipfile.BadZipfile as err:
+            raise IOError('%s is not a valid output archive: %s' % (filename, err))
+        self._file = open(filename, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, name):
+        try:
+            self._info(name)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self._index)
+
+    def close(self):
+        self._file.close()
+
+    def names(self):
+        """Get the names of all files in the archive, with a leading /."""
+        return sorted('/' + name for name in self._index)
+
+    def _info(self, name):
+        for key in [name.lstrip('/'), strip_codec_suffix(name.lstrip('/'))]:
+            if key in self._index:
+                return self._index[key]
+        raise KeyError('No file %s in archive %s' % (name, self.filename))
+
+    def offset(self, name):
+        """Get the position of a file's contents in the archive, in bytes.
+
+        Parameters
+        ----------
+        name : str
+            Name of file in archive.
+
+        Returns
+        -------
+        int
+            Byte offset of the contents.
+
+        Raises
+        ------
+        KeyError
+            If there is no file with that name in the archive.
+        IOError
+            If the archive is corrupt.
+        """
+        info = self._info(name)
+        self._file.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(self._file.read(_LOCAL_HEADER.size))
+        if header[0] != _LOCAL_HEADER_SIGNATURE:
+            raise IOError('Bad header for %s in %s' % (name, self.filename))
+        return info.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1]
+
+    def size(self, name):
+        """Get the size in bytes of a file in the archive."""
+        return self._info(name).file_size
+
+    def compress_type(self, name):
+        """Get how a file is compressed in the archive, e.g. zipfile.ZIP_DEFLATED."""
+        return self._info(name).compress_type
+
+    def read(self, name):
+        """Get the contents of a file in the archive.
+
+        Parameters
+        ----------
+        name : str
+            Name of file in archive.
+
+        Returns
+        -------
+        bytes
+            Contents of file.
+
+        Raises
+        ------
+        KeyError
+            If there is no file with that name in the archive.
+        IOError
+            If the contents do not match their checksum.
+        """
+        info = self._info(name)
+        self._file.seek(self.offset(name))
+        data = self._file.read(info.compress_size)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -15)
+        elif info.compress_type != zipfile.ZIP_STORED:
+            raise IOError('Unsupported compression for %s in %s' % (name, self.filename))
+        if zlib.crc32(data) & 0xffffffff != info.CRC:
+            raise IOError('Checksum mismatch for %s in %s' % (name, self.filename))
+        return data
+
+    def extract(self, name, dest):
+        """Write a file in the archive to dest.
+
+        Parameters
+        ----------
+        name : str
+            Name of file in archive.
+
+        dest : str
+            Destination filepath, or directory to put file in.
+
+        Returns
+        -------
+        str
+            Filepath written.
+        """
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(name))
+        with open(dest, 'wb') as dfile:
+            dfile.write(self.read(name))
+        return dest
+
+
+def merge_archives(archives, dest):
+    """Merge several output archives into one, e.g. to have one archive per
+    N jobs instead of one per job.
+
+    The merged archive is written locally first, then copied to dest with
+    cp_hdfs, so dest can be on HDFS. Later archives take precedence if
+    they have files with the same name. Each file keeps its compression.
+
+    Parameters
+    ----------
+    archives : list[str]
+        Archive filenames to merge.
+
+    dest : str
+        Filename for merged archive.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        merged = os.path.join(tmp_dir, os.path.basename(dest))
+        zfile = zipfile.ZipFile(merged, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        try:
+            written = set()
+            # go backwards so the first copy of a name seen is the one to keep
+            for archive in reversed(archives):
+                log.debug('Merging %s', archive)
+                with OutputArchive(archive) as oarchive:
+                    for name in oarchive.names():
+                        if name not in written:
+                            zfile.writestr(name.lstrip('/'), oarchive.read(name),
+                                           oarchive.compress_type(name))
+                            written.add(name)
+        finally:
+            zfile.close()
+        log.info('Writing merged archive to %s', dest)
+        cp_hdfs(merged, dest)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,580 @@
+"""
+Classes to submit JobSets and DAGs to HTCondor, either with the command line
+tools or the HTCondor python bindings, plus a fake in-process schedd for tests.
+"""
+
+
+import logging
+import os
+import re
+import json
+import time
+import threading
+import Queue
+from copy import deepcopy
+from collections import OrderedDict
+from subprocess import Popen, PIPE, STDOUT, CalledProcessError
+try:
+    import htcondor
+except ImportError:
+    htcondor = None
+
+
+log = logging.getLogger(__name__)
+
+
+# e.g. "3 job(s) submitted to cluster 1234."
+SUBMITTED_RE = re.compile(r'(\d+) job\(s\) submitted to cluster (\d+)')
+
+# Name of submit variable holding each job's arguments, when using itemdata
+ARGS_VAR_NAME = 'htcJobArgs'
+
+
+class SubmitResult(object):
+    """IDs of the jobs made by a submission.
+
+    Parameters
+    ----------
+    cluster : int
+        Cluster ID.
+
+    first_proc : int
+        Process ID of the first job.
+
+    num_procs : int
+        Number of jobs.
+
+    names : list[str], optional
+        Name of the Job for each process, in order. Jobs with quantity > 1
+        appear several times.
+    """
+
+    def __init__(self, cluster, first_proc=0, num_procs=1, names=None):
+        super(SubmitResult, self).__init__()
+        self.cluster = int(cluster)
+        self.first_proc = int(first_proc)
+        self.num_procs = int(num_procs)
+        self.names = names or []
+
+    def __repr__(self):
+        return 'SubmitResult(cluster=%d, first_proc=%d, num_procs=%d)' % (
+            self.cluster, self.first_proc, self.num_procs)
+
+    @property
+    def job_ids(self):
+        """List of cluster.process IDs."""
+        return ['%d.%d' % (self.cluster, self.first_proc + i) for i in xrange(self.num_procs)]
+
+    def ids_by_name(self):
+        """Get the cluster.process IDs of each Job.
+
+        Returns
+        -------
+        OrderedDict
+            {job name: [cluster.process, ...]}
+        """
+        ids = OrderedDict()
+        for name, job_id in zip(self.names, self.job_ids):
+            ids.setdefault(name, []).append(job_id)
+        return ids
+
+
+def job_names(jobs):
+    """Get the name of the Job for each process in a cluster of Jobs."""
+    return [job.name for job in jobs for _ in xrange(job.quantity)]
+
+
+def parse_environment(value):
+    """Get the variables in a submit `environment` value, in either the new
+    syntax (in double quotes, separated by spaces, values with spaces in
+    single quotes) or the old syntax (separated by semicolons).
+
+    Returns
+    -------
+    list[(str, str)]
+        (name, value) for each variable, in order.
+    """
+    value = (value or '').strip()
+    if not (len(value) > 1 and value[0] == value[-1] == '"'):
+        return [tuple(x.strip().split('=', 1)) for x in value.split(';') if '=' in x]
+    text = value[1:-1].replace('""', '"')
+    tokens = []
+    token = ''
+    quoted = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "'" and quoted and text[i + 1:i + 2] == "'":
+            token += "'"
+            i += 1
+        elif char == "'":
+            quoted = not quoted
+        elif char.isspace() and not quoted:
+            if token:
+                tokens.append(token)
+            token = ''
+        else:
+            token += char
+        i += 1
+    if token:
+        tokens.append(token)
+    return [tuple(t.split('=', 1)) for t in tokens if '=' in t]
+
+
+def format_environment(variables):
+    """Make a submit `environment` value in the new syntax.
+
+    Parameters
+    ----------
+    variables : list[(str, str)]
+        (name, value) for each variable.
+
+    Returns
+    -------
+    str
+    """
+    entries = []
+    for name, value in variables:
+        value = str(value)
+        if not value or any(c.isspace() or c == "'" for c in value):
+            value = "'%s'" % value.replace("'", "''")
+        entries.append('%s=%s' % (name, value))
+    return '"%s"' % ' '.join(entries).replace('"', '""')
+
+
+def read_submit_description(filename):
+    """Read the submit commands common to all jobs in a submit file written
+    by JobSet, i.e. everything apart from the arguments & queue lines.
+
+    Parameters
+    ----------
+    filename : str
+        Submit filename.
+
+    Returns
+    -------
+    OrderedDict
+        {command: value}
+    """
+    description = OrderedDict()
+    with open(filename) as sfile:
+        for line in sfile:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = [x.strip() for x in line.split('=', 1)]
+            if key.lower() not in ['arguments', 'queue']:
+                description[key] = value
+    return description
+
+
+class CondorCommandBackend(object):
+    """Submit with `condor_submit` & `condor_submit_dag`.
+
+    The cluster ID is read from their output.
+    """
+
+    def run(self, cmds, env=None):
+        """Run a submit command, print its output, and get the cluster ID & number of jobs.
+
+        Raises
+        ------
+        CalledProcessError
+            If the command fails. Its output is in the exception's `output`.
+        """
+        proc = Popen(cmds, env=env, stdout=PIPE, stderr=STDOUT)
+        output = proc.communicate()[0]
+        print output.rstrip()
+        if proc.returncode != 0:
+            raise CalledProcessError(proc.returncode, cmds, output)
+        match = SUBMITTED_RE.search(output)
+        if not match:
+            raise RuntimeError('Cannot find cluster ID in output of %s' % ' '.join(cmds))
+        return int(match.group(2)), int(match.group(1))
+
+    def submit_file(self, filename, jobs, force=False):
+        """Submit a submit file written by a JobSet.
+
+        Parameters
+        ----------
+        filename : str
+            Submit filename, e.g. of a shard.
+
+        jobs : list[Job]
+            Jobs in the file, in order.
+
+        force : bool, optional
+            Force condor_submit.
+
+        Returns
+        -------
+        SubmitResult
+        """
+        cmds = ['condor_submit', filename]
+        if force:
+            cmds.insert(1, '-f')
+        cluster, num_procs = self.run(cmds)
+        return SubmitResult(cluster, 0, num_procs, job_names(jobs))
+
+    def submit_jobset(self, jobset, force=False):
+        """Submit a JobSet whose submit file has been written.
+
+        Returns
+        -------
+        SubmitResult
+        """
+        return self.submit_file(jobset.filename, jobset.jobs.values(), force)
+
+    def submit_dag(self, dag, force=False, submit_per_interval=10):
+        """Submit a DAG whose files have been written.
+
+        Returns
+        -------
+        SubmitResult
+            For the DAGMan job itself.
+        """
+        cmds = ['condor_submit_dag', dag.dag_filename]
+        if force:
+            cmds.insert(1, '-f')
+        # modify the env vars to modify DAGMan config settings
+        mod_env = deepcopy(os.environ)
+        mod_env['_CONDOR_DAGMAN_MAX_SUBMITS_PER_INTERVAL'] = str(submit_per_interval)
+        cluster, _ = self.run(cmds, env=mod_env)
+        return SubmitResult(cluster, 0, 1, [os.path.basename(dag.dag_filename)])
+
+
+class PythonBindingsBackend(object):
+    """Submit with the HTCondor python bindings.
+
+    All the jobs in a JobSet are submitted in one transaction with the
+    schedd, as one cluster, so either all or none are submitted. Each job's
+    arguments are passed as item data rather than a separate queue statement.
+
+    Parameters
+    ----------
+    schedd : htcondor.Schedd or FakeSchedd, optional
+        Schedd to submit to. Defaults to the local schedd.
+
+    late_materialization : int, optional
+        If set, the schedd only makes this many jobs of a cluster at once
+        (`max_materialize`), making more as they finish. This keeps the
+        schedd responsive for very large JobSets. Needs HTCondor 8.7.1+.
+
+    Raises
+    ------
+    ImportError
+        If no `schedd` is given and the htcondor module is not installed.
+    """
+
+    def __init__(self, schedd=None, late_materialization=None):
+        super(PythonBindingsBackend, self).__init__()
+        if schedd is None:
+            if htcondor is None:
+                raise ImportError('PythonBindingsBackend needs the htcondor module: '
+                                  'pip install htcondor')
+            schedd = htcondor.Schedd()
+        self.schedd = schedd
+        self.late_materialization = late_materialization
+
+    @staticmethod
+    def make_submit(description):
+        """Turn a dict of submit commands into a htcondor.Submit, if the
+        bindings are installed. Otherwise the dict is used as is, e.g. for
+        FakeSchedd."""
+        return htcondor.Submit(dict(description)) if htcondor else description
+
+    def submit_file(self, filename, jobs, force=False):
+        """Submit the jobs of a submit file written by a JobSet.
+
+        Parameters
+        ----------
+        filename : str
+            Submit filename, e.g. of a shard.
+
+        jobs : list[Job]
+            Jobs in the file, in order.
+
+        force : bool, optional
+            Not used, for compatibility with CondorCommandBackend.
+
+        Returns
+        -------
+        SubmitResult
+        """
+        description = read_submit_description(filename)
+        description['arguments'] = '"$(%s)"' % ARGS_VAR_NAME
+        if self.late_materialization:
+            description['max_materialize'] = str(self.late_materialization)
+        itemdata = [{ARGS_VAR_NAME: job.generate_job_arg_str()}
+                    for job in jobs for _ in xrange(job.quantity)]
+        result = self.schedd.submit(self.make_submit(description), itemdata=iter(itemdata))
+        log.info('%d job(s) submitted to cluster %d.', result.num_procs(), result.cluster())
+        return SubmitResult(result.cluster(), result.first_proc(), result.num_procs(),
+                            job_names(jobs))
+
+    def submit_jobset(self, jobset, force=False):
+        """Submit a JobSet whose submit file has been written.
+
+        Returns
+        -------
+        SubmitResult
+        """
+        return self.submit_file(jobset.filename, jobset.jobs.values(), force)
+
+    def submit_dag(self, dag, force=False, submit_per_interval=10):
+        """Submit a DAG whose files have been written.
+
+        Parameters
+        ----------
+        dag : DAGMan
+
+        force : bool, optional
+            Overwrite any existing DAGMan files (e.g. from a previous run).
+
+        submit_per_interval : int, optional
+            Number of DAGMan submissions per interval.
+
+        Returns
+        -------
+        SubmitResult
+            For the DAGMan job itself.
+        """
+        options = {'force': int(bool(force))}
+        if htcondor:
+            description = htcondor.Submit.from_dag(dag.dag_filename, options)
+            variables = parse_environment(description.get('environment'))
+            variables = [('_CONDOR_DAGMAN_MAX_SUBMITS_PER_INTERVAL', str(submit_per_interval))] + [
+                v for v in variables if v[0] != '_CONDOR_DAGMAN_MAX_SUBMITS_PER_INTERVAL']
+            description['environment'] = format_environment(variables)
+        else:
+            description = OrderedDict([('universe', 'scheduler'),
+                                       ('executable', 'condor_dagman'),
+                                       ('dag_file', dag.dag_filename)])
+            description.update(options)
+        result = self.schedd.submit(description)
+        log.info('DAG submitted to cluster %d.', result.cluster())
+        return SubmitResult(result.cluster(), result.first_proc(), result.num_procs(),
+                            [os.path.basename(dag.dag_filename)])
+
+
+class ShardSubmitter(object):
+    """Submit the shards of a JobSet (see JobSet `shard_size`) as separate
+    clusters, several at once.
+
+    A small pool of threads each submits one shard at a time. Shards are
+    handed to them through a queue of limited size, and if a submission
+    fails, all threads wait before submitting again, so a busy schedd is not
+    flooded. A failed shard is retried up to `max_attempts` times in total.
+
+    The cluster of each submitted shard is saved to a JSON file as soon as it
+    is submitted. With `resume=True`, shards already recorded there are not
+    submitted again, so after a failure only the failed shards are.
+
+    Parameters
+    ----------
+    backend : CondorCommandBackend or PythonBindingsBackend
+        How to submit each shard.
+
+    submitters : int, optional
+        Number of shards to submit at once.
+
+    max_attempts : int, optional
+        Number of times to try submitting each shard.
+
+    retry_wait : float, optional
+        Seconds to wait after a failed submission before submitting anything
+        else. Doubles with each failed attempt of a shard.
+    """
+
+    def __init__(self, backend, submitters=4, max_attempts=3, retry_wait=30):
+        super(ShardSubmitter, self).__init__()
+        self.backend = backend
+        self.submitters = max(1, int(submitters))
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_wait = retry_wait
+        self._lock = threading.Lock()
+        self._pause_until = 0
+
+    def submit(self, shards, force=False, state_file=None, resume=False):
+        """Submit shards.
+
+        Parameters
+        ----------
+        shards : list[(str, list[Job])]
+            Submit filename & its Jobs for each shard, e.g. JobSet.shards.
+
+        force : bool, optional
+            Passed to the backend.
+
+        state_file : str, optional
+            JSON file to record the cluster of each submitted shard in.
+
+        resume : bool, optional
+            If True, do not submit shards already recorded in `state_file`.
+
+        Returns
+        -------
+        list[SubmitResult]
+            For each shard, in order.
+
+        Raises
+        ------
+        RuntimeError
+            If any shards could not be submitted. The others are still
+            recorded in `state_file`.
+        """
+        state = OrderedDict()
+        if resume and state_file and os.path.isfile(state_file):
+            with open(state_file) as sfile:
+                state = json.load(sfile, object_pairs_hook=OrderedDict)
+        results = [None] * len(shards)
+        work = Queue.Queue(maxsize=self.submitters)
+        threads = [threading.Thread(target=self._worker,
+                                    args=(work, results, state, state_file, force))
+                   for _ in xrange(self.submitters)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for index, (filename, jobs) in enumerate(shards):
+            if filename in state:
+                log.info('Already submitted %s to cluster %d', filename, state[filename]['cluster'])
+                results[index] = SubmitResult(names=job_names(jobs), **state[filename])
+            else:
+                # blocks whilst all submitters are busy
+                work.put((index, filename, jobs))
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+
+        failed = [filename for (filename, _), result in zip(shards, results) if result is None]
+        if failed:
+            raise RuntimeError('%d of %d shards could not be submitted: %s. '
+                               'Submit again with resume=True to submit only these.'
+                               % (len(failed), len(shards), ', '.join(failed)))
+        log.info('Submitted %d shards, %d jobs', len(shards), sum(r.num_procs for r in results))
+        return results
+
+    def _worker(self, work, results, state, state_file, force):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            index, filename, jobs = item
+            result = self._submit_shard(filename, jobs, force)
+            if result is None:
+                continue
+            with self._lock:
+                results[index] = result
+                state[filename] = dict(cluster=result.cluster, first_proc=result.first_proc,
+                                       num_procs=result.num_procs)
+                if state_file:
+                    self._save(state, state_file)
+
+    def _submit_shard(self, filename, jobs, force):
+        """Submit one shard, retrying on failure. Returns None if it failed."""
+        for attempt in xrange(self.max_attempts):
+            time.sleep(max(0, self._pause_until - time.time()))
+            try:
+                return self.backend.submit_file(filename, jobs, force)
+            except Exception as exc:
+                wait = self.retry_wait * 2 ** attempt
+                log.warning('Failed to submit %s (attempt %d of %d): %s',
+                            filename, attempt + 1, self.max_attempts, exc)
+                if attempt + 1 < self.max_attempts:
+                    with self._lock:
+                        self._pause_until = max(self._pause_until, time.time() + wait)
+        log.error('Giving up submitting %s', filename)
+        return None
+
+    @staticmethod
+    def _save(state, state_file):
+        tmp_file = state_file + '.tmp'
+        with open(tmp_file, 'w') as sfile:
+            json.dump(state, sfile, indent=2)
+        os.rename(tmp_file, state_file)
+
+
+class FakeSubmitResult(object):
+    """What FakeSchedd.submit() returns, like htcondor.SubmitResult."""
+
+    def __init__(self, cluster, first_proc, num_procs):
+        super(FakeSubmitResult, self).__init__()
+        self._ids = (cluster, first_proc, num_procs)
+
+    def cluster(self):
+        return self._ids[0]
+
+    def first_proc(self):
+        return self._ids[1]
+
+    def num_procs(self):
+        return self._ids[2]
+
+
+class FakeSchedd(object):
+    """In-process stand-in for htcondor.Schedd, for testing submission
+    without HTCondor. Submitted jobs are stored, not run.
+
+    Parameters
+    ----------
+    first_cluster : int, optional
+        Cluster ID for the first submission.
+
+    fail_after : int, optional
+        If set, a submission fails with RuntimeError after this many
+        jobs in total, to test what happens when a transaction fails.
+        Nothing from the failed submission is kept.
+
+    Attributes
+    ----------
+    jobs : OrderedDict
+        {(cluster, proc): dict of submit commands for that job}, with item
+        data macros, e.g. $(htcJobArgs), filled in.
+    """
+
+    def __init__(self, first_cluster=1, fail_after=None):
+        super(FakeSchedd, self).__init__()
+        self.next_cluster = first_cluster
+        self.fail_after = fail_after
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, description, count=0, spool=False, itemdata=None):
+        """Submit a cluster of jobs in one transaction.
+
+        Parameters
+        ----------
+        description : dict or htcondor.Submit
+            Submit commands.
+
+        count : int, optional
+            Number of jobs if there is no item data.
+
+        spool : bool, optional
+            Not used.
+
+        itemdata : iterable[dict], optional
+            Macros for each job.
+
+        Returns
+        -------
+        FakeSubmitResult
+        """
+        description = dict(description.items())
+        items = list(itemdata) if itemdata is not None else [{}] * (count or 1)
+        with self._lock:
+            if self.fail_after is not None and len(self.jobs) + len(items) > self.fail_after:
+                raise RuntimeError('FakeSchedd: transaction failed')
+            cluster = self.next_cluster
+            self.next_cluster += 1
+            for proc, item in enumerate(items):
+                ad = dict((k, re.sub(r'\$\((\w+)\)',
+                                     lambda m: item.get(m.group(1), m.group(0)), str(v)))
+                          for k, v in description.iteritems())
+                self.jobs[(cluster, proc)] = ad
+        return FakeSubmitResult(cluster, 0, len(items))
+
+    def cluster_jobs(self, cluster):
+        """Get the submit commands of each job in a cluster, in process order."""
+        return [ad for (c, _), ad in self.jobs.iteritems() if c == cluster]
@@ -6,11 +6,28 @@ import os
 from subprocess import check_call, Popen, PIPE
 import shutil
 import datetime
+import errno
+import fcntl
+import ctypes
+import ctypes.util
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 
 log = logging.getLogger(__name__)
 
 
+# Compression codecs for output files, and the filename suffix each one adds.
+# condor_worker.py uses the suffix to decide how to (de)compress.
+COMPRESSION_CODECS = {
+    'gzip': '.gz',
+    'bzip2': '.bz2',
+    'xz': '.xz',
+    'zstd': '.zst',
+    'lz4': '.lz4',
+}
+
+
 class FileMirror(object):
     """Simple class to store location of mirrored files: the original,
     the copy of HDFS, and the copy on the worker node."""
@@ -52,6 +69,192 @@ def check_dir_create(directory):
             os.makedirs(directory)
 
 
+# ioctl request to clone a file's extents, from linux/fs.h
+FICLONE = 0x40049409
+
+# Errors meaning a copy strategy is not supported for these files,
+# so the next one should be tried.
+_UNSUPPORTED_ERRNOS = set([errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EPERM,
+                           errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EMLINK])
+
+try:
+    _LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    _LIBC = None
+
+
+def _libc_func(name, restype, argtypes):
+    """Get a function from libc, or None if not available."""
+    func = getattr(_LIBC, name, None) if _LIBC else None
+    if func is not None:
+        func.restype = restype
+        func.argtypes = argtypes
+    return func
+
+
+_COPY_FILE_RANGE = _libc_func('copy_file_range', ctypes.c_ssize_t,
+                              [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                               ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint])
+_SENDFILE = _libc_func('sendfile', ctypes.c_ssize_t,
+                       [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+
+
+def _kernel_copy(func, src_fd, dest_fd, size):
+    """Copy size bytes using copy_file_range or sendfile, looping over
+    partial copies. func takes (src_fd, dest_fd, nbytes).
+
+    Some filesystems (e.g. FUSE, NFS) & kernels copy nothing without an
+    error, so that raises EINVAL, for copy_file() to try the next strategy.
+    """
+    remaining = size
+    while remaining > 0:
+        copied = func(src_fd, dest_fd, min(remaining, 1 << 30))
+        if copied < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if copied == 0:
+            raise OSError(errno.EINVAL, 'Copy stopped with %d bytes left' % remaining)
+        remaining -= copied
+
+
+def _copy_hardlink(src, dest):
+    # Link to a temporary name first so an existing dest is replaced atomically
+    tmp = dest + '.htcondenser_link'
+    os.link(src, tmp)
+    os.rename(tmp, dest)
+
+
+def _copy_reflink(src, dest):
+    with open(src, 'rb') as fsrc:
+        with open(dest, 'wb') as fdest:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(src, dest):
+    if _COPY_FILE_RANGE is None:
+        raise OSError(errno.ENOSYS, 'copy_file_range not available')
+    with open(src, 'rb') as fsrc:
+        with open(dest, 'wb') as fdest:
+            _kernel_copy(lambda i, o, n: _COPY_FILE_RANGE(i, None, o, None, n, 0),
+                         fsrc.fileno(), fdest.fileno(), os.fstat(fsrc.fileno()).st_size)
+
+
+def _copy_sendfile(src, dest):
+    if _SENDFILE is None:
+        raise OSError(errno.ENOSYS, 'sendfile not available')
+    with open(src, 'rb') as fsrc:
+        with open(dest, 'wb') as fdest:
+            _kernel_copy(lambda i, o, n: _SENDFILE(o, i, None, n),
+                         fsrc.fileno(), fdest.fileno(), os.fstat(fsrc.fileno()).st_size)
+
+
+def _copy_buffered(src, dest):
+    shutil.copyfile(src, dest)
+
+
+# Copy strategies in order of preference
+COPY_STRATEGIES = [
+    ('hardlink', _copy_hardlink),
+    ('reflink', _copy_reflink),
+    ('copy_file_range', _copy_file_range),
+    ('sendfile', _copy_sendfile),
+    ('buffered', _copy_buffered),
+]
+
+
+def copy_file(src, dest, hardlink=False):
+    """Copy a file using the fastest method that works for src and dest.
+
+    Tries in order: a hardlink (only if `hardlink` is True), a reflink
+    (FICLONE), the zero-copy copy_file_range and sendfile system calls,
+    and finally a normal buffered copy. Permission bits & timestamps are
+    copied as for shutil.copy2.
+
+    Parameters
+    ----------
+    src : str
+        Source filepath.
+
+    dest : str
+        Destination filepath or directory.
+
+    hardlink : bool, optional
+        Allow dest to be a hardlink to src. Only use this if neither file
+        will be modified afterwards, since they will share their contents.
+
+    Returns
+    -------
+    str
+        Name of the strategy used, one of the names in COPY_STRATEGIES.
+
+    Raises
+    ------
+    shutil.Error
+        If src and dest are the same file.
+    """
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(src))
+    # as shutil.copyfile, since opening dest would truncate src
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        raise shutil.Error('`%s` and `%s` are the same file' % (src, dest))
+    for name, func in COPY_STRATEGIES:
+        if name == 'hardlink' and not hardlink:
+            continue
+        try:
+            func(src, dest)
+        except (OSError, IOError) as err:
+            if name == 'buffered' or err.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            log.debug('Cannot copy %s with %s: %s', src, name, err)
+            continue
+        if name != 'hardlink':
+            shutil.copystat(src, dest)
+        return name
+
+
+def copy_tree(src, dest, hardlink=False, threads=None):
+    """Copy a directory tree, copying files in parallel with copy_file().
+
+    As for shutil.copytree, dest must not already exist, and symlinks are
+    followed.
+
+    Parameters
+    ----------
+    src : str
+        Source directory.
+
+    dest : str
+        Destination directory.
+
+    hardlink : bool, optional
+        Allow files to be hardlinked, see copy_file().
+
+    threads : int, optional
+        Number of files to copy at once. Default is the number of CPUs, up to 8.
+
+    Returns
+    -------
+    dict
+        Number of files copied with each strategy.
+    """
+    pairs = []
+    for root, dirs, files in os.walk(src, followlinks=True):
+        dest_root = os.path.join(dest, os.path.relpath(root, src))
+        os.makedirs(dest_root)
+        shutil.copystat(root, dest_root)
+        pairs.extend((os.path.join(root, f), os.path.join(dest_root, f)) for f in files)
+    pool = ThreadPool(threads or min(cpu_count(), 8))
+    try:
+        strategies = pool.map(lambda pair: copy_file(pair[0], pair[1], hardlink), pairs)
+    finally:
+        pool.close()
+        pool.join()
+    counts = {}
+    for name in strategies:
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
 def cp_hdfs(src, dest, force=True):
     """Copy file between src and destination, allowing for one or both to
     be on HDFS.
@@ -68,6 +271,13 @@ def cp_hdfs(src, dest, force=True):
 
     force : bool, optional
         If True, will overwrite destination file if it already exists.
+
+    Returns
+    -------
+    str or dict
+        How the copy was done: 'hadoop' for HDFS, otherwise the strategy
+        from copy_file(), or for a directory the count of each strategy
+        from copy_tree().
     """
     # Check if source and/or destination reside on HDFS
     flag_src_hdfs = src.startswith("/hdfs")
@@ -90,12 +300,17 @@ def cp_hdfs(src, dest, force=True):
         cmds.extend([src_hdfs, dest_hdfs])
         log.debug(cmds)
         check_call(cmds)
+        return 'hadoop'
     else:
-        # use normal copy command
+        # use fastest local copy available
         if os.path.isfile(src):
-            shutil.copy2(src, dest)
+            strategy = copy_file(src, dest)
         elif os.path.isdir(src):
-            shutil.copytree(src, dest)
+            strategy = copy_tree(src, dest)
+        else:
+            return None
+        log.debug('Copied %s to %s via %s', src, dest, strategy)
+        return strategy
 
 
 def date_time_now(fmt='%H:%M:%S %d %B %Y'):
@@ -168,6 +383,38 @@ def check_certificate():
         raise RuntimeError(err)
 
 
+def check_codec(codec):
+    """Check a compression codec is supported.
+
+    Parameters
+    ----------
+    codec : str or None
+        Codec name, one of COMPRESSION_CODECS, or None for no compression.
+
+    Raises
+    ------
+    ValueError
+        If codec is not supported.
+    """
+    if codec is not None and codec not in COMPRESSION_CODECS:
+        raise ValueError('Unknown codec %s, must be one of %s' %
+                         (codec, ', '.join(sorted(COMPRESSION_CODECS))))
+
+
+def strip_codec_suffix(filename):
+    """Remove any compression codec suffix from a filename.
+
+    Returns
+    -------
+    str
+        Filename without suffix.
+    """
+    for suffix in COMPRESSION_CODECS.values():
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
 def check_good_filename(filename):
     """Checks the filename isn't rubbish e.g. blank, a period
 
@@ -179,3 +426,37 @@ def check_good_filename(filename):
     bad_filenames = ['', '.']
     if filename in bad_filenames:
         raise OSError('Bad filename %s' % f)
+
+
+def add_to_submit_list(value, item, separator=',', quote=False):
+    """Add an item to the value of a submit command that is a list, e.g.
+    transfer_input_files, unless it is already there.
+
+    Parameters
+    ----------
+    value : str or None
+        Current value, e.g. from the user's other_args.
+
+    item : str
+        Item to add.
+
+    separator : str, optional
+        Separator between items.
+
+    quote : bool, optional
+        If True, the whole value is in double quotes, e.g. for
+        transfer_output_remaps. Any quotes around `value` are removed first.
+
+    Returns
+    -------
+    str
+        New value.
+    """
+    value = str(value or '').strip()
+    if quote and len(value) > 1 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    items = [x.strip() for x in value.split(separator) if x.strip()]
+    if item not in items:
+        items.append(item)
+    new_value = (separator + ' ' if quote else separator).join(items)
+    return '"%s"' % new_value if quote else new_value
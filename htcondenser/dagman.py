@@ -5,11 +5,15 @@ DAGMan class to handle DAGs in HTCondor.
 
 import logging
 import os
-from copy import deepcopy
-from subprocess import check_call
 from collections import OrderedDict
 import htcondenser as ht
 from htcondenser.common import date_time_now, check_dir_create, check_good_filename
+from htcondenser.local import LocalExecutor
+from htcondenser.backends import CondorCommandBackend
+from htcondenser.futures import DAGFuture
+from htcondenser.dedup import remove_duplicate_jobs, format_report as format_dedup_report
+from htcondenser.expansion import (generator_reference, write_spec, write_placeholder,
+                                   pre_script_command)
 
 
 log = logging.getLogger(__name__)
@@ -38,11 +42,20 @@ class DAGMan(object):
     other_args : dict, optional
         Dictionary of {variable: value} for other DAG options.
 
+    deduplicate : bool, optional
+        If True, when writing the DAG, Jobs that would do exactly the same as
+        an earlier Job (same executable, setup script, arguments, and input
+        files) are removed, and Jobs that need them use the earlier Job &
+        its output files instead. See htcondenser.dedup.remove_duplicate_jobs.
+
     Attributes
     ----------
     JOB_VAR_NAME : str
         Name of variable to hold job arguments string to pass to condor_worker.py,
         required in both DAG file and condor submit file.
+
+    dedup_report : dict
+        From the last removal of duplicate Jobs, if `deduplicate` is True.
     """
 
     # name of variable for individual condor submit files
@@ -53,7 +66,8 @@ class DAGMan(object):
                  status_file='jobs.status',
                  status_update_period=30,
                  dot=None,
-                 other_args=None):
+                 other_args=None,
+                 deduplicate=False):
         super(DAGMan, self).__init__()
         self.dag_filename = os.path.abspath(filename)
         if self.dag_filename.startswith('/users'):
@@ -62,10 +76,14 @@ class DAGMan(object):
         self.status_update_period = str(status_update_period)
         self.dot = dot
         self.other_args = other_args
+        self.deduplicate = deduplicate
+        self.dedup_report = None
         for f in [filename, status_file, dot]:
             check_good_filename(f)
         # hold info about Jobs. key is name, value is a dict
         self.jobs = OrderedDict()
+        # hold info about nodes whose Jobs are made when they run, see add_expansion()
+        self.expansions = OrderedDict()
 
     def __getitem__(self, i):
         if isinstance(i, int):
@@ -114,12 +132,17 @@ class DAGMan(object):
         if not isinstance(job, ht.Job):
             raise TypeError('Cannot added a non-Job object to DAGMan.')
 
-        if job.name in self.jobs:
+        if job.name in self.jobs or job.name in self.expansions:
             raise KeyError('Job with name %s already exists in DAG - names must be unique' % job.name)
 
         # Store any user opts.
         job_vars = job_vars or ""
 
+        hierarchy_list = self._requires_list(requires)
+        self.jobs[job.name] = dict(job=job, job_vars=job_vars, retry=retry, requires=hierarchy_list)
+
+    def _requires_list(self, requires):
+        """Get a list of job names from the `requires` argument of add_job()."""
         # Keep list of names of Jobs that must be executed before this one.
         hierarchy_list = []
         # requires can be:
@@ -142,8 +165,58 @@ class DAGMan(object):
                         raise TypeError('Can only add list of Jobs or list of job names')
             else:
                 raise TypeError('Can only add Job(s) or job name(s)')
+        return hierarchy_list
 
-        self.jobs[job.name] = dict(job=job, job_vars=job_vars, retry=retry, requires=hierarchy_list)
+    def add_expansion(self, name, generator, requires=None, retry=None):
+        """Add a node whose Jobs are only made once its parents have finished.
+
+        When the node is ready to run, its PRE script calls
+        ``generator(dag, inputs)`` with a new DAGMan for the node's Jobs, and
+        ``inputs``, a dict of {parent name: list of its output files on HDFS}.
+        The generator adds Jobs to the DAGMan as usual, e.g. one for each file
+        listed by a splitter Job, and that DAG then runs as a sub-DAG. Jobs
+        that require this node run once all of its Jobs have finished.
+
+        The generator is imported again in the PRE script, so it must be a
+        function at the top level of a module or script. For a script, any
+        code that makes & submits the DAG must be under
+        ``if __name__ == "__main__":``.
+
+        Parameters
+        ----------
+        name : str
+            Node name.
+
+        generator : callable or str
+            Function to add the Jobs, or 'module:function' or
+            '/path/to/script.py:function'.
+
+        requires : str, Job, iterable[str], iterable[Job], optional
+            Jobs (or names of Jobs or expansions) that must run first.
+
+        retry : int or str, optional
+            Number of retry attempts, each of which makes the Jobs again.
+
+        Raises
+        ------
+        KeyError
+            If a Job or expansion with that name is already in the DAG.
+
+        ValueError
+            If `generator` cannot be imported by name, e.g. a lambda.
+        """
+        if name in self.jobs or name in self.expansions:
+            raise KeyError('Job with name %s already exists in DAG - names must be unique' % name)
+        generator_reference(generator)
+        stem = os.path.join(os.path.dirname(self.dag_filename), name)
+        self.expansions[name] = dict(generator=generator, retry=retry,
+                                     requires=self._requires_list(requires),
+                                     dag_filename=stem + '.dag',
+                                     spec_filename=stem + '.expand.json')
+
+    def get_node(self, name):
+        """Get the info dict for a Job or expansion by name."""
+        return self.jobs[name] if name in self.jobs else self.expansions[name]
 
     def check_job_requirements(self, job):
         """Check that the required Jobs actually exist and have been added to DAG.
@@ -170,8 +243,8 @@ class DAGMan(object):
         else:
             log.debug(type(job))
             raise TypeError('job argument must be job name or Job object.')
-        req_jobs = set(self.jobs[job_name]['requires'])
-        all_jobs = set(self.jobs)
+        req_jobs = set(self.get_node(job_name)['requires'])
+        all_jobs = set(self.jobs) | set(self.expansions)
         if not req_jobs.issubset(all_jobs):
             raise KeyError('The following requirements on %s do not have corresponding '
                            'Job objects: %s' % (job_name, ', '.join(list(req_jobs - all_jobs))))
@@ -193,13 +266,13 @@ class DAGMan(object):
             If job has circular dependency.
         """
         job_name = job.name if isinstance(job, ht.Job) else job
-        parents = self.jobs[job_name]['requires']
+        parents = self.get_node(job_name)['requires']
         log.debug('Checking %s', job_name)
         log.debug(parents)
         while parents:
             new_parents = []
             for p in parents:
-                grandparents = self.jobs[p]['requires']
+                grandparents = self.get_node(p)['requires']
                 if job_name in grandparents:
                     raise RuntimeError("%s is in requirements for %s - cannot "
                                        "have cyclic dependencies" % (job_name, p))
@@ -240,16 +313,55 @@ class DAGMan(object):
         job_obj = self.jobs[job_name]['job']
         job_contents = ['JOB %s %s' % (job_name, job_obj.manager.filename)]
 
-        # Get their latest and greatest args
-        self.jobs[job_name]['job_vars'] += 'jobOpts="%s"' % job_obj.generate_job_arg_str()
-        job_contents.append('VARS %s %s' % (job_name, self.jobs[job_name]['job_vars']))
-
+        # Get their latest and greatest args, without storing them so the
+        # DAG can be written again
+        job_vars = self.jobs[job_name]['job_vars'] + 'jobOpts="%s"' % job_obj.generate_job_arg_str()
         job_retry = self.jobs[job_name]['retry']
+        # Pass the retry number to the submit file to raise resource requests
+        if job_retry and job_obj.manager.escalation:
+            job_vars += ' %s="$(RETRY)"' % job_obj.manager.escalation.RETRY_VAR_NAME
+        job_contents.append('VARS %s %s' % (job_name, job_vars))
+
         if job_retry:
             job_contents.append('RETRY %s %s' % (job_name, job_retry))
 
         return '\n'.join(job_contents)
 
+    def generate_expansion_str(self, name):
+        """Generate a string for an expansion node, for use in DAG file.
+
+        Parameters
+        ----------
+        name : str
+            Name of expansion.
+
+        Returns
+        -------
+        str
+            Sub-DAG listing, PRE script, and any RETRY, for DAG file.
+        """
+        expansion = self.expansions[name]
+        contents = ['SUBDAG EXTERNAL %s %s' % (name, expansion['dag_filename']),
+                    'SCRIPT PRE %s %s' % (name, pre_script_command(expansion['spec_filename']))]
+        if expansion['retry']:
+            contents.append('RETRY %s %s' % (name, expansion['retry']))
+        return '\n'.join(contents)
+
+    def write_expansions(self):
+        """Write the spec for each expansion's PRE script, and a placeholder
+        sub-DAG that does nothing until the PRE script replaces it."""
+        for name, expansion in self.expansions.iteritems():
+            inputs = OrderedDict()
+            for parent in expansion['requires']:
+                inputs[parent] = []
+                if parent in self.jobs:
+                    job = self.jobs[parent]['job']
+                    job.setup_output_file_mirrors(job.hdfs_mirror_dir)
+                    inputs[parent] = [mirror.hdfs for mirror in job.output_file_mirrors]
+            write_spec(expansion['spec_filename'], name, expansion['generator'],
+                       expansion['dag_filename'], inputs)
+            write_placeholder(expansion['dag_filename'])
+
     def generate_job_requirements_str(self, job):
         """Generate a string of prerequisite jobs for this job.
 
@@ -283,8 +395,9 @@ class DAGMan(object):
         self.check_job_requirements(job)
         self.check_job_acyclic(job)
 
-        if self.jobs[job_name]['requires']:
-            return 'PARENT %s CHILD %s' % (' '.join(self.jobs[job_name]['requires']), job_name)
+        requires = self.get_node(job_name)['requires']
+        if requires:
+            return 'PARENT %s CHILD %s' % (' '.join(requires), job_name)
         else:
             return ''
 
@@ -304,8 +417,11 @@ class DAGMan(object):
         for job in self.jobs:
             contents.append(self.generate_job_str(job))
 
+        for name in self.expansions:
+            contents.append(self.generate_expansion_str(name))
+
         # Add parent-child relationships
-        for job in self.jobs:
+        for job in list(self.jobs) + list(self.expansions):
             req_str = self.generate_job_requirements_str(job)
             if req_str != '':
                 contents.append(req_str)
@@ -343,17 +459,43 @@ class DAGMan(object):
 
     def write(self):
         """Write DAG to file and causes all Jobs to write their HTCondor submit files."""
+        if self.deduplicate:
+            self.dedup_report = remove_duplicate_jobs(self)
+            log.info(format_dedup_report(self.dedup_report))
         dag_contents = self.generate_dag_contents()
         log.info('Writing DAG to %s', self.dag_filename)
         check_dir_create(os.path.dirname(self.dag_filename))
         with open(self.dag_filename, 'w') as dfile:
             dfile.write(dag_contents)
 
+        self.write_expansions()
+
         # Write job files for each JobSet
         for manager in self.get_jobsets():
             manager.write(dag_mode=True)
 
-    def submit(self, force=False, submit_per_interval=10):
+    def run_local(self, processes=None, storage_root=None):
+        """Run the DAG on this machine instead of submitting it to HTCondor.
+
+        See htcondenser.local.LocalExecutor.
+
+        Parameters
+        ----------
+        processes : int, optional
+            Number of CPU cores to use. Defaults to all of them.
+
+        storage_root : str, optional
+            If set, store files for HDFS under this local directory instead.
+
+        Returns
+        -------
+        OrderedDict
+            {job name: exit code}, or None for jobs not run because a
+            parent failed.
+        """
+        return LocalExecutor(processes, storage_root).run_dag(self)
+
+    def submit(self, force=False, submit_per_interval=10, backend=None):
         """Write all necessary submit files, transfer files to HDFS, and submit DAG.
         Also prints out info for user.
 
@@ -363,6 +505,15 @@ class DAGMan(object):
             Force condor_submit_dag
         submit_per_interval : int, optional
             Number of DAGMan submissions per interval. The default 10 every 5 seconds.
+        backend : optional
+            How to submit, e.g. htcondenser.backends.PythonBindingsBackend.
+            Defaults to CondorCommandBackend, i.e. `condor_submit_dag`.
+
+        Returns
+        -------
+        DAGFuture
+            Follows the DAG nodes through the DAGMan logs, to wait for the
+            DAG to finish, get node return values, or add callbacks.
 
         Raises
         ------
@@ -372,12 +523,6 @@ class DAGMan(object):
         self.write()
         for manager in self.get_jobsets():
             manager.transfer_to_hdfs()
-        cmds = ['condor_submit_dag', self.dag_filename]
-        if force:
-            cmds.insert(1, '-f')
-        # modify the env vars to modify DAGMan config settings
-        # Not great, myabe should go for explciit config file instead?
-        mod_env = deepcopy(os.environ)
-        mod_env['_CONDOR_DAGMAN_MAX_SUBMITS_PER_INTERVAL'] = str(submit_per_interval)
-        check_call(cmds, env=mod_env)
+        result = (backend or CondorCommandBackend()).submit_dag(self, force, submit_per_interval)
         log.info('Check DAG status:\nDAGstatus %s', self.status_file)
+        return DAGFuture(self, result)
@@ -0,0 +1,251 @@
+"""
+Functions to find Jobs in a DAG that would do exactly the same thing, and
+keep only one of each, e.g. for DAGs made by scripts that add the same Job
+several times under different names.
+"""
+
+
+import logging
+import os
+import json
+import hashlib
+from collections import OrderedDict
+from htcondenser.userlog import LogAnalyzer, find_log_files
+
+
+log = logging.getLogger(__name__)
+
+
+def file_hash(filename, cache=None):
+    """Get the md5 hex digest of a local file, or just the filename if it
+    does not exist (e.g. an executable on the worker's PATH).
+
+    Parameters
+    ----------
+    filename : str
+
+    cache : dict, optional
+        Digests already calculated, keyed by (filename, size, mtime), so each
+        file is only read once. Only share this whilst files cannot change,
+        e.g. within one remove_duplicate_jobs().
+    """
+    if not filename or not os.path.isfile(filename):
+        return filename
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+    if cache is None or key not in cache:
+        md5 = hashlib.md5()
+        with open(filename, 'rb') as ffile:
+            for chunk in iter(lambda: ffile.read(1024 * 1024), b''):
+                md5.update(chunk)
+        if cache is None:
+            return md5.hexdigest()
+        cache[key] = md5.hexdigest()
+    return cache[key]
+
+
+def job_fingerprint(job, cache=None):
+    """Get a fingerprint that is the same for Jobs that do the same thing.
+
+    It covers the executable & setup script contents, the arguments, the
+    input files (as their original locations & names on the worker), the
+    common input files, the output files (by basename, unless given as a
+    location on HDFS) and their compression codecs, the JobSet's output
+    aggregation settings, other submit file settings (`other_args`, e.g.
+    environment), certificate & input decompression, and the quantity. It
+    does not cover the Job name, or resource requests.
+
+    Parameters
+    ----------
+    job : Job
+        Job, that must have been added to a JobSet.
+
+    cache : dict, optional
+        Passed to file_hash().
+
+    Returns
+    -------
+    str
+        md5 hex digest.
+    """
+    manager = job.manager
+    job.setup_input_file_mirrors(job.hdfs_mirror_dir)
+    inputs = [(os.path.abspath(m.original), m.worker) for m in job.input_file_mirrors
+              if m.original not in [manager.exe, manager.setup_script]]
+    outputs = [f if f.startswith('/hdfs') else os.path.basename(f) for f in job.output_files]
+    codecs = [job.get_output_codec(f) for f in job.output_files]
+    contents = [file_hash(manager.exe, cache), file_hash(manager.setup_script, cache),
+                manager.copy_exe, [str(a) for a in job.args], inputs, outputs, codecs,
+                [os.path.abspath(f) for f in manager.common_input_files],
+                manager.transfer_hdfs_input, manager.aggregate_outputs,
+                manager.aggregate_max_size if manager.aggregate_outputs else None,
+                sorted((str(k), str(v)) for k, v in (manager.other_job_args or {}).iteritems()),
+                manager.certificate, manager.decompress_inputs,
+                job.quantity]
+    return hashlib.md5(json.dumps(contents)).hexdigest()
+
+
+def topological_order(dag):
+    """Get the names of the Jobs in a DAG, with every Job after its parents.
+
+    Jobs are otherwise kept in the order they were added. Requirements that
+    are not in the DAG are ignored, and Jobs in a cycle are put at the end.
+    """
+    remaining = OrderedDict((name, set(p for p in info['requires'] if p in dag.jobs))
+                            for name, info in dag.jobs.iteritems())
+    order = []
+    done = set()
+    while remaining:
+        ready = [name for name, parents in remaining.iteritems() if parents <= done]
+        if not ready:
+            order.extend(remaining)
+            break
+        for name in ready:
+            del remaining[name]
+            done.add(name)
+        order.extend(ready)
+    return order
+
+
+def _ancestors(dag, name):
+    ancestors = set()
+    to_visit = list(dag.jobs[name]['requires'])
+    while to_visit:
+        parent = to_visit.pop()
+        if parent not in ancestors and parent in dag.jobs:
+            ancestors.add(parent)
+            to_visit.extend(dag.jobs[parent]['requires'])
+    return ancestors
+
+
+def _unique(items):
+    return list(OrderedDict.fromkeys(items))
+
+
+def _replace_paths(job, path_map):
+    """Point input files & arguments at the surviving copies of outputs."""
+    if path_map:
+        job.input_files = _unique(path_map.get(f, f) for f in job.input_files)
+        job.input_names = dict((path_map.get(f, f), n) for f, n in job.input_names.iteritems())
+        job.args = [path_map.get(a, a) if isinstance(a, str) else a for a in job.args]
+
+
+def mean_runtime(jobset, cache=None):
+    """Get the mean runtime in seconds of a JobSet's previous jobs, from their
+    user logs, or None if there are none.
+
+    `cache` can be a dict of results already found, keyed by JobSet filename,
+    so each JobSet's logs are only read once, e.g. within one
+    remove_duplicate_jobs().
+    """
+    if cache is not None and jobset.filename in cache:
+        return cache[jobset.filename]
+    analyzer = LogAnalyzer()
+    analyzer.add_logs(find_log_files(jobset))
+    runtime = analyzer.runtime.summary()['mean']
+    if cache is not None:
+        cache[jobset.filename] = runtime
+    return runtime
+
+
+def remove_duplicate_jobs(dag):
+    """Keep only the first of each set of identical Jobs in a DAG.
+
+    Jobs are compared with job_fingerprint(), parents first, so Jobs that
+    become identical once their parents are merged are merged too. A Job is
+    not merged into one it depends on. For each removed Job:
+
+    - Jobs that required it require the surviving Job instead.
+    - Its output files on HDFS are replaced by the surviving Job's outputs in
+      the input files & arguments of other Jobs.
+    - The surviving Job also requires its parents, and gets the larger retry.
+    - It is removed from its JobSet.
+
+    Parameters
+    ----------
+    dag : DAGMan
+
+    Returns
+    -------
+    dict
+        `jobs`: number of Jobs before, `removed`: number removed,
+        `duplicates`: {surviving Job name: [removed Job names]},
+        `hours_saved`: estimated core hours saved, from the mean runtime of
+        previous jobs of each removed Job's JobSet, and `unestimated`: the
+        number of removed Jobs with no previous runtimes.
+    """
+    n_jobs = len(dag.jobs)
+    survivors = {}
+    renamed = {}
+    path_map = {}
+    duplicates = OrderedDict()
+    hours_saved = 0.
+    unestimated = 0
+    # only for this call, as files & logs may change between calls
+    hashes = {}
+    runtimes = {}
+    for name in topological_order(dag):
+        info = dag.jobs[name]
+        job = info['job']
+        info['requires'] = _unique(renamed.get(p, p) for p in info['requires'])
+        _replace_paths(job, path_map)
+        fingerprint = job_fingerprint(job, hashes)
+        survivor = survivors.setdefault(fingerprint, name)
+        if survivor == name or survivor in _ancestors(dag, name):
+            continue
+
+        kept = dag.jobs[survivor]
+        kept['requires'] = _unique(kept['requires'] +
+                                   [p for p in info['requires'] if p != survivor])
+        if info['retry'] and int(info['retry']) > int(kept['retry'] or 0):
+            kept['retry'] = info['retry']
+        job.setup_output_file_mirrors(job.hdfs_mirror_dir)
+        kept['job'].setup_output_file_mirrors(kept['job'].hdfs_mirror_dir)
+        for old, new in zip(job.output_file_mirrors, kept['job'].output_file_mirrors):
+            if old.hdfs != new.hdfs:
+                path_map[old.hdfs] = new.hdfs
+        renamed[name] = survivor
+        duplicates.setdefault(survivor, []).append(name)
+        del dag.jobs[name]
+        job.manager.remove_job(job)
+
+        runtime = mean_runtime(job.manager, runtimes)
+        if runtime is None:
+            unestimated += 1
+        else:
+            hours_saved += runtime * job.manager.cpus * job.quantity / 3600.
+
+    # Jobs may use the outputs of a removed Job without requiring it
+    for info in dag.jobs.itervalues():
+        info['requires'] = _unique(renamed.get(p, p) for p in info['requires'])
+        _replace_paths(info['job'], path_map)
+    for info in dag.expansions.itervalues():
+        info['requires'] = _unique(renamed.get(p, p) for p in info['requires'])
+
+    return {
+        'jobs': n_jobs,
+        'removed': len(renamed),
+        'duplicates': duplicates,
+        'hours_saved': hours_saved,
+        'unestimated': unestimated,
+    }
+
+
+def format_report(report):
+    """Make a readable summary from remove_duplicate_jobs().
+
+    Parameters
+    ----------
+    report : dict
+        From remove_duplicate_jobs().
+
+    Returns
+    -------
+    str
+    """
+    text = 'Removed %d duplicate Jobs of %d' % (report['removed'], report['jobs'])
+    if report['removed']:
+        text += ', saving ~%.1f core hours' % report['hours_saved']
+        if report['unestimated']:
+            text += ' (plus %d Jobs with no previous runtimes)' % report['unestimated']
+    return text
@@ -0,0 +1,160 @@
+"""
+Functions for DAG nodes whose Jobs are only made once their parents have
+finished, by a user function that can look at the parents' output files,
+e.g. to make one Job per file written by a splitter Job.
+
+Each such node is a sub-DAG (SUBDAG EXTERNAL). Its PRE script, which DAGMan
+runs once all the node's parents have succeeded, calls the user's generator
+function to add Jobs to a new DAGMan, and writes it as the sub-DAG file.
+"""
+
+
+import logging
+import os
+import sys
+import imp
+import json
+import importlib
+from collections import OrderedDict
+import htcondenser as ht
+
+
+log = logging.getLogger(__name__)
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def generator_reference(generator):
+    """Get how to import a generator function from another process.
+
+    Parameters
+    ----------
+    generator : callable or str
+        Function at the top level of a module or script, or a string
+        'package.module:function' or '/path/to/script.py:function'.
+
+    Returns
+    -------
+    dict
+        `module` (name) or `path` (of a script), and `function` (name).
+
+    Raises
+    ------
+    ValueError
+        If `generator` cannot be imported by name, e.g. a lambda.
+    """
+    if isinstance(generator, basestring):
+        location, _, function = generator.rpartition(':')
+        if not location or not function:
+            raise ValueError("Generator must be 'module:function' or 'script.py:function'")
+        if location.endswith('.py'):
+            return dict(path=os.path.abspath(location), function=function)
+        return dict(module=location, function=function)
+
+    function = getattr(generator, '__name__', '')
+    module = getattr(generator, '__module__', None)
+    if not function or function == '<lambda>' or not module:
+        raise ValueError('Generator %r must be a function defined at the top level '
+                         'of a module or script' % generator)
+    if module == '__main__':
+        return dict(path=os.path.abspath(sys.modules['__main__'].__file__), function=function)
+    return dict(module=module, function=function)
+
+
+def load_generator(reference):
+    """Import a generator function from the output of generator_reference().
+
+    A script is loaded under another name, so that code in it under
+    `if __name__ == "__main__":` (e.g. submitting the DAG) is not run.
+    """
+    if 'path' in reference:
+        module = imp.load_source('htcondenser_generator', reference['path'])
+    else:
+        module = importlib.import_module(reference['module'])
+    return getattr(module, reference['function'])
+
+
+def write_spec(spec_filename, name, generator, dag_filename, inputs):
+    """Write what the PRE script needs to make a sub-DAG.
+
+    Parameters
+    ----------
+    spec_filename : str
+        JSON file to write.
+
+    name : str
+        Node name.
+
+    generator : callable or str
+        See generator_reference().
+
+    dag_filename : str
+        Sub-DAG file to write.
+
+    inputs : OrderedDict
+        {parent node name: list of its output files on HDFS}
+    """
+    reference = generator_reference(generator)
+    sys_path = [os.getcwd(), os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+    if 'path' in reference:
+        sys_path.insert(0, os.path.dirname(reference['path']))
+    spec = OrderedDict([('name', name), ('generator', reference), ('dag_filename', dag_filename),
+                        ('inputs', inputs), ('sys_path', list(OrderedDict.fromkeys(sys_path)))])
+    with open(spec_filename, 'w') as sfile:
+        json.dump(spec, sfile, indent=2)
+
+
+def write_placeholder(dag_filename):
+    """Write a sub-DAG with a single node that does nothing, to be replaced by
+    the PRE script. This lets the DAG be checked before it runs."""
+    stem = os.path.splitext(dag_filename)[0]
+    noop_filename = stem + '.noop.condor'
+    with open(noop_filename, 'w') as nfile:
+        nfile.write('universe = vanilla\nexecutable = /bin/true\nqueue\n')
+    with open(dag_filename, 'w') as dfile:
+        dfile.write('# Placeholder, replaced when the Jobs are made\n'
+                    'JOB placeholder %s NOOP\n' % noop_filename)
+
+
+def run_expansion(spec_filename):
+    """Make & write the sub-DAG for a node, from the spec written by write_spec().
+
+    The generator is called as generator(dag, inputs), with a new DAGMan to
+    add Jobs to, and {parent node name: list of its output files on HDFS}.
+    The DAG & its JobSets' submit files are then written, and their files
+    copied to HDFS. If the generator adds no Jobs, the sub-DAG has a single
+    node that does nothing.
+
+    Parameters
+    ----------
+    spec_filename : str
+
+    Returns
+    -------
+    DAGMan
+        The sub-DAG.
+    """
+    with open(spec_filename) as sfile:
+        spec = json.load(sfile, object_pairs_hook=OrderedDict)
+    generator = load_generator(spec['generator'])
+    dag_filename = str(spec['dag_filename'])
+    dag = ht.DAGMan(filename=dag_filename,
+                    status_file=os.path.splitext(dag_filename)[0] + '.status')
+    inputs = OrderedDict((str(k), [str(f) for f in v]) for k, v in spec['inputs'].iteritems())
+    generator(dag, inputs)
+    if not dag.jobs and not dag.expansions:
+        log.info('No Jobs made for %s', spec['name'])
+        write_placeholder(dag_filename)
+        return dag
+    log.info('Made %d Jobs for %s', len(dag.jobs), spec['name'])
+    dag.write()
+    for jobset in dag.get_jobsets():
+        jobset.transfer_to_hdfs()
+    return dag
+
+
+def pre_script_command(spec_filename):
+    """Get the DAGMan PRE script command to make the sub-DAG from a spec."""
+    return '%s %s %s' % (sys.executable, os.path.join(TEMPLATE_DIR, 'expand_dag.py'),
+                         spec_filename)
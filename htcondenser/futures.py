@@ -0,0 +1,555 @@
+"""
+Future-like handles for submitted JobSets and DAGs, that follow the state of
+each job or DAG node by tailing the HTCondor user logs, rather than querying
+the schedd with condor_q.
+
+Each poll only reads the events added to the logs since the last one, from
+the byte offset reached in each file, so many JobSets and DAGs can be
+followed from one process. The offsets & states can be saved to a JSON file,
+so a driver that is restarted carries on where it left off.
+"""
+
+
+import logging
+import os
+import json
+import time
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from htcondenser.local import expand_macros
+from htcondenser.userlog import (iter_log_events, DAG_NODE_RE, RETURN_VALUE_RE,
+                                 SUBMIT, EXECUTE, EVICTED, TERMINATED, ABORTED, HELD, RELEASED)
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+
+log = logging.getLogger(__name__)
+
+
+# States of a job or DAG node
+WAITING = 'waiting'  # DAG node not submitted yet
+IDLE = 'idle'
+RUNNING = 'running'
+HELD_STATE = 'held'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+REMOVED = 'removed'
+
+FINISHED_STATES = [SUCCEEDED, FAILED, REMOVED]
+
+
+class JobsFailed(RuntimeError):
+    """Raised by result() when jobs failed or were removed.
+
+    Attributes
+    ----------
+    failed : list[str]
+        Job IDs or DAG node names that did not succeed.
+    """
+
+    def __init__(self, message, failed):
+        super(JobsFailed, self).__init__(message)
+        self.failed = failed
+
+
+class WaitTimeout(RuntimeError):
+    """Raised when waiting for a future takes longer than its timeout."""
+    pass
+
+
+class LogFuture(object):
+    """Abstract base class for futures that follow jobs through user logs.
+
+    Subclasses must say which log files to read (log_files()), how each event
+    changes the state (add_event()), and when they are finished (finished()).
+
+    Parameters
+    ----------
+    state_file : str, optional
+        If set, load the offsets & states from this JSON file if it exists,
+        and save them to it after each poll that reads new events.
+
+    poll_interval : int, optional
+        Seconds between polls when waiting.
+
+    Attributes
+    ----------
+    status : OrderedDict
+        {job ID or node name: state}, e.g. RUNNING.
+
+    return_values : OrderedDict
+        {job ID or node name: return value} for finished jobs.
+
+    offsets : dict
+        {log filename: byte offset reached}.
+    """
+
+    __metaclass__ = ABCMeta
+
+    # Attributes saved to state_file
+    STATE_ATTRS = ['offsets', 'status', 'return_values']
+
+    def __init__(self, state_file=None, poll_interval=30):
+        super(LogFuture, self).__init__()
+        self.state_file = state_file
+        self.poll_interval = poll_interval
+        self.status = OrderedDict()
+        self.return_values = OrderedDict()
+        self.offsets = {}
+        self._done = False
+        self._callbacks = []
+
+    @abstractmethod
+    def log_files(self):
+        """Get the log filenames to read on the next poll."""
+        pass
+
+    @abstractmethod
+    def add_event(self, filename, event):
+        """Update the state with an event read from a log file."""
+        pass
+
+    @abstractmethod
+    def finished(self):
+        """Whether all the jobs have finished, according to the events read."""
+        pass
+
+    def failures(self):
+        """Get the job IDs or node names that did not succeed."""
+        return [name for name, state in self.status.iteritems() if state in [FAILED, REMOVED]]
+
+    def _update(self, name, event):
+        """Update the state of a job or node from one of its events."""
+        if event.code == SUBMIT or event.code == RELEASED or event.code == EVICTED:
+            self.status[name] = IDLE
+        elif event.code == EXECUTE:
+            self.status[name] = RUNNING
+        elif event.code == HELD:
+            self.status[name] = HELD_STATE
+        elif event.code == ABORTED:
+            self.status[name] = REMOVED
+        elif event.code == TERMINATED:
+            return_value = None
+            for line in event.body:
+                match = RETURN_VALUE_RE.search(line)
+                if match:
+                    return_value = int(match.group(1))
+            self.return_values[name] = return_value
+            self.status[name] = SUCCEEDED if return_value == 0 else FAILED
+
+    def poll(self):
+        """Read any new events from the logs.
+
+        Returns
+        -------
+        bool
+            Whether all the jobs have finished.
+        """
+        if self._done:
+            return True
+        n_events = 0
+        for filename in self.log_files():
+            if not os.path.isfile(filename):
+                continue
+            for event, offset in iter_log_events(filename, self.offsets.get(filename, 0)):
+                self.add_event(filename, event)
+                self.offsets[filename] = offset
+                n_events += 1
+        if n_events and self.state_file:
+            self.save()
+        if self.finished():
+            self._done = True
+            for callback in self._callbacks:
+                self._run_callback(callback)
+        return self._done
+
+    def done(self):
+        """Whether all the jobs have finished. Reads any new events first."""
+        return self.poll()
+
+    def counts(self):
+        """Get the number of jobs or nodes in each state.
+
+        Returns
+        -------
+        OrderedDict
+            {state: number}
+        """
+        counts = OrderedDict()
+        for state in self.status.itervalues():
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def wait(self, timeout=None):
+        """Wait until all the jobs have finished.
+
+        Parameters
+        ----------
+        timeout : int, optional
+            Seconds to wait for. By default wait forever.
+
+        Raises
+        ------
+        WaitTimeout
+            If the jobs have not finished after `timeout` seconds.
+        """
+        end = time.time() + timeout if timeout is not None else None
+        while not self.poll():
+            if end is not None and time.time() >= end:
+                raise WaitTimeout('Jobs not finished after %s seconds' % timeout)
+            time.sleep(self.poll_interval if end is None
+                       else max(0, min(self.poll_interval, end - time.time())))
+
+    def exception(self, timeout=None):
+        """Wait until all the jobs have finished, and get the error if any
+        did not succeed.
+
+        Returns
+        -------
+        JobsFailed or None
+        """
+        self.wait(timeout)
+        failed = self.failures()
+        if failed:
+            return JobsFailed('%d jobs did not succeed: %s' % (len(failed), ', '.join(failed)),
+                              failed)
+        return None
+
+    def result(self, timeout=None):
+        """Wait until all the jobs have finished, and get their return values.
+
+        Parameters
+        ----------
+        timeout : int, optional
+            Seconds to wait for. By default wait forever.
+
+        Returns
+        -------
+        OrderedDict
+            {job ID or node name: return value}
+
+        Raises
+        ------
+        JobsFailed
+            If any jobs did not succeed.
+
+        WaitTimeout
+            If the jobs have not finished after `timeout` seconds.
+        """
+        exc = self.exception(timeout)
+        if exc:
+            raise exc
+        return self.return_values
+
+    def add_done_callback(self, fn):
+        """Call fn(future) once all the jobs have finished.
+
+        It is called from poll(), so something has to be polling, e.g.
+        wait(), as_completed(), or an asyncio loop via to_asyncio().
+        If already finished, fn is called straight away.
+        """
+        if self._done:
+            self._run_callback(fn)
+        else:
+            self._callbacks.append(fn)
+
+    def _run_callback(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            log.exception('Exception in callback %s', fn)
+
+    def to_asyncio(self, loop=None):
+        """Get an asyncio Future for this, that can be awaited.
+
+        The logs are polled every `poll_interval` seconds by the event loop.
+        Needs asyncio (Python 3) or its Python 2 backport trollius.
+
+        Parameters
+        ----------
+        loop : optional
+            Event loop. Defaults to the current one.
+
+        Returns
+        -------
+        asyncio.Future
+            Gets the result() or the exception() once all jobs have finished.
+
+        Raises
+        ------
+        ImportError
+            If neither asyncio or trollius is installed.
+        """
+        if asyncio is None:
+            raise ImportError('to_asyncio() needs asyncio or trollius: pip install trollius')
+        loop = loop or asyncio.get_event_loop()
+        future = asyncio.Future(loop=loop)
+
+        def check():
+            if future.cancelled():
+                return
+            if not self.poll():
+                loop.call_later(self.poll_interval, check)
+                return
+            exc = self.exception()
+            if exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(self.return_values)
+
+        loop.call_soon(check)
+        return future
+
+    def save(self, state_file=None):
+        """Save offsets & states to a JSON file, by default `state_file`."""
+        state_file = state_file or self.state_file
+        state = dict((name, getattr(self, name)) for name in self.STATE_ATTRS)
+        tmp_file = state_file + '.tmp'
+        with open(tmp_file, 'w') as sfile:
+            json.dump(state, sfile)
+        os.rename(tmp_file, state_file)
+
+    def load(self, state_file=None):
+        """Load offsets & states from a JSON file, by default `state_file`."""
+        with open(state_file or self.state_file) as sfile:
+            state = json.load(sfile, object_pairs_hook=OrderedDict)
+        for name in self.STATE_ATTRS:
+            value = state[name]
+            setattr(self, name, dict(value) if name == 'offsets' else value)
+        self._done = self.finished()
+
+    def _load_if_saved(self):
+        if self.state_file and os.path.isfile(self.state_file):
+            self.load()
+
+
+class JobSetFuture(LogFuture):
+    """Future for the jobs of a submitted JobSet, from its user logs.
+
+    Parameters
+    ----------
+    jobset : JobSet
+        JobSet that was submitted.
+
+    results : SubmitResult or list[SubmitResult]
+        IDs of the submitted jobs, e.g. from each cluster submitted.
+
+    state_file : str, optional
+        If set, load & save the offsets & states with this JSON file.
+
+    poll_interval : int, optional
+        Seconds between polls when waiting.
+
+    Attributes
+    ----------
+    names : OrderedDict
+        {job ID: Job name}
+
+    submit_results : list[SubmitResult]
+    """
+
+    def __init__(self, jobset, results, state_file=None, poll_interval=30):
+        super(JobSetFuture, self).__init__(state_file, poll_interval)
+        self.jobset = jobset
+        self.submit_results = results if isinstance(results, list) else [results]
+        self.names = OrderedDict()
+        for result in self.submit_results:
+            self.names.update(zip(result.job_ids, result.names))
+            for job_id in result.job_ids:
+                self.status[job_id] = IDLE
+        self._load_if_saved()
+
+    def __repr__(self):
+        return 'JobSetFuture(%s, %s)' % (self.jobset.filename, dict(self.counts()))
+
+    @property
+    def job_ids(self):
+        """List of cluster.process IDs."""
+        return list(self.status)
+
+    def log_files(self):
+        """Get the user logs of jobs that have not finished."""
+        pattern = os.path.join(self.jobset.log_dir, self.jobset.log_file)
+        files = OrderedDict()
+        for job_id, state in self.status.iteritems():
+            if state not in FINISHED_STATES:
+                cluster, process = job_id.split('.')
+                files[expand_macros(pattern, cluster, process)] = True
+        return list(files)
+
+    def add_event(self, filename, event):
+        if event.job_id in self.status:
+            self._update(event.job_id, event)
+
+    def finished(self):
+        return all(state in FINISHED_STATES for state in self.status.itervalues())
+
+    def results_by_name(self):
+        """Get the return values by Job name.
+
+        Returns
+        -------
+        OrderedDict
+            {Job name: [return value of each job]}
+        """
+        values = OrderedDict()
+        for job_id, name in self.names.iteritems():
+            values.setdefault(name, []).append(self.return_values.get(job_id))
+        return values
+
+
+class DAGFuture(LogFuture):
+    """Future for a submitted DAG, from the DAGMan logs.
+
+    Node states come from the node jobs' events in the DAG's nodes log
+    (``<DAG file>.nodes.log``), and the DAG is finished when the DAGMan job
+    itself finishes, according to ``<DAG file>.dagman.log``.
+
+    Parameters
+    ----------
+    dag : DAGMan
+        DAG that was submitted.
+
+    result : SubmitResult
+        ID of the DAGMan job.
+
+    state_file : str, optional
+        If set, load & save the offsets & states with this JSON file.
+
+    poll_interval : int, optional
+        Seconds between polls when waiting.
+
+    Attributes
+    ----------
+    status : OrderedDict
+        {node name: state}. Nodes not yet submitted are WAITING.
+
+    dagman_status : str
+        State of the DAGMan job.
+    """
+
+    STATE_ATTRS = LogFuture.STATE_ATTRS + ['node_names', 'dagman_status']
+
+    def __init__(self, dag, result, state_file=None, poll_interval=30):
+        super(DAGFuture, self).__init__(state_file, poll_interval)
+        self.dag = dag
+        self.submit_result = result
+        self.dagman_id = result.job_ids[0]
+        self.nodes_log = dag.dag_filename + '.nodes.log'
+        self.dagman_log = dag.dag_filename + '.dagman.log'
+        # {job ID: node name}, from the submit events
+        self.node_names = {}
+        self.dagman_status = IDLE
+        for name in list(dag.jobs) + list(dag.expansions):
+            self.status[name] = WAITING
+        self._load_if_saved()
+
+    def __repr__(self):
+        return 'DAGFuture(%s, %s)' % (self.dag.dag_filename, dict(self.counts()))
+
+    def log_files(self):
+        return [self.nodes_log, self.dagman_log]
+
+    def add_event(self, filename, event):
+        if filename == self.dagman_log:
+            if event.job_id == self.dagman_id:
+                self.dagman_status = self._dagman_state(event)
+            return
+        if event.code == SUBMIT:
+            for line in event.body:
+                match = DAG_NODE_RE.match(line)
+                if match:
+                    self.node_names[event.job_id] = match.group(1)
+        name = self.node_names.get(event.job_id)
+        if name:
+            self._update(name, event)
+
+    def _dagman_state(self, event):
+        if event.code == TERMINATED:
+            match = [RETURN_VALUE_RE.search(line) for line in event.body]
+            return_values = [int(m.group(1)) for m in match if m]
+            return SUCCEEDED if return_values and return_values[0] == 0 else FAILED
+        elif event.code == ABORTED:
+            return REMOVED
+        elif event.code == EXECUTE:
+            return RUNNING
+        return self.dagman_status
+
+    def finished(self):
+        return self.dagman_status in FINISHED_STATES
+
+    def failures(self):
+        """Get the nodes that did not succeed, if the DAG did not succeed."""
+        if self.dagman_status == SUCCEEDED:
+            return []
+        return ([name for name, state in self.status.iteritems() if state != SUCCEEDED] or
+                [os.path.basename(self.dag.dag_filename)])
+
+
+def wait(futures, timeout=None, poll_interval=30):
+    """Wait until all futures have finished, polling each in turn.
+
+    Parameters
+    ----------
+    futures : iterable[LogFuture]
+
+    timeout : int, optional
+        Seconds to wait for. By default wait forever.
+
+    poll_interval : int, optional
+        Seconds between polling all the futures.
+
+    Returns
+    -------
+    list[LogFuture], list[LogFuture]
+        Finished & not finished futures.
+    """
+    futures = list(futures)
+    done = []
+    for future in as_completed(futures, timeout, poll_interval, raise_timeout=False):
+        done.append(future)
+    return done, [f for f in futures if f not in done]
+
+
+def as_completed(futures, timeout=None, poll_interval=30, raise_timeout=True):
+    """Iterate over futures as they finish, polling the unfinished ones in turn.
+
+    Parameters
+    ----------
+    futures : iterable[LogFuture]
+
+    timeout : int, optional
+        Seconds to wait for. By default wait forever.
+
+    poll_interval : int, optional
+        Seconds between polling all the futures.
+
+    raise_timeout : bool, optional
+        Raise WaitTimeout if not all finished after `timeout`, otherwise
+        just stop.
+
+    Yields
+    ------
+    LogFuture
+    """
+    pending = list(futures)
+    end = time.time() + timeout if timeout is not None else None
+    while pending:
+        for future in pending[:]:
+            if future.poll():
+                pending.remove(future)
+                yield future
+        if not pending:
+            break
+        if end is not None and time.time() >= end:
+            if raise_timeout:
+                raise WaitTimeout('%d futures not finished after %s seconds'
+                                  % (len(pending), timeout))
+            break
+        time.sleep(poll_interval if end is None
+                   else max(0, min(poll_interval, end - time.time())))
@@ -6,7 +6,8 @@ Classes to describe individual job, as part of a JobSet.
 import logging
 import os
 import htcondenser as ht
-from htcondenser.common import cp_hdfs, check_dir_create
+from htcondenser.common import (cp_hdfs, check_dir_create, check_codec,
+                                strip_codec_suffix, COMPRESSION_CODECS)
 from itertools import chain
 
 
@@ -46,6 +47,16 @@ class Job(object):
         use `hdfs_mirror_dir`/self.name, where `hdfs_mirror_dir` is taken
         from the manager. If the directory does not exist, it is created.
 
+    output_codec : str or dict, optional
+        Compression codec for output files, overriding the managing JobSet's
+        `output_codec`. Can also be a dict of {output file: codec}, in which
+        case any output file not in the dict uses the JobSet's codec.
+
+    input_names : dict, optional
+        Names for input files on the worker (and in `hdfs_mirror_dir`, if not
+        on HDFS), as {input file: name}. Any input file not in the dict keeps
+        its basename. Use this to transfer input files that share a basename.
+
     Raises
     ------
     KeyError
@@ -55,11 +66,14 @@ class Job(object):
     TypeError
         If the user tries to assign a manager that is not of type JobSet
         (or a derived class).
+
+    ValueError
+        If `output_codec` contains an unsupported codec.
     """
 
     def __init__(self, name, args=None,
                  input_files=None, output_files=None,
-                 quantity=1, hdfs_mirror_dir=None):
+                 quantity=1, hdfs_mirror_dir=None, output_codec=None, input_names=None):
         super(Job, self).__init__()
         self._manager = None
         self.name = str(name)
@@ -79,6 +93,10 @@ class Job(object):
         self.input_file_mirrors = []  # input original, mirror on HDFS, and worker
         self.output_file_mirrors = []  # output mirror on HDFS, and worker
         self.hdfs_mirror_dir = hdfs_mirror_dir
+        for codec in (output_codec.values() if isinstance(output_codec, dict) else [output_codec]):
+            check_codec(codec)
+        self.output_codec = output_codec
+        self.input_names = dict(input_names or {})
 
     def __eq__(self, other):
         return self.name == other.name
@@ -111,6 +129,12 @@ class Job(object):
         self.setup_input_file_mirrors(self.hdfs_mirror_dir)
         self.setup_output_file_mirrors(self.hdfs_mirror_dir)
 
+    @property
+    def output_archive(self):
+        """Location of the archive of small output files, if the managing
+        JobSet uses aggregate_outputs."""
+        return os.path.join(self.hdfs_mirror_dir, self.name + '.outputs.zip')
+
     def setup_input_file_mirrors(self, hdfs_mirror_dir):
         """Attach a mirror HDFS location for each non-HDFS input file.
         Also attaches a location for the worker node, incase the user wishes to
@@ -127,17 +151,41 @@ class Job(object):
         """
         mirrors = []
         for ifile in self.input_files:
-            basename = os.path.basename(ifile)
+            name = self.input_names.get(ifile, os.path.basename(ifile))
             mirror_dir = hdfs_mirror_dir
             if (ifile in [self.manager.exe, self.manager.setup_script] and
                     self.manager.share_exe_setup):
                 mirror_dir = self.manager.hdfs_store
             hdfs_mirror = (ifile if ifile.startswith('/hdfs')
-                           else os.path.join(mirror_dir, basename))
-            mirror = ht.FileMirror(original=ifile, hdfs=hdfs_mirror, worker=basename)
+                           else os.path.join(mirror_dir, name))
+            worker = name
+            if (self.manager.decompress_inputs and self.manager.transfer_hdfs_input and
+                    ifile not in [self.manager.exe, self.manager.setup_script]):
+                worker = strip_codec_suffix(name)
+            mirror = ht.FileMirror(original=ifile, hdfs=hdfs_mirror, worker=worker)
             mirrors.append(mirror)
         self.input_file_mirrors = mirrors
 
+    def get_output_codec(self, ofile):
+        """Get the compression codec for an output file.
+
+        Parameters
+        ----------
+        ofile : str
+            Output file, as in `output_files`.
+
+        Returns
+        -------
+        str or None
+            Codec name, or None for no compression.
+        """
+        codec = self.output_codec
+        if isinstance(codec, dict):
+            codec = codec.get(ofile)
+        if codec is None:
+            codec = self.manager.output_codec
+        return codec
+
     def setup_output_file_mirrors(self, hdfs_mirror_dir):
         """Attach a mirror HDFS location for each output file.
 
@@ -153,6 +201,10 @@ class Job(object):
             # ... else join(hdfs_mirror_dir, ofile) ?
             hdfs_mirror = (ofile if ofile.startswith('/hdfs')
                            else os.path.join(hdfs_mirror_dir, basename))
+            # add the codec suffix so the worker knows to compress
+            codec = self.get_output_codec(ofile)
+            if codec and not hdfs_mirror.endswith(COMPRESSION_CODECS[codec]):
+                hdfs_mirror += COMPRESSION_CODECS[codec]
             # set worker copy depending on if it's on hdfs or not, since we
             # can't stream to it.
             if ofile.startswith('/hdfs'):
@@ -190,6 +242,29 @@ class Job(object):
     def generate_job_arg_str(self):
         """Generate arg string to pass to the condor_worker.py script.
 
+        If the managing JobSet uses a manifest file, this only points the
+        worker to this Job's entry in the manifest. Otherwise it is the
+        full list of arguments from generate_job_arg_list().
+
+        Returns
+        -------
+        str:
+            Argument string for the job, to be passed to condor_worker.py
+
+        """
+        if self.manager.manifest:
+            job_args = ['--manifest', os.path.basename(self.manager.manifest_filename),
+                        '--index', self.manager.job_index(self)]
+        else:
+            job_args = self.generate_job_arg_list()
+
+        # Convert everything to str, and convert double quotes properly
+        job_args = [str(x).replace('"', '""') for x in job_args]
+        return ' '.join(job_args)
+
+    def generate_job_arg_list(self):
+        """Generate list of args to pass to the condor_worker.py script.
+
         This includes the user's args (in `self.args`), but also includes options
         for input and output files, and automatically updating the args to
         account for new locations on HDFS or worker node. It also includes
@@ -197,8 +272,8 @@ class Job(object):
 
         Returns
         -------
-        str:
-            Argument string for the job, to be passed to condor_worker.py
+        list[str]:
+            Arguments for the job, to be passed to condor_worker.py
 
         """
         job_args = []
@@ -243,6 +318,20 @@ class Job(object):
                     new_args[i] = ofile.worker
             job_args.extend(['--copyFromLocal', ofile.worker, ofile.hdfs])
 
+        if self.manager.overlap_stage_out and self.output_file_mirrors:
+            job_args.append('--overlapStageOut')
+
+        if self.manager.telemetry:
+            job_args.extend(['--telemetry', self.manager.TELEMETRY_FILE])
+
+        if self.manager.aggregate_outputs and self.output_file_mirrors:
+            job_args.extend(['--aggregate', self.output_archive,
+                             '--aggregateMaxSize', self.manager.aggregate_max_size])
+
+        job_args.extend(['--retries', self.manager.transfer_retries,
+                         '--retryDelay', self.manager.transfer_retry_delay,
+                         '--verify', self.manager.verify_transfers])
+
         # Add the exe
         job_args.extend(['--exe', os.path.basename(self.manager.exe)])
 
@@ -251,6 +340,4 @@ class Job(object):
             job_args.append('--args')
             job_args.extend(new_args)
 
-        # Convert everything to str, and convert double quotes properly
-        job_args = [str(x).replace('"', '""') for x in job_args]
-        return ' '.join(job_args)
+        return [str(x) for x in job_args]
@@ -6,8 +6,13 @@ Class to describe groups of jobs sharing common settings, that becomes one condo
 import logging
 import os
 import re
-from subprocess import check_call
-from htcondenser.common import cp_hdfs, check_certificate, check_dir_create, check_good_filename
+import json
+from htcondenser.common import (cp_hdfs, check_certificate, check_dir_create,
+                                check_good_filename, check_codec, add_to_submit_list)
+from htcondenser.tuning import ResourceTuner
+from htcondenser.local import LocalExecutor
+from htcondenser.backends import CondorCommandBackend, ShardSubmitter
+from htcondenser.futures import JobSetFuture
 from collections import OrderedDict
 import htcondenser as ht
 
@@ -95,6 +100,83 @@ class JobSet(object):
         Dictionary of other job options to write to HTCondor submit file.
         These will be added in **before** any arguments or jobs.
 
+    overlap_stage_out : bool, optional
+        If True, output files are uploaded to HDFS in the background as soon
+        as they are complete, whilst the executable is still running.
+        Any remaining files are uploaded, and all sizes checked, once the
+        executable has finished.
+
+    telemetry : bool, optional
+        If True, each job writes a JSON record of its phase timings, bytes
+        transferred per file, and resource usage from `/usr/bin/time -v`.
+        This is stored next to the job's log file, with the extension
+        `.telemetry.json`. See htcondenser.telemetry to read these back.
+        The record is added to any `transfer_output_files` &
+        `transfer_output_remaps` in `other_args`.
+
+    manifest : bool, optional
+        If True, the full arguments for every job are written to a manifest
+        file alongside the submit file (see `manifest_filename`), which is
+        transferred to each job, along with any `transfer_input_files` in
+        `other_args`. Each job's arguments then only point to
+        its entry in the manifest, keeping submit and DAG files small
+        regardless of the number of input/output files.
+
+    aggregate_outputs : bool, optional
+        If True, output files of `aggregate_max_size` bytes or smaller are
+        put into a single archive per job, `Job.output_archive`, instead of
+        being copied to HDFS individually. This reduces the number of files
+        on HDFS. Use htcondenser.aggregate.OutputArchive to read them back.
+
+    aggregate_max_size : int, optional
+        Size in bytes of the largest output file to put in the archive.
+
+    output_codec : str, optional
+        Compress output files with this codec as they are copied to HDFS.
+        One of common.COMPRESSION_CODECS, e.g. 'gzip' or 'zstd'.
+        The codec's suffix (e.g. .gz) is added to the HDFS filename.
+        Can be overridden for each Job. The default is no compression.
+
+    decompress_inputs : bool, optional
+        If True, input files on HDFS with a codec suffix (e.g. .gz) are
+        decompressed when copied to the worker node, and the executable
+        gets the filename without the suffix. Requires `transfer_hdfs_input`.
+
+    transfer_retries : int, optional
+        Number of times the worker retries a failed input or output file
+        transfer, with exponential backoff, before giving up.
+
+    transfer_retry_delay : float, optional
+        Seconds to wait before the first retry. Doubles for each retry.
+
+    verify_transfers : str, optional
+        How the worker checks each transferred file: 'none', 'size', or
+        'md5'. Checking costs a `hadoop fs` call per file, and 'md5' reads
+        the whole of each file back. With 'md5', output files that are
+        already on HDFS with the same checksum (e.g. from a previous
+        attempt) are not copied again.
+
+    autotune : bool or dict, optional
+        If True, each time the submit file is written the `cpus`, `memory`,
+        and `disk` requests are replaced by ones recommended from the usage
+        of this JobSet's previous jobs, and a report of the expected savings
+        is logged. A dict is passed as options to
+        htcondenser.tuning.ResourceTuner, e.g. {'percentile': 99}.
+        Requests with too few jobs measured are left as given.
+
+    escalation : EscalationPolicy, optional
+        If set, jobs that use more memory or disk than requested are held and
+        released (or retried, in a DAG) with a larger request, up to a cap,
+        and jobs running far longer than expected are removed. Any
+        periodic_release or periodic_remove in `other_args` still applies.
+        See htcondenser.policy.EscalationPolicy.
+
+    shard_size : int, optional
+        If set, and there are more jobs than this, the jobs are also written
+        to several submit files ("shards") of at most this many jobs each,
+        which submit() submits as separate clusters in parallel. Each shard
+        is recorded as it is submitted, so only failed shards need resubmitting.
+
     Raises
     ------
     OSError
@@ -103,8 +185,23 @@ class JobSet(object):
     OSError
         If any of `out_dir`, `err_dir`, `log_dir`, `hdfs_store` cannot be created.
 
+    ValueError
+        If `output_codec` is not a supported codec.
+
+    ValueError
+        If `verify_transfers` is not one of 'none', 'size', 'md5'.
+
+    Attributes
+    ----------
+    TELEMETRY_FILE : str
+        Name of the telemetry file written by condor_worker.py on the worker
+        node, before it is transferred back by HTCondor.
+
     """
 
+    # name of telemetry file on the worker node
+    TELEMETRY_FILE = 'htcondenser_telemetry.json'
+
     def __init__(self,
                  exe,
                  copy_exe=True,
@@ -120,7 +217,20 @@ class JobSet(object):
                  common_input_files=None,
                  hdfs_store=None,
                  dag_mode=False,
-                 other_args=None):
+                 other_args=None,
+                 overlap_stage_out=False,
+                 telemetry=False,
+                 manifest=False,
+                 aggregate_outputs=False,
+                 aggregate_max_size=1024 * 1024,
+                 output_codec=None,
+                 decompress_inputs=False,
+                 transfer_retries=3,
+                 transfer_retry_delay=5,
+                 verify_transfers='none',
+                 autotune=False,
+                 escalation=None,
+                 shard_size=None):
         super(JobSet, self).__init__()
         self.exe = exe
         self.copy_exe = copy_exe
@@ -152,8 +262,28 @@ class JobSet(object):
         # self.dag_mode = dag_mode
         self.job_template = os.path.join(os.path.dirname(__file__), 'templates/job.condor')
         self.other_job_args = other_args
+        self.overlap_stage_out = overlap_stage_out
+        self.telemetry = telemetry
+        self.manifest = manifest
+        self.aggregate_outputs = aggregate_outputs
+        self.aggregate_max_size = int(aggregate_max_size)
+        check_codec(output_codec)
+        self.output_codec = output_codec
+        self.decompress_inputs = decompress_inputs
+        self.transfer_retries = int(transfer_retries)
+        self.transfer_retry_delay = float(transfer_retry_delay)
+        if verify_transfers not in ['none', 'size', 'md5']:
+            raise ValueError("verify_transfers must be one of 'none', 'size', 'md5'")
+        self.verify_transfers = verify_transfers
+        self.autotune = autotune
+        self.escalation = escalation
+        self.shard_size = int(shard_size) if shard_size else None
+        # (submit filename, list of Jobs) for each shard, set by write()
+        self.shards = []
         # Hold all Job object this JobSet manages, key is Job name.
         self.jobs = OrderedDict()
+        # Position of each Job in self.jobs, key is Job name.
+        self.job_indices = {}
 
         # Setup directories
         # ---------------------------------------------------------------------
@@ -179,6 +309,41 @@ class JobSet(object):
     def __len__(self):
         return len(self.jobs)
 
+    @property
+    def telemetry_file(self):
+        """Filename that each job's telemetry record is transferred back to.
+
+        Contains the same HTCondor macros as `log_file`, e.g. $(cluster).
+        """
+        stem = os.path.splitext(self.log_file)[0]
+        return os.path.join(self.log_dir, stem + '.telemetry.json')
+
+    @property
+    def manifest_filename(self):
+        """Filename of the manifest holding each job's arguments."""
+        return os.path.splitext(self.filename)[0] + '.manifest.jsonl'
+
+    @property
+    def shard_state_filename(self):
+        """Filename of the record of which shards have been submitted."""
+        return os.path.splitext(self.filename)[0] + '.shards.json'
+
+    def job_index(self, job):
+        """Get the position of a Job in this JobSet.
+
+        Parameters
+        ----------
+        job : Job or str
+            Job object or name of Job.
+
+        Returns
+        -------
+        int
+            Position of Job, which is also its entry in the manifest file.
+        """
+        name = job.name if isinstance(job, ht.Job) else job
+        return self.job_indices[name]
+
     def setup_common_input_file_mirrors(self, hdfs_mirror_dir):
         """Attach a mirror HDFS location for each non-HDFS input file.
         Also attaches a location for the worker node, incase the user wishes to
@@ -222,25 +387,105 @@ class JobSet(object):
         if job.name in self.jobs:
             raise KeyError('Job %s already exists in JobSet' % job.name)
 
+        self.job_indices[job.name] = len(self.jobs)
         self.jobs[job.name] = job
         job.manager = self
 
+    def remove_job(self, job):
+        """Remove a Job from this JobSet.
+
+        Parameters
+        ----------
+        job : Job or str
+            Job object or name of Job.
+
+        Raises
+        ------
+        KeyError
+            If this JobSet does not have a Job with that name.
+        """
+        name = job.name if isinstance(job, ht.Job) else job
+        del self.jobs[name]
+        self.job_indices = dict((n, i) for i, n in enumerate(self.jobs))
+
     def write(self, dag_mode):
         """Write jobs to HTCondor job file."""
 
         self.setup_common_input_file_mirrors(self.hdfs_store)
 
+        if self.autotune:
+            options = self.autotune if isinstance(self.autotune, dict) else {}
+            ResourceTuner(self, **options).apply()
+
         with open(self.job_template) as tfile:
             template = tfile.read()
 
-        file_contents = self.generate_file_contents(template, dag_mode)
+        n_procs = sum(job.quantity for job in self.jobs.itervalues())
+        sharded = not dag_mode and self.shard_size and n_procs > self.shard_size
+        file_contents = self.generate_file_contents(template, dag_mode,
+                                                    jobs=[] if sharded else None)
+        if sharded:
+            self.write_shards(file_contents)
+            file_contents += ''.join(self.generate_job_entry(job)
+                                     for job in self.jobs.itervalues())
+        else:
+            self.shards = [(self.filename, self.jobs.values())]
 
         log.info('Writing HTCondor job file to %s', self.filename)
         check_dir_create(os.path.dirname(os.path.realpath(self.filename)))
         with open(self.filename, 'w') as jfile:
             jfile.write(file_contents)
 
-    def generate_file_contents(self, template, dag_mode=False):
+        if self.manifest:
+            self.write_manifest()
+
+    def write_shards(self, header):
+        """Write the jobs to submit files of at most `shard_size` jobs each.
+
+        Parameters
+        ----------
+        header : str
+            Submit file contents common to all jobs.
+        """
+        groups = [[]]
+        n_procs = 0
+        for job in self.jobs.itervalues():
+            if groups[-1] and n_procs + job.quantity > self.shard_size:
+                groups.append([])
+                n_procs = 0
+            groups[-1].append(job)
+            n_procs += job.quantity
+
+        stem, ext = os.path.splitext(self.filename)
+        self.shards = []
+        log.info('Writing %d HTCondor job files of up to %d jobs to %s.shard*%s',
+                 len(groups), self.shard_size, stem, ext)
+        check_dir_create(os.path.dirname(os.path.realpath(self.filename)))
+        for i, jobs in enumerate(groups):
+            shard_filename = '%s.shard%d%s' % (stem, i, ext)
+            with open(shard_filename, 'w') as sfile:
+                sfile.write(header)
+                sfile.write(''.join(self.generate_job_entry(job) for job in jobs))
+            self.shards.append((shard_filename, jobs))
+
+    def write_manifest(self):
+        """Write the arguments for every job to the manifest file.
+
+        Each line is the JSON list of arguments for the job at that position.
+        The worker only needs to read up to its own line.
+        """
+        log.info('Writing job manifest to %s', self.manifest_filename)
+        with open(self.manifest_filename, 'w') as mfile:
+            for job in self.jobs.itervalues():
+                mfile.write(json.dumps(job.generate_job_arg_list(), separators=(',', ':')))
+                mfile.write('\n')
+
+    def generate_job_entry(self, job):
+        """Get the arguments & queue statement for a Job, for the submit file."""
+        return '\n# %s\narguments="%s"\n\nqueue %d\n' % (job.name, job.generate_job_arg_str(),
+                                                         job.quantity)
+
+    def generate_file_contents(self, template, dag_mode=False, jobs=None):
         """Create a job file contents from a template, replacing necessary fields
         and adding in all jobs with necessary arguments.
 
@@ -257,6 +502,10 @@ class JobSet(object):
             This is so it can be used in a DAG. Otherwise, the submit file will
             specify each Job attached to this JobSet.
 
+        jobs : list[Job], optional
+            Jobs to add, if not all of them, e.g. an empty list for just
+            the submit commands common to all jobs.
+
         Returns
         -------
         str
@@ -288,9 +537,35 @@ class JobSet(object):
                 self.other_job_args = dict()
             self.other_job_args['use_x509userproxy'] = 'True'
 
-        if self.other_job_args:
+        # Update other_job_args if manifest, to transfer it to each job
+        if self.manifest:
+            if not self.other_job_args:
+                self.other_job_args = dict()
+            self.other_job_args['transfer_input_files'] = add_to_submit_list(
+                self.other_job_args.get('transfer_input_files'), self.manifest_filename)
+
+        # Update other_job_args if telemetry, to transfer the record back
+        if self.telemetry:
+            if not self.other_job_args:
+                self.other_job_args = dict()
+            self.other_job_args['transfer_output_files'] = add_to_submit_list(
+                self.other_job_args.get('transfer_output_files'), self.TELEMETRY_FILE)
+            self.other_job_args['transfer_output_remaps'] = add_to_submit_list(
+                self.other_job_args.get('transfer_output_remaps'),
+                '%s = %s' % (self.TELEMETRY_FILE, self.telemetry_file), separator=';', quote=True)
+
+        # Add options to hold/release/remove jobs if escalation, only to
+        # this submit file, so the user's options are kept as they are
+        other_args = self.other_job_args
+        memory, disk = self.memory, self.disk
+        if self.escalation:
+            other_args = self.escalation.merge_submit_args(self, self.other_job_args)
+            memory = self.escalation.memory_expr(self.memory)
+            disk = self.escalation.disk_expr(self.disk)
+
+        if other_args:
             other_args_str = '\n'.join('%s = %s' % (str(k), str(v))
-                                       for k, v in self.other_job_args.iteritems())
+                                       for k, v in other_args.iteritems())
         else:
             other_args_str = None
 
@@ -301,8 +576,8 @@ class JobSet(object):
             'STDERR': os.path.join(self.err_dir, self.err_file),
             'STDLOG': os.path.join(self.log_dir, self.log_file),
             'CPUS': str(self.cpus),
-            'MEMORY': self.memory,
-            'DISK': self.disk,
+            'MEMORY': memory,
+            'DISK': disk,
             'OTHER_ARGS': other_args_str
         }
 
@@ -317,10 +592,8 @@ class JobSet(object):
             template += 'queue\n'
         else:
             # specifiy each job in submit file
-            for name, job in self.jobs.iteritems():
-                template += '\n# %s\n' % name
-                template += 'arguments="%s"\n' % job.generate_job_arg_str()
-                template += '\nqueue %d\n' % job.quantity
+            for job in (self.jobs.itervalues() if jobs is None else jobs):
+                template += self.generate_job_entry(job)
 
         # Check we haven't left any unused tokens in the template.
         # If we have, then remove them.
@@ -358,7 +631,27 @@ class JobSet(object):
         for job in self.jobs.itervalues():
             job.transfer_to_hdfs()
 
-    def submit(self, force=False):
+    def run_local(self, processes=None, storage_root=None):
+        """Run all jobs on this machine instead of submitting them to HTCondor.
+
+        See htcondenser.local.LocalExecutor.
+
+        Parameters
+        ----------
+        processes : int, optional
+            Number of CPU cores to use. Defaults to all of them.
+
+        storage_root : str, optional
+            If set, store files for HDFS under this local directory instead.
+
+        Returns
+        -------
+        OrderedDict
+            {job name: exit code}
+        """
+        return LocalExecutor(processes, storage_root).run_jobset(self)
+
+    def submit(self, force=False, backend=None, submitters=4, resume=False):
         """Write HTCondor job file, copy necessary files to HDFS, and submit.
         Also prints out info for user.
 
@@ -367,18 +660,41 @@ class JobSet(object):
         force : bool, optional
             Force condor_submit
 
+        backend : optional
+            How to submit, e.g. htcondenser.backends.PythonBindingsBackend.
+            Defaults to CondorCommandBackend, i.e. `condor_submit`.
+
+        submitters : int, optional
+            Number of shards to submit at once, if `shard_size` is set.
+            See htcondenser.backends.ShardSubmitter.
+
+        resume : bool, optional
+            If True, only submit the shards that have not already been
+            submitted, according to `shard_state_filename`.
+
+        Returns
+        -------
+        JobSetFuture
+            Follows the jobs through their user logs, to wait for them to
+            finish, get their return values, or add callbacks.
+
         Raises
         ------
         CalledProcessError
             If condor_submit returns non-zero exit code.
+
+        RuntimeError
+            If any shards could not be submitted.
         """
         self.write(dag_mode=False)
         self.transfer_to_hdfs()
 
-        cmds = ['condor_submit', self.filename]
-        if force:
-            cmds.insert(1, '-f')
-        check_call(cmds)
+        backend = backend or CondorCommandBackend()
+        if len(self.shards) > 1:
+            submitter = ShardSubmitter(backend, submitters)
+            result = submitter.submit(self.shards, force, self.shard_state_filename, resume)
+        else:
+            result = backend.submit_jobset(self, force)
 
         if self.log_dir == self.out_dir == self.err_dir:
             log.info('Output/error/htcondor logs written to %s', self.out_dir)
@@ -387,3 +703,4 @@ class JobSet(object):
                          'STDERR': self.err_dir,
                          'HTCondor log': self.log_dir}:
                 log.info('%s written to %s', t, d)
+        return JobSetFuture(self, result)
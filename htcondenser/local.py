@@ -0,0 +1,345 @@
+"""
+Class to run a JobSet or DAG on the local machine instead of submitting it to
+HTCondor, e.g. to test it, or for small workloads.
+"""
+
+
+import logging
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import itertools
+import Queue
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from subprocess import call
+from htcondenser.common import check_dir_create
+from htcondenser.expansion import run_expansion
+
+
+log = logging.getLogger(__name__)
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def expand_macros(filename, cluster, process):
+    """Replace the $(cluster) & $(process) macros in a filename or argument."""
+    values = {'cluster': str(cluster), 'process': str(process)}
+    return re.sub(r'\$\((\w+)\)', lambda m: values.get(m.group(1).lower(), m.group(0)), filename)
+
+
+class LocalExecutor(object):
+    """Run the jobs of a JobSet or DAG on this machine, without HTCondor.
+
+    Each job runs condor_worker.py with the same arguments as it would get on
+    a worker node, in its own temporary directory, with up to `processes`
+    jobs at once. Each job takes as many of these as its JobSet's `cpus`.
+    STDOUT, STDERR, the user log, and the telemetry record are written to
+    the same places as when run by HTCondor, using local cluster IDs.
+
+    In a DAG, jobs only start once all their parents have succeeded, and
+    failed jobs are run again up to their `retry` number of times.
+    Children of jobs that still fail are not run. Expansions (see
+    DAGMan.add_expansion()) make their Jobs, then run them as a DAG.
+
+    Parameters
+    ----------
+    processes : int, optional
+        Number of CPU cores to use. Defaults to all of them.
+
+    storage_root : str, optional
+        If set, files on HDFS (/hdfs/...) are instead stored under this local
+        directory, by stand-in `hadoop` & `hdfs` commands put first on the PATH. This
+        must be used around making the JobSets too, if their `hdfs_store` is
+        on HDFS: see storage(). Otherwise the real `hadoop` command is used.
+    """
+
+    def __init__(self, processes=None, storage_root=None):
+        super(LocalExecutor, self).__init__()
+        self.processes = processes or multiprocessing.cpu_count()
+        self.storage_root = os.path.abspath(storage_root) if storage_root else None
+        self.worker_script = os.path.join(TEMPLATE_DIR, 'condor_worker.py')
+        self._clusters = itertools.count(int(time.time()))
+        self._log_lock = threading.Lock()
+        self._storage_lock = threading.Lock()
+        self._storage_depth = 0
+        self._bin_dir = None
+        self._old_env = None
+
+    @contextmanager
+    def storage(self):
+        """Context manager to use `storage_root` in place of HDFS, for both
+        this process & the jobs it runs. Does nothing if it is not set.
+
+        It can be nested, e.g. by expansions running in other threads: only
+        the outermost call makes the stand-in commands & changes os.environ.
+        """
+        if not self.storage_root:
+            yield
+            return
+        with self._storage_lock:
+            if self._storage_depth == 0:
+                self._start_storage()
+            self._storage_depth += 1
+        try:
+            yield
+        finally:
+            with self._storage_lock:
+                self._storage_depth -= 1
+                if self._storage_depth == 0:
+                    self._stop_storage()
+
+    def _start_storage(self):
+        """Make the stand-in `hadoop` & `hdfs` commands, and put them on the PATH."""
+        check_dir_create(self.storage_root)
+        self._bin_dir = tempfile.mkdtemp(prefix='htcondenser_bin_')
+        for name in ['hadoop', 'hdfs']:
+            command = os.path.join(self._bin_dir, name)
+            with open(command, 'w') as cfile:
+                cfile.write('#!/bin/sh\nexec "%s" "%s" "$@"\n'
+                            % (sys.executable, os.path.join(TEMPLATE_DIR, 'local_hadoop.py')))
+            os.chmod(command, 0755)
+        self._old_env = dict((k, os.environ.get(k)) for k in ['PATH', 'HTCONDENSER_STORAGE_ROOT'])
+        os.environ.update(self._storage_env(self._old_env))
+
+    def _stop_storage(self):
+        """Undo _start_storage()."""
+        for k, v in self._old_env.iteritems():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        shutil.rmtree(self._bin_dir)
+        self._bin_dir = None
+        self._old_env = None
+
+    def _storage_env(self, env):
+        """Get a copy of the environment `env` that uses `storage_root` in
+        place of HDFS, if in storage(). Otherwise it is unchanged."""
+        env = dict((k, v) for k, v in env.iteritems() if v is not None)
+        if self._bin_dir:
+            old_path = self._old_env.get('PATH') or ''
+            env['PATH'] = self._bin_dir + os.pathsep + old_path
+            env['HTCONDENSER_STORAGE_ROOT'] = self.storage_root
+        return env
+
+    def new_cluster(self):
+        """Get a new cluster ID."""
+        return next(self._clusters)
+
+    def run_jobset(self, jobset):
+        """Write files for, and run all the jobs in, a JobSet.
+
+        Parameters
+        ----------
+        jobset : JobSet
+
+        As with HTCondor, a Job with a `quantity` of N runs N times, and all
+        the jobs share a cluster ID, with process IDs counted across the
+        whole JobSet.
+
+        Returns
+        -------
+        OrderedDict
+            {job name: exit code}. For a Job with a `quantity` above 1, each
+            run is named <job name>.<n>, with n from 0.
+        """
+        with self.storage():
+            jobset.write(dag_mode=False)
+            jobset.transfer_to_hdfs()
+            cluster = self.new_cluster()
+            nodes = OrderedDict()
+            process = itertools.count()
+            for job in jobset.jobs.itervalues():
+                for index in range(job.quantity):
+                    name = job.name if job.quantity == 1 else '%s.%d' % (job.name, index)
+                    nodes[name] = dict(job=job, parents=[], retry=0, cluster=cluster,
+                                       process=next(process), quantity=1, dag_node=None)
+            return self._execute(nodes)
+
+    def run_dag(self, dag):
+        """Write files for, and run all the jobs in, a DAG.
+
+        Parameters
+        ----------
+        dag : DAGMan
+
+        Returns
+        -------
+        OrderedDict
+            {job name: exit code}, or None for jobs not run because a
+            parent failed. A Job with a `quantity` above 1 runs that many
+            times in one cluster, and its exit code is the first non-zero one.
+            An expansion's exit code is 0 if all its Jobs succeeded.
+        """
+        with self.storage():
+            dag.write()
+            for jobset in dag.get_jobsets():
+                jobset.transfer_to_hdfs()
+            nodes = OrderedDict()
+            for name, info in dag.jobs.iteritems():
+                nodes[name] = dict(job=info['job'], parents=info['requires'],
+                                   retry=int(info['retry'] or 0),
+                                   cluster=None, process=0, quantity=info['job'].quantity,
+                                   dag_node=name)
+            for name, info in dag.expansions.iteritems():
+                nodes[name] = dict(job=None, parents=info['requires'],
+                                   retry=int(info['retry'] or 0), expansion=info['spec_filename'])
+            return self._execute(nodes)
+
+    def _execute(self, nodes):
+        """Run nodes once their parents have succeeded, retrying failures.
+
+        Parameters
+        ----------
+        nodes : OrderedDict
+            {name: dict(job, parents, retry, cluster, process, quantity, dag_node)}.
+            A cluster of None gets a new cluster ID for every attempt. The
+            `quantity` processes from `process` run one after another.
+        """
+        results = OrderedDict((name, None) for name in nodes)
+        done = set()
+        attempts = dict((name, 0) for name in nodes)
+        pending = OrderedDict(nodes)
+        finished = Queue.Queue()
+        free_cpus = self.processes
+        running = 0
+        while pending or running:
+            for name, node in pending.items():
+                cpus = min(node['job'].manager.cpus if node['job'] else 1, self.processes)
+                if cpus > free_cpus or any(p not in done for p in node['parents']):
+                    continue
+                del pending[name]
+                attempts[name] += 1
+                free_cpus -= cpus
+                running += 1
+                thread = threading.Thread(target=self._run_node, args=(name, node, cpus, finished))
+                thread.daemon = True
+                thread.start()
+            if not running:
+                raise RuntimeError('Cannot run jobs: %s' % ', '.join(pending))
+            name, cpus, exit_code = finished.get()
+            free_cpus += cpus
+            running -= 1
+            node = nodes[name]
+            if exit_code != 0 and attempts[name] <= node['retry']:
+                log.warning('%s failed with exit code %d, retrying', name, exit_code)
+                pending[name] = node
+                continue
+            results[name] = exit_code
+            if exit_code == 0:
+                done.add(name)
+            else:
+                self._remove_children(name, pending)
+        failed = [node_name for node_name, code in results.iteritems() if code != 0]
+        if failed:
+            log.warning('%d of %d jobs failed or did not run: %s',
+                        len(failed), len(results), ', '.join(failed))
+        else:
+            log.info('All %d jobs succeeded', len(results))
+        return results
+
+    def _remove_children(self, name, pending):
+        """Remove all descendants of a failed job from pending."""
+        for child, node in pending.items():
+            if child in pending and name in node['parents']:
+                log.warning('Not running %s as %s failed', child, name)
+                del pending[child]
+                self._remove_children(child, pending)
+
+    def _run_node(self, name, node, cpus, finished):
+        exit_code = -1
+        try:
+            if node.get('expansion'):
+                exit_code = self.run_expansion(node['expansion'])
+            else:
+                cluster = node['cluster'] or self.new_cluster()
+                exit_code = 0
+                for process in xrange(node['process'], node['process'] + node['quantity']):
+                    code = self.run_job(node['job'], cluster, process, node['dag_node'])
+                    exit_code = exit_code or code
+        except Exception as exc:
+            log.exception('Error running %s: %s', name, exc)
+        finally:
+            finished.put((name, cpus, exit_code))
+
+    def run_expansion(self, spec_filename):
+        """Make the Jobs of an expansion, and run them as a DAG.
+
+        Returns
+        -------
+        int
+            0 if all the Jobs succeeded, otherwise 1.
+        """
+        dag = run_expansion(spec_filename)
+        if not dag.jobs and not dag.expansions:
+            return 0
+        results = self.run_dag(dag)
+        return 0 if all(code == 0 for code in results.itervalues()) else 1
+
+    def run_job(self, job, cluster, process, dag_node=None):
+        """Run one Job, and wait for it to finish.
+
+        Parameters
+        ----------
+        job : Job
+            Job to run.
+
+        cluster : int
+            Cluster ID, for output filenames & the user log.
+
+        process : int
+            Process ID.
+
+        dag_node : str, optional
+            Name of DAG node, for the user log.
+
+        Returns
+        -------
+        int
+            Exit code of condor_worker.py.
+        """
+        jobset = job.manager
+        stdout = expand_macros(os.path.join(jobset.out_dir, jobset.out_file), cluster, process)
+        stderr = expand_macros(os.path.join(jobset.err_dir, jobset.err_file), cluster, process)
+        user_log = expand_macros(os.path.join(jobset.log_dir, jobset.log_file), cluster, process)
+        job_id = '(%03d.%03d.000)' % (cluster, process)
+        submit_body = ['    DAG Node: %s' % dag_node] if dag_node else []
+        self.log_event(user_log, '000', job_id, 'Job submitted from host: <local>', submit_body)
+
+        sandbox = tempfile.mkdtemp(prefix='htcondenser_job_')
+        try:
+            job_ad = os.path.join(sandbox, '.job.ad')
+            with open(job_ad, 'w') as afile:
+                afile.write('ClusterId = %d\nProcId = %d\n' % (cluster, process))
+            env = dict(self._storage_env(os.environ), _CONDOR_JOB_AD=job_ad,
+                       _CONDOR_SCRATCH_DIR=sandbox)
+            cmd = [sys.executable, self.worker_script] + [
+                expand_macros(str(arg), cluster, process) for arg in job.generate_job_arg_list()]
+            log.debug('Running %s in %s', cmd, sandbox)
+            self.log_event(user_log, '001', job_id, 'Job executing on host: <local>')
+            with open(stdout, 'w') as ofile, open(stderr, 'w') as efile:
+                exit_code = call(cmd, cwd=sandbox, stdout=ofile, stderr=efile, env=env)
+            telemetry = os.path.join(sandbox, jobset.TELEMETRY_FILE)
+            if jobset.telemetry and os.path.isfile(telemetry):
+                shutil.move(telemetry, expand_macros(jobset.telemetry_file, cluster, process))
+        finally:
+            shutil.rmtree(sandbox)
+        self.log_event(user_log, '005', job_id, 'Job terminated.',
+                       ['\t(1) Normal termination (return value %d)' % exit_code])
+        return exit_code
+
+    def log_event(self, filename, code, job_id, text, body=None):
+        """Append an event to a user log, in the same format as HTCondor."""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        lines = ['%s %s %s %s' % (code, job_id, now, text)] + (body or []) + ['...']
+        with self._log_lock:
+            with open(filename, 'a') as lfile:
+                lfile.write('\n'.join(lines) + '\n')
@@ -0,0 +1,201 @@
+"""
+Class to add a tree of merge jobs to a DAG, that combines the output files of
+many jobs a few at a time, e.g. with hadd, instead of in one long job.
+"""
+
+
+import logging
+import os
+from fnmatch import fnmatch
+import htcondenser as ht
+
+
+log = logging.getLogger(__name__)
+
+
+def split_evenly(items, n_groups):
+    """Split items into n_groups consecutive groups, whose sizes differ by at most 1."""
+    size, extra = divmod(len(items), n_groups)
+    groups = []
+    start = 0
+    for i in xrange(n_groups):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+
+class MergeTree(object):
+    """Balanced tree of merge Jobs, each merging at most `fan_in` files.
+
+    The output files of the parent Jobs are merged by the first level of
+    merge Jobs, whose outputs are merged by the next level, and so on until
+    one Job writes `output`. For N files there are ceil(log_k(N)) levels,
+    with k = `fan_in`, so the merging takes that many short jobs in a row
+    instead of one very long job.
+
+    Each merge Job gets its input files as input_files, and its output file
+    as an output_file, so the merge executable only needs to read & write
+    local files, e.g. `hadd output.root 0_input.root 1_input.root ...`.
+    Each input file is named on the worker with its index in the Job as a
+    prefix, so parent outputs with the same basename don't overwrite each
+    other.
+
+    Parameters
+    ----------
+    merge_jobset : JobSet
+        JobSet for the merge Jobs, whose executable does the merging,
+        e.g. JobSet(exe='hadd', copy_exe=False, ...).
+
+    output : str
+        Final merged file. If it is not on HDFS, it is put in the final merge
+        Job's HDFS mirror directory.
+
+    fan_in : int, optional
+        Largest number of files each merge Job merges.
+
+    args : list[str], optional
+        Arguments for each merge Job. '{output}' is replaced by the output
+        file, and '{inputs}' by the input files, one argument each.
+        Defaults to ['{output}', '{inputs}'], as for hadd.
+
+    name : str, optional
+        Stem for the names of the merge Jobs, e.g. merge_1_0 is the first
+        Job of the first level. Also used to name intermediate files.
+
+    cleanup_jobset : JobSet, optional
+        If set, a Job from this JobSet deletes the intermediate files merged
+        by each merge Job, once that has succeeded, e.g.
+        JobSet(exe='rm', copy_exe=False, ...).
+
+    cleanup_args : list[str], optional
+        Arguments for each cleanup Job. '{files}' is replaced by the files to
+        delete, one argument each, as /hdfs/... paths. Defaults to ['{files}'].
+
+    cleanup_parent_outputs : bool, optional
+        If True, the cleanup Jobs also delete the parent Jobs' output files
+        once they have been merged.
+
+    retry : int, optional
+        Number of retries for each merge & cleanup Job in the DAG.
+
+    Raises
+    ------
+    ValueError
+        If `fan_in` is less than 2.
+
+    Attributes
+    ----------
+    levels : list[list[Job]]
+        Merge Jobs in each level, set by add_to_dag().
+
+    cleanup_jobs : list[Job]
+        Cleanup Jobs, set by add_to_dag().
+    """
+
+    def __init__(self, merge_jobset, output, fan_in=10, args=None, name='merge',
+                 cleanup_jobset=None, cleanup_args=None, cleanup_parent_outputs=False,
+                 retry=None):
+        super(MergeTree, self).__init__()
+        if int(fan_in) < 2:
+            raise ValueError('fan_in must be at least 2')
+        self.merge_jobset = merge_jobset
+        self.output = output
+        self.fan_in = int(fan_in)
+        self.args = args or ['{output}', '{inputs}']
+        self.name = name
+        self.cleanup_jobset = cleanup_jobset
+        self.cleanup_args = cleanup_args or ['{files}']
+        self.cleanup_parent_outputs = cleanup_parent_outputs
+        self.retry = retry
+        self.levels = []
+        self.cleanup_jobs = []
+
+    @property
+    def depth(self):
+        """Number of levels of merge Jobs."""
+        return len(self.levels)
+
+    @staticmethod
+    def _format(template, replacements):
+        return [x for arg in template for x in replacements.get(arg, [arg])]
+
+    def intermediate_filename(self, level, index):
+        """Get the HDFS filename for the output of a merge Job that is not the last."""
+        ext = os.path.splitext(self.output)[1]
+        return os.path.join(self.merge_jobset.hdfs_store, self.name,
+                            '%s_%d_%d%s' % (self.name, level, index, ext))
+
+    def add_to_dag(self, dag, parents, pattern='*'):
+        """Add the merge (& cleanup) Jobs to a DAG.
+
+        Parameters
+        ----------
+        dag : DAGMan
+            DAG that the parent Jobs are already in.
+
+        parents : JobSet or list[Job]
+            Jobs whose output files are merged.
+
+        pattern : str, optional
+            Only merge the output files whose names match this, e.g. '*.root'.
+
+        Returns
+        -------
+        Job
+            Final merge Job, that writes `output`.
+
+        Raises
+        ------
+        ValueError
+            If the parents have no output files matching `pattern`.
+        """
+        if isinstance(parents, ht.JobSet):
+            parents = parents.jobs.values()
+        # (HDFS filename, name of Job that makes it)
+        items = [(mirror.hdfs, job.name) for job in parents
+                 for mirror in job.output_file_mirrors if fnmatch(mirror.original, pattern)]
+        if not items:
+            raise ValueError('No output files matching %s to merge' % pattern)
+
+        n_files = len(items)
+        self.levels = []
+        self.cleanup_jobs = []
+        level = 1
+        while not self.levels or len(items) > 1:
+            n_groups = -(-len(items) // self.fan_in)
+            last = n_groups == 1
+            jobs = []
+            new_items = []
+            for index, group in enumerate(split_evenly(items, n_groups)):
+                output = self.output if last else self.intermediate_filename(level, index)
+                job = self._add_merge_job(dag, '%s_%d_%d' % (self.name, level, index),
+                                          group, output, first_level=level == 1)
+                jobs.append(job)
+                new_items.append((job.output_file_mirrors[0].hdfs, job.name))
+            self.levels.append(jobs)
+            items = new_items
+            level += 1
+
+        log.info('Merging %d files with %d Jobs in %d levels',
+                 n_files, sum(len(jobs) for jobs in self.levels), self.depth)
+        return self.levels[-1][0]
+
+    def _add_merge_job(self, dag, name, group, output, first_level):
+        inputs = [filename for filename, _ in group]
+        input_names = dict((f, '%d_%s' % (i, os.path.basename(f))) for i, f in enumerate(inputs))
+        args = self._format(self.args, {'{output}': [output], '{inputs}': inputs})
+        job = ht.Job(name=name, args=args, input_files=inputs, output_files=[output],
+                     input_names=input_names)
+        self.merge_jobset.add_job(job)
+        requires = sorted(set(parent for _, parent in group))
+        dag.add_job(job, requires=requires, retry=self.retry)
+
+        to_delete = inputs if (self.cleanup_parent_outputs or not first_level) else []
+        if self.cleanup_jobset is not None and to_delete:
+            cleanup = ht.Job(name='%s_cleanup' % name,
+                             args=self._format(self.cleanup_args, {'{files}': to_delete}))
+            self.cleanup_jobset.add_job(cleanup)
+            dag.add_job(cleanup, requires=job, retry=self.retry)
+            self.cleanup_jobs.append(cleanup)
+        return job
@@ -0,0 +1,203 @@
+"""
+Class to make the submit file expressions that raise a JobSet's memory &
+disk requests each time a job is retried or released from hold, and remove
+jobs that run far longer than expected.
+"""
+
+
+import logging
+from collections import OrderedDict
+from htcondenser.tuning import parse_size
+from htcondenser.userlog import LogAnalyzer, find_log_files
+
+
+log = logging.getLogger(__name__)
+
+
+class EscalationPolicy(object):
+    """Raise memory & disk requests on each retry or release, up to a cap.
+
+    Each attempt requests the JobSet's request times `memory_factor` (or
+    `disk_factor`) to the power of the number of previous attempts, i.e. the
+    DAG retry number plus the number of times the job has been held.
+
+    Jobs that use more than they request are held, and released again with
+    the raised request up to `max_releases` times, after which they are
+    removed. In a DAG, the node is then retried (with `DAGMan.add_job(retry=N)`)
+    with a larger request again.
+
+    Jobs that run for longer than `max_runtime` are removed. If that is not
+    given, it is `runtime_factor` times the 99th percentile runtime of the
+    JobSet's previous jobs, once at least `min_jobs` have finished.
+
+    Parameters
+    ----------
+    memory_factor : float, optional
+        Factor to raise the memory request by each time.
+
+    max_memory : str, optional
+        Largest memory to request, e.g. '8GB'. Defaults to 4 times the JobSet's
+        memory request.
+
+    disk_factor : float, optional
+        Factor to raise the disk request by each time.
+
+    max_disk : str, optional
+        Largest disk to request. Defaults to 4 times the JobSet's disk request.
+
+    max_releases : int, optional
+        Number of times a job held for exceeding its request is released.
+
+    max_runtime : int, optional
+        Seconds a job can run for before it is removed.
+
+    runtime_factor : float, optional
+        Multiple of the 99th percentile runtime of previous jobs to use if
+        `max_runtime` is not given. Set to None to not remove long jobs.
+
+    min_jobs : int, optional
+        Number of previous jobs needed to use their runtime.
+
+    Attributes
+    ----------
+    HOLD_SUBCODE : int
+        HoldReasonSubCode of jobs held by this policy.
+
+    RETRY_VAR_NAME : str
+        Name of the submit variable holding the DAG retry number.
+    """
+
+    HOLD_SUBCODE = 42
+    RETRY_VAR_NAME = 'htcRetry'
+
+    def __init__(self, memory_factor=1.5, max_memory=None, disk_factor=1.5, max_disk=None,
+                 max_releases=2, max_runtime=None, runtime_factor=3, min_jobs=10):
+        super(EscalationPolicy, self).__init__()
+        if memory_factor < 1 or disk_factor < 1:
+            raise ValueError('memory_factor and disk_factor must be >= 1')
+        self.memory_factor = memory_factor
+        self.max_memory = max_memory
+        self.disk_factor = disk_factor
+        self.max_disk = max_disk
+        self.max_releases = int(max_releases)
+        self.max_runtime = max_runtime
+        self.runtime_factor = runtime_factor
+        self.min_jobs = min_jobs
+
+    def _request_expr(self, base, factor, cap):
+        attempts = ('$(%s:0) + ifThenElse(isUndefined(NumHolds), 0, NumHolds)'
+                    % self.RETRY_VAR_NAME)
+        return 'min({int(%d * pow(%g, %s)), %d})' % (base, factor, attempts, cap)
+
+    def memory_expr(self, memory):
+        """Get the request_memory expression, in MB.
+
+        Parameters
+        ----------
+        memory : str
+            JobSet memory request, e.g. '2GB'.
+        """
+        base = parse_size(memory, 'M') // 1024
+        cap = parse_size(self.max_memory, 'M') // 1024 if self.max_memory else 4 * base
+        return self._request_expr(base, self.memory_factor, max(cap, base))
+
+    def disk_expr(self, disk):
+        """Get the request_disk expression, in KB.
+
+        Parameters
+        ----------
+        disk : str
+            JobSet disk request, e.g. '100MB'.
+        """
+        base = parse_size(disk, 'K')
+        cap = parse_size(self.max_disk, 'K') if self.max_disk else 4 * base
+        return self._request_expr(base, self.disk_factor, max(cap, base))
+
+    def expected_max_runtime(self, jobset):
+        """Get the seconds a job can run for before it is removed, or None.
+
+        Parameters
+        ----------
+        jobset : JobSet
+            JobSet whose previous jobs' user logs are read, if `max_runtime`
+            was not given.
+        """
+        if self.max_runtime or not self.runtime_factor:
+            return self.max_runtime
+        analyzer = LogAnalyzer()
+        analyzer.add_logs(find_log_files(jobset))
+        if analyzer.runtime.count < self.min_jobs:
+            log.info('Only %d previous jobs for %s, not limiting runtime',
+                     analyzer.runtime.count, jobset.filename)
+            return None
+        max_runtime = int(self.runtime_factor * analyzer.runtime.percentile(99))
+        log.info('Removing jobs in %s that run for more than %d seconds',
+                 jobset.filename, max_runtime)
+        return max_runtime
+
+    def submit_args(self, jobset):
+        """Get the periodic hold, release & remove options for a JobSet.
+
+        Parameters
+        ----------
+        jobset : JobSet
+
+        Returns
+        -------
+        OrderedDict
+            {option: value} to add to the submit file.
+        """
+        exceeded = ('(MemoryUsage =!= undefined && MemoryUsage > RequestMemory) || '
+                    '(DiskUsage =!= undefined && DiskUsage > RequestDisk)')
+        # 34 is HTCondor's own hold for exceeding the memory limit
+        held_for_usage = ('(JobStatus == 5 && (HoldReasonCode =?= 34 || '
+                          '(HoldReasonCode =?= 3 && HoldReasonSubCode =?= %d)))'
+                          % self.HOLD_SUBCODE)
+        args = OrderedDict()
+        args['periodic_hold'] = 'JobStatus == 2 && (%s)' % exceeded
+        args['periodic_hold_reason'] = '"Used more memory or disk than requested"'
+        args['periodic_hold_subcode'] = self.HOLD_SUBCODE
+        args['periodic_release'] = '%s && NumHolds <= %d' % (held_for_usage, self.max_releases)
+        remove = ['(%s && NumHolds > %d)' % (held_for_usage, self.max_releases)]
+        max_runtime = self.expected_max_runtime(jobset)
+        if max_runtime:
+            remove.append('(JobStatus == 2 && time() - EnteredCurrentStatus > %d)' % max_runtime)
+        args['periodic_remove'] = ' || '.join(remove)
+        return args
+
+    def merge_submit_args(self, jobset, other_args):
+        """Add the options from submit_args() to a copy of a JobSet's other
+        submit file options.
+
+        A periodic_release or periodic_remove already in `other_args` is
+        kept, combined with this policy's using ||. Holds are not combined,
+        since the release & remove expressions rely on the hold subcode.
+
+        Parameters
+        ----------
+        jobset : JobSet
+
+        other_args : dict
+            {option: value}, e.g. JobSet `other_args`. Not changed.
+
+        Returns
+        -------
+        OrderedDict
+            {option: value}
+
+        Raises
+        ------
+        ValueError
+            If `other_args` has its own periodic_hold, periodic_hold_reason or
+            periodic_hold_subcode.
+        """
+        merged = OrderedDict(other_args or {})
+        existing = dict((str(k).lower(), k) for k in merged)
+        for key, value in self.submit_args(jobset).iteritems():
+            if key not in existing:
+                merged[key] = value
+            elif key in ['periodic_release', 'periodic_remove']:
+                merged[existing[key]] = '(%s) || (%s)' % (merged[existing[key]], value)
+            else:
+                raise ValueError('Cannot use %s in other_args with an EscalationPolicy' % key)
+        return merged
@@ -0,0 +1,338 @@
+"""
+Classes/functions to split a set of input files into Jobs with about the same
+number of bytes each, so that jobs take about as long as each other.
+"""
+
+
+import logging
+import os
+import re
+import math
+import heapq
+from glob import glob
+from fnmatch import fnmatch
+from subprocess import check_output
+import htcondenser as ht
+from htcondenser.tuning import SIZE_RE, parse_size
+
+
+log = logging.getLogger(__name__)
+
+
+# Line of `hadoop fs -ls` output, e.g.
+# -rw-r--r--   3 user group   1234 2016-10-27 12:00 /user/me/file.root
+HDFS_LS_RE = re.compile(r'^([-d])\S*\s+\S+\s+\S+\s+\S+\s+(\d+)\s+\S+\s+\S+\s+(.+)$')
+
+# Fields filled in by InputSplitter.make_jobs(), e.g. {index}
+FIELD_RE = re.compile(r'\{(index|name|inputs|paths|n_inputs)\}')
+
+
+def list_hdfs_dir(directory, pattern='*', recursive=False):
+    """List the files & their sizes in a HDFS directory, with one `hadoop fs -ls`.
+
+    Parameters
+    ----------
+    directory : str
+        Directory on HDFS, e.g. /hdfs/user/me/data.
+
+    pattern : str, optional
+        Only list files whose basename matches this, e.g. '*.root'.
+
+    recursive : bool, optional
+        If True, list files in subdirectories too.
+
+    Returns
+    -------
+    list[(str, int)]
+        (/hdfs/... filename, size in bytes) for each file.
+    """
+    cmds = ['hadoop', 'fs', '-ls']
+    if recursive:
+        cmds.append('-R')
+    cmds.append(directory.replace('/hdfs', '', 1) if directory.startswith('/hdfs') else directory)
+    log.debug(cmds)
+    files = []
+    for line in check_output(cmds).splitlines():
+        match = HDFS_LS_RE.match(line.strip())
+        if not match or match.group(1) == 'd':
+            continue
+        # remove any hdfs://namenode:port prefix
+        path = re.sub(r'^\w+://[^/]*', '', match.group(3))
+        if fnmatch(os.path.basename(path), pattern):
+            files.append(('/hdfs' + path, int(match.group(2))))
+    return files
+
+
+def find_input_files(inputs, pattern='*', recursive=False):
+    """Get the input files & their sizes.
+
+    Parameters
+    ----------
+    inputs : str or list[str]
+        Directory (local, or on HDFS as /hdfs/...), glob pattern, or list
+        of filenames.
+
+    pattern : str, optional
+        For a directory, only use files whose basename matches this.
+
+    recursive : bool, optional
+        For a directory, use files in subdirectories too.
+
+    Returns
+    -------
+    list[(str, int)]
+        (filename, size in bytes) for each file.
+    """
+    if isinstance(inputs, basestring):
+        if inputs.startswith('/hdfs') and not any(c in inputs for c in '*?['):
+            return list_hdfs_dir(inputs, pattern, recursive)
+        if os.path.isdir(inputs):
+            filenames = []
+            for root, dirs, names in os.walk(inputs):
+                filenames.extend(os.path.join(root, name) for name in sorted(names)
+                                 if fnmatch(name, pattern))
+                if not recursive:
+                    break
+        else:
+            filenames = sorted(glob(inputs))
+    else:
+        filenames = list(inputs)
+    return [(filename, os.path.getsize(filename)) for filename in filenames]
+
+
+def parse_bytes(size):
+    """Convert a size, e.g. '2GB', to bytes. With no unit, it is in bytes.
+
+    Parameters
+    ----------
+    size : str or int
+
+    Returns
+    -------
+    int
+
+    Raises
+    ------
+    ValueError
+        If `size` cannot be understood.
+    """
+    match = SIZE_RE.match(str(size))
+    if match and not match.group(2):
+        return int(math.ceil(float(match.group(1))))
+    return parse_size(size, 'K') * 1024
+
+
+def pack_files(files, n_jobs):
+    """Split files into groups with as equal total size as possible.
+
+    Files are taken largest first, each put in the group with the smallest
+    total so far. Each group keeps the files in their original order.
+
+    Parameters
+    ----------
+    files : list[(str, int)]
+        (filename, size) for each file.
+
+    n_jobs : int
+        Number of groups. Fewer are made if there are fewer files.
+
+    Returns
+    -------
+    list[list[(str, int)]]
+        Files in each group.
+    """
+    n_jobs = max(1, min(int(n_jobs), len(files)))
+    heap = [(0, i, []) for i in xrange(n_jobs)]
+    order = sorted(xrange(len(files)), key=lambda i: (-files[i][1], i))
+    for i in order:
+        total, index, group = heapq.heappop(heap)
+        group.append(i)
+        heapq.heappush(heap, (total + files[i][1], index, group))
+    groups = [members for _, _, members in sorted(heap, key=lambda x: x[1])]
+    return [[files[i] for i in sorted(group)] for group in groups if group]
+
+
+class InputSplitter(object):
+    """Split input files into balanced Jobs by size.
+
+    Parameters
+    ----------
+    inputs : str or list[str]
+        Directory (local, or on HDFS as /hdfs/..., which is listed with one
+        `hadoop fs -ls`), glob pattern, or list of filenames.
+
+    bytes_per_job : int or str, optional
+        Target size of input per job, e.g. 2 * 1024**3 or '2GB'. A number,
+        or a string with no unit, is in bytes.
+
+    n_jobs : int, optional
+        Number of jobs. One of `bytes_per_job` or `n_jobs` must be given.
+
+    pattern : str, optional
+        For a directory, only use files whose basename matches this.
+
+    recursive : bool, optional
+        For a directory, use files in subdirectories too.
+
+    Raises
+    ------
+    ValueError
+        If neither or both of `bytes_per_job` & `n_jobs` are given.
+
+    IOError
+        If no input files are found.
+
+    Attributes
+    ----------
+    files : list[(str, int)]
+        (filename, size in bytes) for each input file.
+
+    groups : list[list[(str, int)]]
+        Input files for each job.
+    """
+
+    def __init__(self, inputs, bytes_per_job=None, n_jobs=None, pattern='*', recursive=False):
+        super(InputSplitter, self).__init__()
+        if (bytes_per_job is None) == (n_jobs is None):
+            raise ValueError('Give one of bytes_per_job or n_jobs')
+        self.files = find_input_files(inputs, pattern, recursive)
+        if not self.files:
+            raise IOError('No input files found in %s' % inputs)
+        if bytes_per_job is not None:
+            if isinstance(bytes_per_job, basestring):
+                bytes_per_job = parse_bytes(bytes_per_job)
+            n_jobs = int(math.ceil(self.total_bytes / float(bytes_per_job)))
+        self.groups = pack_files(self.files, n_jobs)
+
+    @property
+    def total_bytes(self):
+        return sum(size for _, size in self.files)
+
+    @staticmethod
+    def _fill(template, values):
+        return FIELD_RE.sub(lambda m: str(values[m.group(1)]), str(template))
+
+    @staticmethod
+    def _format(template, values, inputs, names):
+        if template == '{inputs}':
+            return list(names)
+        if template == '{paths}':
+            return list(inputs)
+        return [InputSplitter._fill(template, values)]
+
+    @staticmethod
+    def _job_input_names(job, inputs):
+        """Get the names a Job's executable sees for its input files, as
+        Job.generate_job_arg_list() rewrites them: the copy on the worker, or
+        on HDFS if the JobSet does not transfer inputs."""
+        job.setup_input_file_mirrors(job.hdfs_mirror_dir)
+        mirrors = dict((m.original, m) for m in job.input_file_mirrors)
+        if job.manager.transfer_hdfs_input:
+            return [mirrors[f].worker for f in inputs]
+        return [mirrors[f].hdfs for f in inputs]
+
+    def make_jobs(self, name='job_{index}', args=None, output_files=None, jobset=None,
+                  **job_kwargs):
+        """Make a Job for each group of input files.
+
+        `name`, `args`, and `output_files` can contain these fields, which
+        are filled in for each job:
+
+        - {index}: job number, from 0
+        - {name}: job name (not in `name`)
+        - {inputs}: input files as the executable sees them, separated by commas
+        - {paths}: input filenames as given, separated by commas
+        - {n_inputs}: number of input files
+
+        An argument that is just '{inputs}' or '{paths}' becomes one
+        argument per input file, as given, which the Job then replaces by
+        its copy on the worker (or on HDFS, if the JobSet does not transfer
+        inputs), as for any argument that is an input file. {inputs}
+        elsewhere can only be filled in this way if `jobset` is given;
+        otherwise, and in `name` & `output_files`, it is the input file
+        basenames. Any other text in braces, e.g. JSON or ${VAR}, is left as
+        it is.
+
+        Parameters
+        ----------
+        name : str, optional
+            Template for the name of each Job.
+
+        args : list[str], optional
+            Template for the arguments of each Job.
+
+        output_files : list[str], optional
+            Template for the output files of each Job.
+
+        jobset : JobSet, optional
+            If given, each Job is added to it.
+
+        **job_kwargs
+            Passed to each Job, e.g. quantity.
+
+        Returns
+        -------
+        list[Job]
+        """
+        jobs = []
+        for index, group in enumerate(self.groups):
+            inputs = [filename for filename, _ in group]
+            basenames = [os.path.basename(f) for f in inputs]
+            values = dict(index=index, n_inputs=len(inputs), paths=','.join(inputs),
+                          inputs=','.join(basenames))
+            values['name'] = self._fill(name, values)
+            job_outputs = [o for ofile in (output_files or [])
+                           for o in self._format(ofile, values, inputs, basenames)]
+            job = ht.Job(name=values['name'], input_files=inputs,
+                         output_files=job_outputs, **job_kwargs)
+            if jobset is not None:
+                jobset.add_job(job)
+                values['inputs'] = ','.join(self._job_input_names(job, inputs))
+            job.args = [a for arg in (args or [])
+                        for a in self._format(arg, values, inputs, inputs)]
+            jobs.append(job)
+        return jobs
+
+    def report(self):
+        """Report the spread of input size per job.
+
+        Returns
+        -------
+        dict
+            Number of jobs & files, and the total, min, max, mean, & standard
+            deviation of bytes per job. `imbalance` is max / mean, i.e. how
+            much longer the longest job is expected to take than average.
+        """
+        loads = [sum(size for _, size in group) for group in self.groups]
+        mean = sum(loads) / float(len(loads))
+        std = math.sqrt(sum((x - mean) ** 2 for x in loads) / len(loads))
+        return {
+            'jobs': len(loads),
+            'files': len(self.files),
+            'total_bytes': sum(loads),
+            'min_bytes': min(loads),
+            'max_bytes': max(loads),
+            'mean_bytes': mean,
+            'std_bytes': std,
+            'imbalance': max(loads) / mean if mean else 1.,
+        }
+
+
+def format_report(report):
+    """Make a readable summary from InputSplitter.report().
+
+    Parameters
+    ----------
+    report : dict
+        From InputSplitter.report().
+
+    Returns
+    -------
+    str
+    """
+    mb = 1024. ** 2
+    return ('%d files (%.1f MB) in %d jobs\n'
+            'MB per job: min %.1f, mean %.1f, max %.1f, std dev %.1f (max/mean %.2f)'
+            % (report['files'], report['total_bytes'] / mb, report['jobs'],
+               report['min_bytes'] / mb, report['mean_bytes'] / mb, report['max_bytes'] / mb,
+               report['std_bytes'] / mb, report['imbalance']))
@@ -0,0 +1,124 @@
+"""
+Functions to collect the telemetry records written by condor_worker.py,
+and aggregate them across a JobSet or DAG.
+"""
+
+
+import logging
+import os
+import re
+import json
+from glob import glob
+
+
+log = logging.getLogger(__name__)
+
+
+def find_telemetry_files(jobset):
+    """Get the telemetry files that have been transferred back for a JobSet.
+
+    Parameters
+    ----------
+    jobset : JobSet
+        JobSet with telemetry enabled.
+
+    Returns
+    -------
+    list[str]
+        Telemetry filenames.
+    """
+    # Replace any HTCondor macros, e.g. $(cluster), with a wildcard
+    pattern = re.sub(r'\$\(\w+\)', '*', jobset.telemetry_file)
+    return sorted(glob(pattern))
+
+
+def load_telemetry(filenames):
+    """Load telemetry records from file.
+
+    Any file that cannot be read or parsed is skipped with a warning,
+    since a job may have been evicted halfway through writing its record.
+
+    Parameters
+    ----------
+    filenames : iterable[str]
+        Telemetry filenames.
+
+    Yields
+    ------
+    dict
+        Telemetry record, with the key `filename` added.
+    """
+    for filename in filenames:
+        try:
+            with open(filename) as tfile:
+                record = json.load(tfile)
+        except (IOError, ValueError) as err:
+            log.warning('Cannot read telemetry file %s: %s', filename, err)
+            continue
+        record['filename'] = filename
+        yield record
+
+
+def collect_telemetry(jobsets):
+    """Collect all telemetry records for one or more JobSets.
+
+    Parameters
+    ----------
+    jobsets : JobSet or iterable[JobSet]
+        JobSet(s) to collect records for, e.g. `DAGMan.get_jobsets()`.
+
+    Returns
+    -------
+    list[dict]
+        Telemetry records.
+    """
+    if hasattr(jobsets, 'telemetry_file'):
+        jobsets = [jobsets]
+    records = []
+    for jobset in jobsets:
+        records.extend(load_telemetry(find_telemetry_files(jobset)))
+    return records
+
+
+def _stats(values):
+    """Get count, total, mean, min and max of a list of numbers."""
+    if not values:
+        return dict(count=0, total=0, mean=None, min=None, max=None)
+    return dict(count=len(values), total=sum(values), mean=sum(values) / float(len(values)),
+                min=min(values), max=max(values))
+
+
+def summarise_telemetry(records):
+    """Aggregate telemetry records.
+
+    Parameters
+    ----------
+    records : iterable[dict]
+        Telemetry records, e.g. from collect_telemetry().
+
+    Returns
+    -------
+    dict
+        Number of jobs per status, statistics on each phase duration
+        and resource usage field, and total bytes transferred in & out.
+    """
+    statuses = {}
+    phases = {}
+    resources = {}
+    bytes_moved = {'in': 0, 'out': 0}
+    for record in records:
+        status = record.get('status', 'unknown')
+        statuses[status] = statuses.get(status, 0) + 1
+        for name, duration in record.get('phases', {}).iteritems():
+            phases.setdefault(name, []).append(duration)
+        for name, value in record.get('resources', {}).iteritems():
+            resources.setdefault(name, []).append(value)
+        for transfer in record.get('transfers', []):
+            if transfer.get('bytes') is not None:
+                bytes_moved[transfer['direction']] += transfer['bytes']
+    return dict(jobs=sum(statuses.itervalues()),
+                statuses=statuses,
+                phases=dict((k, _stats(v)) for k, v in phases.iteritems()),
+                resources=dict((k, _stats(v)) for k, v in resources.iteritems()),
+                bytes_in=bytes_moved['in'],
+                bytes_out=bytes_moved['out'])
@@ -7,11 +7,26 @@ and execution of a job.
 
 
 import argparse
-from subprocess import check_call, Popen, PIPE
+from subprocess import check_call, Popen, PIPE, CalledProcessError
 import sys
 import shutil
 import os
+import errno
+import fcntl
+import ctypes
+import ctypes.util
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import glob
+import fnmatch
+import hashlib
+import json
+import random
+import threading
+import time
+import zipfile
+from functools import partial
+from contextlib import contextmanager
 
 
 class WorkerArgParser(argparse.ArgumentParser):
@@ -33,11 +48,1123 @@ class WorkerArgParser(argparse.ArgumentParser):
                           "after running program. "
                           "Must be of the form <source> <destination>. "
                           "Repeat for each file you want to copy.")
+        self.add_argument("--overlapStageOut", action='store_true',
+                          help="Upload --copyFromLocal files in the background "
+                          "whilst the executable is still running, as soon as "
+                          "each file is complete.")
+        self.add_argument("--overlapInterval", type=float, default=10.,
+                          help="Seconds between checks for complete output "
+                          "files when using --overlapStageOut.")
+        self.add_argument("--telemetry",
+                          help="Filename to write JSON record of phase timings, "
+                          "file transfers and resource usage. Relative to "
+                          "the job's initial directory, not the sandbox.")
+        self.add_argument("--aggregate",
+                          help="Destination of an archive to put small "
+                          "--copyFromLocal files in, instead of copying each one.")
+        self.add_argument("--aggregateMaxSize", type=int, default=1024 * 1024,
+                          help="Largest file in bytes to put in --aggregate archive.")
+        self.add_argument("--retries", type=int, default=3,
+                          help="Number of times to retry a failed file transfer.")
+        self.add_argument("--retryDelay", type=float, default=5.,
+                          help="Seconds to wait before the first retry. "
+                          "Doubles for each subsequent retry.")
+        self.add_argument("--verify", choices=['none', 'size', 'md5'], default='none',
+                          help="How to check each file after transfer. With md5, "
+                          "stage-out also skips files that are already on "
+                          "HDFS with the same checksum.")
+        self.add_argument("--manifest",
+                          help="Manifest file holding the arguments for all jobs. "
+                          "If specified, all other arguments are read from "
+                          "the entry at --index.")
+        self.add_argument("--index", type=int, default=0,
+                          help="Entry in --manifest for this job.")
         self.add_argument("--exe", help="Name of executable")
         self.add_argument("--args", nargs=argparse.REMAINDER,
                           help="Args to pass to executable")
 
 
+class HDFSListing(object):
+    """Cache of HDFS directory listings, to expand wildcards and check for
+    files on HDFS without going through the FUSE mount.
+
+    Each directory is listed at most once with a single `hadoop fs -ls`
+    call, and kept for the lifetime of the worker. Paths use the /hdfs
+    prefix, as elsewhere in this script.
+    """
+    def __init__(self):
+        self._listings = {}  # directory : {name : (is_dir, size)}
+        self._lock = threading.Lock()
+
+    def listdir(self, directory):
+        """Get the contents of a HDFS directory.
+
+        Returns
+        -------
+        dict
+            {name: (is_dir, size)} for each entry. Empty if the directory
+            does not exist, or is not a directory.
+        """
+        directory = os.path.normpath(directory)
+        with self._lock:
+            if directory not in self._listings:
+                self._listings[directory] = self._hadoop_ls(directory)
+            return self._listings[directory]
+
+    @staticmethod
+    def _hadoop_ls(directory):
+        proc = Popen(['hadoop', 'fs', '-ls', directory.replace('/hdfs', '', 1) or '/'],
+                     stdout=PIPE, stderr=PIPE)
+        out, err = proc.communicate()
+        entries = {}
+        if proc.returncode != 0:
+            return entries
+        for line in out.splitlines():
+            # e.g. -rw-r--r--   3 user group  1234 2016-10-18 12:00 /path/to/file
+            parts = line.split(None, 7)
+            if len(parts) != 8 or parts[0].startswith('Found'):
+                continue
+            path = parts[7]
+            if os.path.dirname(path.rstrip('/')) != (directory.replace('/hdfs', '', 1) or '/'):
+                # listing a file returns the file itself
+                return {}
+            entries[os.path.basename(path)] = (parts[0].startswith('d'), int(parts[4]))
+        return entries
+
+    def stat(self, path):
+        """Get (is_dir, size) for a path, or None if it does not exist."""
+        path = os.path.normpath(path)
+        if path == '/hdfs':
+            return (True, 0)
+        return self.listdir(os.path.dirname(path)).get(os.path.basename(path))
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        stat = self.stat(path)
+        return stat is not None and stat[0]
+
+    def record(self, path, is_dir, size=0):
+        """Add a new file or directory to any cached listings.
+
+        Only updates what is already cached, so that later lookups stay consistent
+        with any files or directories this worker has created.
+        """
+        path = os.path.normpath(path)
+        with self._lock:
+            parent = os.path.dirname(path)
+            if parent in self._listings:
+                self._listings[parent][os.path.basename(path)] = (is_dir, size)
+            if is_dir:
+                self._listings.setdefault(path, {})
+
+    def forget(self, path):
+        """Remove a deleted file or directory, and anything under it, from any
+        cached listings."""
+        path = os.path.normpath(path)
+        with self._lock:
+            self._listings.get(os.path.dirname(path), {}).pop(os.path.basename(path), None)
+            for directory in list(self._listings):
+                if directory == path or directory.startswith(path + '/'):
+                    del self._listings[directory]
+
+    def glob(self, pattern):
+        """Expand wildcards in a HDFS path, listing each directory at most once.
+
+        Like glob.glob, hidden entries are only matched by a pattern that
+        starts with a '.'.
+
+        Returns
+        -------
+        list[str]
+            Matching paths.
+        """
+        parts = os.path.normpath(pattern).replace('/hdfs', '', 1).strip('/').split('/')
+        candidates = ['/hdfs']
+        for i, part in enumerate(parts):
+            last = (i == len(parts) - 1)
+            matches = []
+            for candidate in candidates:
+                if glob.has_magic(part):
+                    names = self.listdir(candidate)
+                    for name in fnmatch.filter(names.keys(), part):
+                        if name.startswith('.') and not part.startswith('.'):
+                            continue
+                        if last or names[name][0]:
+                            matches.append(os.path.join(candidate, name))
+                else:
+                    # a missing intermediate directory just lists as empty
+                    path = os.path.join(candidate, part)
+                    if not last or self.exists(path):
+                        matches.append(path)
+            candidates = matches
+        return sorted(candidates)
+
+
+# Shared between stage-in and stage-out for the lifetime of the worker
+HDFS = HDFSListing()
+
+
+def path_exists(path):
+    """Check if path exists, using the HDFS listing cache for HDFS paths."""
+    if path.startswith('/hdfs'):
+        return HDFS.exists(path)
+    return os.path.exists(path)
+
+
+def remove_path(path):
+    """Delete a file or directory on HDFS or local disk, if it exists."""
+    if path.startswith('/hdfs'):
+        check_call(['hadoop', 'fs', '-rm', '-r', '-f', path.replace('/hdfs', '', 1)])
+        HDFS.forget(path)
+    elif os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def expand_globs(copy_pairs):
+    """Expand any wildcards in the source of each (source, destination) pair.
+
+    Wildcards in HDFS paths are expanded using the HDFS listing cache.
+
+    Parameters
+    ----------
+    copy_pairs : list[(str, str)]
+        Pairs of (source, destination).
+
+    Returns
+    -------
+    list[(str, str)]
+        Pairs with a concrete source filepath.
+    """
+    copy_list = []
+    for (source, dest) in copy_pairs:
+        if source.startswith('/hdfs'):
+            matches = HDFS.glob(source) if glob.has_magic(source) else [source]
+        else:
+            matches = glob.iglob(source)
+        for match in matches:
+            copy_list.append((match, dest))
+    return copy_list
+
+
+# Fast local copies, the same as in htcondenser.common, since this script
+# must run standalone on the worker node.
+# -----------------------------------------------------------------------------
+# ioctl request to clone a file's extents, from linux/fs.h
+FICLONE = 0x40049409
+
+# Errors meaning a copy strategy is not supported for these files,
+# so the next one should be tried.
+_UNSUPPORTED_ERRNOS = set([errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EPERM,
+                           errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EMLINK])
+
+try:
+    _LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    _LIBC = None
+
+
+def _libc_func(name, restype, argtypes):
+    """Get a function from libc, or None if not available."""
+    func = getattr(_LIBC, name, None) if _LIBC else None
+    if func is not None:
+        func.restype = restype
+        func.argtypes = argtypes
+    return func
+
+
+_COPY_FILE_RANGE = _libc_func('copy_file_range', ctypes.c_ssize_t,
+                              [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                               ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint])
+_SENDFILE = _libc_func('sendfile', ctypes.c_ssize_t,
+                       [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+
+
+def _kernel_copy(func, src_fd, dest_fd, size):
+    """Copy size bytes using copy_file_range or sendfile, looping over
+    partial copies. func takes (src_fd, dest_fd, nbytes).
+
+    Some filesystems (e.g. FUSE, NFS) & kernels copy nothing without an
+    error, so that raises EINVAL, for copy_file() to try the next strategy.
+    """
+    remaining = size
+    while remaining > 0:
+        copied = func(src_fd, dest_fd, min(remaining, 1 << 30))
+        if copied < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if copied == 0:
+            raise OSError(errno.EINVAL, 'Copy stopped with %d bytes left' % remaining)
+        remaining -= copied
+
+
+def _copy_hardlink(src, dest):
+    # Link to a temporary name first so an existing dest is replaced atomically
+    tmp = dest + '.htcondenser_link'
+    os.link(src, tmp)
+    os.rename(tmp, dest)
+
+
+def _copy_reflink(src, dest):
+    with open(src, 'rb') as fsrc:
+        with open(dest, 'wb') as fdest:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(src, dest):
+    if _COPY_FILE_RANGE is None:
+        raise OSError(errno.ENOSYS, 'copy_file_range not available')
+    with open(src, 'rb') as fsrc:
+        with open(dest, 'wb') as fdest:
+            _kernel_copy(lambda i, o, n: _COPY_FILE_RANGE(i, None, o, None, n, 0),
+                         fsrc.fileno(), fdest.fileno(), os.fstat(fsrc.fileno()).st_size)
+
+
+def _copy_sendfile(src, dest):
+    if _SENDFILE is None:
+        raise OSError(errno.ENOSYS, 'sendfile not available')
+    with open(src, 'rb') as fsrc:
+        with open(dest, 'wb') as fdest:
+            _kernel_copy(lambda i, o, n: _SENDFILE(o, i, None, n),
+                         fsrc.fileno(), fdest.fileno(), os.fstat(fsrc.fileno()).st_size)
+
+
+def _copy_buffered(src, dest):
+    shutil.copyfile(src, dest)
+
+
+# Copy strategies in order of preference
+COPY_STRATEGIES = [
+    ('hardlink', _copy_hardlink),
+    ('reflink', _copy_reflink),
+    ('copy_file_range', _copy_file_range),
+    ('sendfile', _copy_sendfile),
+    ('buffered', _copy_buffered),
+]
+
+
+def copy_file(src, dest, hardlink=False):
+    """Copy a file using the fastest method that works for src and dest.
+
+    Tries in order: a hardlink (only if `hardlink` is True), a reflink
+    (FICLONE), the zero-copy copy_file_range and sendfile system calls,
+    and finally a normal buffered copy. Permission bits & timestamps are
+    copied as for shutil.copy2.
+
+    Parameters
+    ----------
+    src : str
+        Source filepath.
+
+    dest : str
+        Destination filepath or directory.
+
+    hardlink : bool, optional
+        Allow dest to be a hardlink to src. Only use this if neither file
+        will be modified afterwards, since they will share their contents.
+
+    Returns
+    -------
+    str
+        Name of the strategy used, one of the names in COPY_STRATEGIES.
+
+    Raises
+    ------
+    shutil.Error
+        If src and dest are the same file.
+    """
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(src))
+    # as shutil.copyfile, since opening dest would truncate src
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        raise shutil.Error('`%s` and `%s` are the same file' % (src, dest))
+    for name, func in COPY_STRATEGIES:
+        if name == 'hardlink' and not hardlink:
+            continue
+        try:
+            func(src, dest)
+        except (OSError, IOError) as err:
+            if name == 'buffered' or err.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            continue
+        if name != 'hardlink':
+            shutil.copystat(src, dest)
+        return name
+
+
+def copy_tree(src, dest, hardlink=False, threads=None):
+    """Copy a directory tree, copying files in parallel with copy_file().
+
+    As for shutil.copytree, dest must not already exist, and symlinks are
+    followed.
+
+    Parameters
+    ----------
+    src : str
+        Source directory.
+
+    dest : str
+        Destination directory.
+
+    hardlink : bool, optional
+        Allow files to be hardlinked, see copy_file().
+
+    threads : int, optional
+        Number of files to copy at once. Default is the number of CPUs, up to 8.
+
+    Returns
+    -------
+    dict
+        Number of files copied with each strategy.
+    """
+    pairs = []
+    for root, dirs, files in os.walk(src, followlinks=True):
+        dest_root = os.path.join(dest, os.path.relpath(root, src))
+        os.makedirs(dest_root)
+        shutil.copystat(root, dest_root)
+        pairs.extend((os.path.join(root, f), os.path.join(dest_root, f)) for f in files)
+    pool = ThreadPool(threads or min(cpu_count(), 8))
+    try:
+        strategies = pool.map(lambda pair: copy_file(pair[0], pair[1], hardlink), pairs)
+    finally:
+        pool.close()
+        pool.join()
+    counts = {}
+    for name in strategies:
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def local_copy(source, dest, hardlink=False):
+    """Copy a local file or directory with copy_file() or copy_tree().
+
+    Returns
+    -------
+    str
+        Name of the strategy used. For a directory, the strategies used
+        for its files joined with '+'.
+    """
+    if os.path.isfile(source):
+        return copy_file(source, dest, hardlink)
+    elif os.path.isdir(source):
+        return '+'.join(sorted(copy_tree(source, dest, hardlink)))
+
+
+# Compression codecs for file transfers, keyed by filename suffix.
+# Values are the commands to (compress, decompress) between stdin & stdout.
+CODECS = {
+    '.gz': (['gzip', '-c', '-1'], ['gzip', '-dc']),
+    '.bz2': (['bzip2', '-c', '-1'], ['bzip2', '-dc']),
+    '.xz': (['xz', '-c', '-1', '-T0'], ['xz', '-dc']),
+    '.zst': (['zstd', '-c', '-1', '-q', '-T0'], ['zstd', '-dc', '-q']),
+    '.lz4': (['lz4', '-c', '-1', '-q'], ['lz4', '-dc', '-q']),
+}
+
+# (number of bytes, md5 hex digest) actually written for each compressed
+# stage-out, keyed by full destination path, since these differ from the
+# local file.
+COMPRESSED_STREAMS = {}
+
+
+def codec_suffix(source, dest):
+    """Get the codec suffix if dest is a compressed version of source, else None."""
+    for suffix in CODECS:
+        if dest.endswith(suffix) and not source.endswith(suffix):
+            return suffix
+    return None
+
+
+def pump(in_stream, out_stream, digest=None, chunk_size=1024 * 1024):
+    """Copy everything from in_stream to out_stream, and return the number of bytes.
+
+    out_stream can be None to just read in_stream. If digest is a hashlib
+    object, it is updated with all the bytes read.
+    """
+    nbytes = 0
+    while True:
+        chunk = in_stream.read(chunk_size)
+        if not chunk:
+            break
+        if out_stream:
+            out_stream.write(chunk)
+        if digest:
+            digest.update(chunk)
+        nbytes += len(chunk)
+    return nbytes
+
+
+def run_pipeline(first, second, in_file, out_file):
+    """Run `first < in_file | second > out_file`, with the pipe between
+    them going through this process. Either command can be None to just
+    read from in_file or write to out_file.
+
+    Returns
+    -------
+    int, str
+        Number of bytes passed between the two commands, and their md5 hex digest.
+
+    Raises
+    ------
+    CalledProcessError
+        If either command fails.
+    """
+    digest = hashlib.md5()
+    procs = []
+    try:
+        with open(in_file, 'rb') as fin:
+            with open(out_file, 'wb') as fout:
+                source = fin
+                if first:
+                    procs.append(Popen(first, stdin=fin, stdout=PIPE))
+                    source = procs[-1].stdout
+                sink = fout
+                if second:
+                    procs.append(Popen(second, stdin=PIPE, stdout=fout))
+                    sink = procs[-1].stdin
+                nbytes = pump(source, sink, digest)
+                if second:
+                    sink.close()
+        for cmd, proc in zip([c for c in [first, second] if c], procs):
+            if proc.wait() != 0:
+                raise CalledProcessError(proc.returncode, ' '.join(cmd))
+    finally:
+        # don't leave a process running, or its pipe open, if anything failed
+        for proc in procs:
+            for stream in [proc.stdin, proc.stdout]:
+                if stream:
+                    stream.close()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+    return nbytes, digest.hexdigest()
+
+
+def stage_in(source, dest):
+    """Copy a file or directory to the worker node, using hadoop for HDFS.
+
+    Never hardlinks, since the executable may modify its inputs.
+    If source has a codec suffix (e.g. .gz) but dest is a filename without
+    it, source is decompressed whilst copying.
+
+    Returns
+    -------
+    str
+        How the copy was done: 'hadoop' or a local_copy() strategy,
+        prefixed with the codec suffix if decompressed.
+    """
+    suffix = None if os.path.isdir(dest) else codec_suffix(dest, source)
+    if suffix:
+        if source.startswith('/hdfs'):
+            cat = ['hadoop', 'fs', '-cat', source.replace('/hdfs', '', 1)]
+            run_pipeline(cat, CODECS[suffix][1], os.devnull, dest)
+            return suffix + '+hadoop'
+        run_pipeline(CODECS[suffix][1], None, source, dest)
+        return suffix
+    if source.startswith('/hdfs'):
+        source = source.replace('/hdfs', '')
+        check_call(['hadoop', 'fs', '-copyToLocal', source, dest])
+        return 'hadoop'
+    else:
+        return local_copy(source, dest)
+
+
+def stage_out(source, dest):
+    """Copy a file or directory from the worker node, using hadoop for HDFS.
+
+    Local copies may hardlink, since the sandbox copy is deleted afterwards.
+    If dest has a codec suffix (e.g. .gz) but source does not, source is
+    compressed as it is copied, with the compressed stream going straight
+    to HDFS.
+
+    Returns
+    -------
+    str
+        How the copy was done: 'hadoop' or a local_copy() strategy,
+        prefixed with the codec suffix if compressed.
+    """
+    suffix = codec_suffix(source, dest) if os.path.isfile(source) else None
+    if dest.startswith('/hdfs'):
+        dest_folder = os.path.dirname(dest)
+        if not HDFS.isdir(dest_folder):
+            check_call(['hdfs', 'dfs', '-mkdir', '-p', dest_folder.replace('/hdfs', '')])
+            HDFS.record(dest_folder, is_dir=True)
+        if suffix:
+            put = ['hadoop', 'fs', '-put', '-f', '-', dest.replace('/hdfs', '', 1)]
+            COMPRESSED_STREAMS[dest] = run_pipeline(CODECS[suffix][0], put, source, os.devnull)
+            HDFS.record(dest, is_dir=False, size=COMPRESSED_STREAMS[dest][0])
+            return suffix + '+hadoop'
+        check_call(['hadoop', 'fs', '-copyFromLocal', '-f', source, dest.replace('/hdfs', '')])
+        if HDFS.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(source))
+        HDFS.record(dest, is_dir=os.path.isdir(source), size=path_size(source))
+        return 'hadoop'
+    elif suffix:
+        COMPRESSED_STREAMS[dest] = run_pipeline(CODECS[suffix][0], None, source, dest)
+        return suffix
+    else:
+        return local_copy(source, dest, hardlink=True)
+
+
+def expected_size(source, dest):
+    """Get the size in bytes the staged-out copy of source should have."""
+    if output_destination(source, dest) in COMPRESSED_STREAMS:
+        return COMPRESSED_STREAMS[output_destination(source, dest)][0]
+    return os.path.getsize(source)
+
+
+def local_md5(filename):
+    """Get the md5 hex digest of a local file."""
+    digest = hashlib.md5()
+    with open(filename, 'rb') as f:
+        pump(f, None, digest)
+    return digest.hexdigest()
+
+
+def remote_md5(filename):
+    """Get the md5 hex digest of a file on HDFS or local disk, or None if
+    it cannot be read. HDFS files are streamed with `hadoop fs -cat`, since
+    HDFS's own checksums cannot be compared with a local file."""
+    if not filename.startswith('/hdfs'):
+        return local_md5(filename) if os.path.isfile(filename) else None
+    digest = hashlib.md5()
+    # stderr is not a pipe, so hadoop cannot block on it whilst we read stdout
+    with open(os.devnull, 'w') as devnull:
+        proc = Popen(['hadoop', 'fs', '-cat', filename.replace('/hdfs', '', 1)],
+                     stdout=PIPE, stderr=devnull)
+        pump(proc.stdout, None, digest)
+    return digest.hexdigest() if proc.wait() == 0 else None
+
+
+class TransferPolicy(object):
+    """Retry failed file transfers with exponential backoff, and check each
+    transfer afterwards.
+
+    Parameters
+    ----------
+    retries : int
+        Number of retries after the first attempt.
+
+    delay : float
+        Seconds to wait before the first retry. This doubles for each
+        retry, with up to 50% random jitter so that many jobs do not retry
+        at the same time.
+
+    verify : str
+        'none', 'size' to compare file sizes, or 'md5' to compare checksums.
+        With 'md5', a stage-out is skipped if the destination already has
+        the same checksum, e.g. from an earlier attempt of this job.
+
+    Before each retry, whatever the failed attempt left at the destination
+    is deleted, since hadoop & copy_tree() will not overwrite it.
+    """
+    def __init__(self, retries=3, delay=5., verify='none'):
+        self.retries = retries
+        self.delay = delay
+        self.verify = verify
+
+    def stage_in(self, source, dest):
+        """stage_in(), with retries and verification."""
+        target = os.path.join(dest, os.path.basename(source)) if os.path.isdir(dest) else dest
+        return self._with_retries(stage_in, self._verify_in, source, dest, target)
+
+    def stage_out(self, source, dest):
+        """stage_out(), with retries and verification."""
+        if self.verify == 'md5' and os.path.isfile(source) and not codec_suffix(source, dest):
+            if remote_md5(output_destination(source, dest)) == local_md5(source):
+                return 'already present'
+        return self._with_retries(stage_out, self._verify_out, source, dest,
+                                  output_destination(source, dest))
+
+    def _with_retries(self, copy_func, verify_func, source, dest, target):
+        """Copy & verify, deleting target (the copy of source) before each retry."""
+        attempt = 0
+        while True:
+            try:
+                strategy = copy_func(source, dest)
+                verify_func(source, dest)
+                return strategy
+            except (CalledProcessError, IOError, OSError) as exc:
+                if attempt >= self.retries:
+                    raise
+                wait = self.delay * (2 ** attempt) * (1 + 0.5 * random.random())
+                attempt += 1
+                print 'Transfer {0} --> {1} failed: {2}'.format(source, dest, exc)
+                print 'Retry {0}/{1} in {2:.1f}s'.format(attempt, self.retries, wait)
+                time.sleep(wait)
+                try:
+                    remove_path(target)
+                except (CalledProcessError, IOError, OSError) as exc:
+                    print 'Could not remove {0}: {1}'.format(target, exc)
+
+    def _verify_in(self, source, dest):
+        if self.verify == 'none' or codec_suffix(dest, source) or not os.path.isfile(dest):
+            return
+        if self.verify == 'size':
+            stat = HDFS.stat(source) if source.startswith('/hdfs') else (False, path_size(source))
+            match = stat is not None and stat[1] == os.path.getsize(dest)
+        else:
+            match = remote_md5(source) == local_md5(dest)
+        if not match:
+            raise IOError('Copy of {0} at {1} does not match ({2})'.format(
+                source, dest, self.verify))
+
+    def _verify_out(self, source, dest):
+        if self.verify == 'none' or not os.path.isfile(source):
+            return
+        full_dest = output_destination(source, dest)
+        if self.verify == 'size':
+            match = remote_size(source, dest) == expected_size(source, dest)
+        elif full_dest in COMPRESSED_STREAMS:
+            match = remote_md5(full_dest) == COMPRESSED_STREAMS[full_dest][1]
+        else:
+            match = remote_md5(full_dest) == local_md5(source)
+        if not match:
+            raise IOError('Copy of {0} at {1} does not match ({2})'.format(
+                source, full_dest, self.verify))
+
+
+def remote_size(source, dest):
+    """Get the size in bytes of the staged-out copy of source, or None if missing.
+
+    If dest is a directory (or an HDFS directory), the copy is assumed to
+    be inside it with the same basename as source.
+    """
+    if dest.startswith('/hdfs'):
+        hdfs_dest = dest.replace('/hdfs', '')
+        proc = Popen(['hadoop', 'fs', '-stat', '%F %b', hdfs_dest], stdout=PIPE, stderr=PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            return None
+        kind, size = out.strip().rsplit(' ', 1)
+        if kind != 'directory':
+            return int(size)
+        hdfs_dest = os.path.join(hdfs_dest, os.path.basename(source))
+        proc = Popen(['hadoop', 'fs', '-stat', '%b', hdfs_dest], stdout=PIPE, stderr=PIPE)
+        out, err = proc.communicate()
+        return int(out.strip()) if proc.returncode == 0 else None
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(source))
+    return os.path.getsize(dest) if os.path.isfile(dest) else None
+
+
+def child_pids(pid):
+    """Get the IDs of the child processes of a process, from /proc."""
+    task_dir = os.path.join('/proc', str(pid), 'task')
+    try:
+        tids = os.listdir(task_dir)
+    except OSError:
+        return []
+    children = []
+    try:
+        for tid in tids:
+            with open(os.path.join(task_dir, tid, 'children')) as f:
+                children.extend(int(c) for c in f.read().split())
+        return children
+    except IOError as exc:
+        if exc.errno != errno.ENOENT:
+            return children
+    # No children files in older kernels, so look for processes whose parent is pid
+    children = []
+    for other in os.listdir('/proc'):
+        if not other.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', other, 'stat')) as f:
+                # the 4th field is the parent ID, after the command name in brackets
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(other))
+    return children
+
+
+def open_files(root_pid=None):
+    """Get the set of files currently held open by a process and all its
+    descendants, e.g. this script and the job's executable.
+
+    Uses /proc, so returns an empty set on systems without it.
+
+    Parameters
+    ----------
+    root_pid : int, optional
+        Process at the top of the tree. Defaults to this process.
+    """
+    held = set()
+    if not os.path.isdir('/proc'):
+        return held
+    to_visit = [root_pid or os.getpid()]
+    seen = set()
+    while to_visit:
+        pid = to_visit.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        to_visit.extend(child_pids(pid))
+        fd_dir = os.path.join('/proc', str(pid), 'fd')
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                held.add(os.readlink(os.path.join(fd_dir, fd)))
+            except OSError:
+                continue
+    return held
+
+
+def path_size(path):
+    """Get the size in bytes of a file, or of all files under a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            total += os.path.getsize(os.path.join(root, f))
+    return total
+
+
+# Fields of `/usr/bin/time -v` output to store, with their JSON key & type.
+TIME_FIELDS = {
+    'Maximum resident set size (kbytes)': ('max_rss_kb', int),
+    'User time (seconds)': ('cpu_user_s', float),
+    'System time (seconds)': ('cpu_sys_s', float),
+    'Major (requiring I/O) page faults': ('major_page_faults', int),
+    'Minor (reclaiming a frame) page faults': ('minor_page_faults', int),
+    'Voluntary context switches': ('voluntary_context_switches', int),
+    'Involuntary context switches': ('involuntary_context_switches', int),
+    'File system inputs': ('fs_inputs', int),
+    'File system outputs': ('fs_outputs', int),
+    'Exit status': ('exit_status', int),
+}
+
+
+def parse_time_output(text):
+    """Parse the output of `/usr/bin/time -v` into a dict.
+
+    Parameters
+    ----------
+    text : str
+        Output from `/usr/bin/time -v`
+
+    Returns
+    -------
+    dict
+        Fields in TIME_FIELDS, plus the wall clock time in seconds as `wall_s`.
+    """
+    result = {}
+    for line in text.splitlines():
+        if ': ' not in line:
+            continue
+        key, value = [x.strip() for x in line.rsplit(': ', 1)]
+        if key in TIME_FIELDS:
+            name, conv = TIME_FIELDS[key]
+            try:
+                result[name] = conv(value)
+            except ValueError:
+                pass
+        elif key.startswith('Elapsed (wall clock) time'):
+            seconds = 0.
+            for part in value.split(':'):
+                seconds = seconds * 60 + float(part)
+            result['wall_s'] = seconds
+    return result
+
+
+def condor_job_ids():
+    """Get the (cluster, process) IDs of this job from the job ClassAd, if available."""
+    ids = [None, None]
+    job_ad = os.environ.get('_CONDOR_JOB_AD')
+    if job_ad and os.path.isfile(job_ad):
+        with open(job_ad) as f:
+            for line in f:
+                key, _, value = line.partition('=')
+                if key.strip() == 'ClusterId':
+                    ids[0] = int(value)
+                elif key.strip() == 'ProcId':
+                    ids[1] = int(value)
+    return tuple(ids)
+
+
+def read_manifest_entry(manifest, index):
+    """Get the arguments for one job from a manifest file.
+
+    Each line of the manifest is a JSON list of arguments for one job,
+    so only lines up to the requested one need to be read.
+
+    Parameters
+    ----------
+    manifest : str
+        Manifest filename.
+
+    index : int
+        Entry to read.
+
+    Returns
+    -------
+    list[str]
+        Arguments for the job.
+
+    Raises
+    ------
+    IndexError
+        If the manifest has no entry at index.
+    """
+    with open(manifest) as mfile:
+        for i, line in enumerate(mfile):
+            if i == index:
+                return [x.encode("utf-8") for x in json.loads(line)]
+    raise IndexError('No entry {0} in manifest {1}'.format(index, manifest))
+
+
+class JobTelemetry(object):
+    """Record phase timings, file transfers, and resource usage for the job.
+
+    The record is written as JSON to `filename`, once at the start (so that
+    there is always a file for HTCondor to transfer back) and again at the end.
+    If `filename` is None, nothing is written.
+
+    Parameters
+    ----------
+    filename : str or None
+        Output JSON filename.
+    """
+    def __init__(self, filename=None):
+        self.filename = os.path.abspath(filename) if filename else None
+        cluster, process = condor_job_ids()
+        self.record = {
+            'host': os.uname()[1],
+            'cluster': cluster,
+            'process': process,
+            'start': time.time(),
+            'end': None,
+            'status': 'running',
+            'phases': {},
+            'transfers': [],
+            'resources': {},
+        }
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager to time a phase of the job."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record['phases'][name] = time.time() - start
+
+    def transfer(self, copy_func, source, dest, direction):
+        """Run copy_func(source, dest) and record its duration, size, and
+        the copy strategy it returns.
+
+        direction is 'in' for stage-in or 'out' for stage-out. The size is
+        of the local file, except for a compressed stage-out, where it is
+        the number of compressed bytes uploaded.
+        """
+        start = time.time()
+        strategy = copy_func(source, dest)
+        duration = time.time() - start
+        print '  ({0}, {1:.2f}s)'.format(strategy, duration)
+        local = dest if direction == 'in' else source
+        size = path_size(local) if os.path.exists(local) else None
+        if direction == 'out' and output_destination(source, dest) in COMPRESSED_STREAMS:
+            size = COMPRESSED_STREAMS[output_destination(source, dest)][0]
+        with self._lock:
+            self.record['transfers'].append({'source': source, 'dest': dest,
+                                             'direction': direction, 'strategy': strategy,
+                                             'bytes': size, 'seconds': duration})
+
+    def write(self):
+        """Write the record to file."""
+        if not self.filename:
+            return
+        with self._lock:
+            contents = json.dumps(self.record, indent=2, sort_keys=True)
+        with open(self.filename, 'w') as f:
+            f.write(contents)
+
+
+class OverlappedStageOut(threading.Thread):
+    """Upload output files in the background whilst the executable is running.
+
+    An output file is considered complete once its size and modification
+    time are unchanged between two consecutive checks, and no process in the
+    job (this script and its descendants) holds it open. Directories are
+    left for the final sync. If the executable fails, the files uploaded so
+    far are deleted again with remove_uploads().
+
+    Parameters
+    ----------
+    copy_pairs : list[(str, str)]
+        (source, destination) pairs as passed to --copyFromLocal.
+        Sources may contain wildcards.
+
+    sandbox : str
+        Directory that relative sources are relative to.
+
+    interval : float
+        Seconds between checks.
+
+    telemetry : JobTelemetry
+        Records each upload.
+
+    stage_func : callable
+        Function to copy a file, e.g. TransferPolicy.stage_out
+
+    skip_size : int or None
+        If set, ignore files of this size in bytes or smaller, since they
+        will be put into an archive at the end instead.
+    """
+    def __init__(self, copy_pairs, sandbox, interval, telemetry, stage_func, skip_size=None):
+        super(OverlappedStageOut, self).__init__()
+        self.daemon = True
+        self.sandbox = sandbox
+        self.copy_pairs = [(os.path.join(sandbox, s), d) for (s, d) in copy_pairs]
+        self.interval = interval
+        self.telemetry = telemetry
+        self.stage_func = stage_func
+        self.skip_size = skip_size
+        self.uploaded = {}  # (source, dest) : (size, mtime) at upload
+        self._last_seen = {}
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Stop checking for output files, and wait for any upload to finish."""
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        while True:
+            self._stop_event.wait(self.interval)
+            if self._stop_event.is_set():
+                break
+            try:
+                self.upload_complete_files()
+            except Exception as exc:  # anything missed is caught by the final sync
+                print 'Background stage-out error:', exc
+
+    def remove_uploads(self):
+        """Delete everything uploaded in the background, e.g. when the
+        executable has failed, so that no partial set of outputs is left."""
+        for (source, dest) in self.uploaded:
+            target = output_destination(source, dest)
+            print 'Removing partial output', target
+            try:
+                remove_path(target)
+            except (CalledProcessError, IOError, OSError) as exc:
+                print 'Could not remove {0}: {1}'.format(target, exc)
+        self.uploaded = {}
+
+    def upload_complete_files(self):
+        held = None
+        for (source, dest) in expand_globs(self.copy_pairs):
+            if not os.path.isfile(source):
+                continue
+            stat = os.stat(source)
+            if self.skip_size is not None and stat.st_size <= self.skip_size:
+                continue
+            key = (source, dest)
+            stamp = (stat.st_size, stat.st_mtime)
+            previous, self._last_seen[key] = self._last_seen.get(key), stamp
+            if previous != stamp or self.uploaded.get(key) == stamp:
+                continue
+            if held is None:
+                held = open_files()
+            if os.path.realpath(source) in held:
+                continue
+            print 'Background stage-out:', source, "-->", dest
+            self.telemetry.transfer(self.stage_func, source, dest, 'out')
+            self.uploaded[key] = stamp
+
+    def final_sync(self, copy_pairs):
+        """Upload anything not yet uploaded, or changed since its upload, and
+        check the size of every background upload against the local file.
+
+        Parameters
+        ----------
+        copy_pairs : list[(str, str)]
+            (source, destination) pairs to sync, with wildcards expanded.
+
+        Returns
+        -------
+        list[(str, str, Exception)]
+            (source, destination, error) for each file that could not be copied.
+        """
+        failures = []
+        for (source, dest) in copy_pairs:
+            source = os.path.join(self.sandbox, source)
+            key = (source, dest)
+            if os.path.isfile(source):
+                stat = os.stat(source)
+                if self.uploaded.get(key) == (stat.st_size, stat.st_mtime):
+                    size = remote_size(source, dest)
+                    if size == expected_size(source, dest):
+                        continue
+                    print 'Size mismatch for {0}: expected {1}, remote {2}'.format(
+                        source, expected_size(source, dest), size)
+            print source, "-->", dest
+            try:
+                # stage_func checks the copy, as set by --verify
+                self.telemetry.transfer(self.stage_func, source, dest, 'out')
+            except (CalledProcessError, IOError, OSError) as exc:
+                failures.append((source, dest, exc))
+        return failures
+
+
+def output_destination(source, dest):
+    """Get the full destination filepath for source, if dest is a directory."""
+    is_dir = HDFS.isdir(dest) if dest.startswith('/hdfs') else os.path.isdir(dest)
+    return os.path.join(dest, os.path.basename(source)) if is_dir else dest
+
+
+def stage_out_archive(archive, dest, members, stage_func=stage_out):
+    """Put files into an uncompressed zip archive, then copy it to dest.
+
+    Each file is stored under its full destination path (without the leading
+    /), so it can be read back using htcondenser.aggregate.OutputArchive.
+    If the destination has a codec suffix (e.g. .gz), the suffix is removed
+    and the file is compressed inside the archive instead.
+
+    Parameters
+    ----------
+    archive : str
+        Local filename for archive.
+
+    dest : str
+        Destination of archive.
+
+    members : list[(str, str)]
+        (source, destination) pairs of files to put in archive.
+
+    stage_func : callable, optional
+        Function to copy the archive to dest.
+
+    Returns
+    -------
+    str
+        How the archive was copied, as for stage_out().
+    """
+    zfile = zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    try:
+        for (source, member_dest) in members:
+            name = output_destination(source, member_dest).lstrip('/')
+            compression = zipfile.ZIP_STORED
+            suffix = codec_suffix(source, name)
+            if suffix:
+                name = name[:-len(suffix)]
+                compression = zipfile.ZIP_DEFLATED
+            print '  ', source, "-->", name
+            zfile.write(source, name, compression)
+    finally:
+        zfile.close()
+    return stage_func(archive, dest)
+
+
 def run_job(in_args=sys.argv[1:]):
     """Main function to run commands on worker node."""
     print '>>>> condor_worker.py logging:'
@@ -50,9 +1177,17 @@ def run_job(in_args=sys.argv[1:]):
 
     parser = WorkerArgParser(description=__doc__)
     args = parser.parse_args(in_args)
+    if args.manifest:
+        args = parser.parse_args(read_manifest_entry(args.manifest, args.index))
     print 'Args:'
     print args
 
+    telemetry = JobTelemetry(args.telemetry)
+    telemetry.write()
+    transfers = TransferPolicy(args.retries, args.retryDelay, args.verify)
+    time_file = os.path.abspath('time_v.txt') if args.telemetry else None
+    setup_end_file = os.path.abspath('setup_end.txt') if args.telemetry else None
+
     # Make sandbox area to avoid names clashing, and stop auto transfer
     # back to submission node
     # -------------------------------------------------------------------------
@@ -62,27 +1197,15 @@ def run_job(in_args=sys.argv[1:]):
     try:
         # Copy files to worker node area from /users, /hdfs, /storage, etc.
         # ---------------------------------------------------------------------
-        if args.copyToLocal:
-            print 'PRE EXECUTION: Copy to local:'
-            copy_list = []
-            for (source, dest) in args.copyToLocal:
-                # handle globbing
-                for match in glob.iglob(source):
-                    copy_list.append((match, dest))
-
-            for (source, dest) in copy_list:
-                print source, "-->", dest
-                if not os.path.exists(source):
-                    print 'File {0} does not exist - cannot copy to {1}'.format(source, dest)
-                else:
-                    if source.startswith('/hdfs'):
-                        source = source.replace('/hdfs', '')
-                        check_call(['hadoop', 'fs', '-copyToLocal', source, dest])
+        with telemetry.phase('stage_in'):
+            if args.copyToLocal:
+                print 'PRE EXECUTION: Copy to local:'
+                for (source, dest) in expand_globs(args.copyToLocal):
+                    print source, "-->", dest
+                    if not path_exists(source):
+                        print 'File {0} does not exist - cannot copy to {1}'.format(source, dest)
                     else:
-                        if os.path.isfile(source):
-                            shutil.copy2(source, dest)
-                        elif os.path.isdir(source):
-                            shutil.copytree(source, dest)
+                        telemetry.transfer(transfers.stage_in, source, dest, 'in')
 
         print 'In current dir:'
         print os.listdir(os.getcwd())
@@ -96,6 +1219,9 @@ def run_job(in_args=sys.argv[1:]):
         if args.setup:
             os.chmod(args.setup, 0555)
             setup_cmd = 'source ./' + args.setup + ' && '
+            if setup_end_file:
+                # Mark the end of setup, to split setup & execution times
+                setup_cmd += 'date +%s.%N > ' + setup_end_file + ' && '
 
         if os.path.isfile(os.path.basename(args.exe)):
             os.chmod(os.path.basename(args.exe), 0555)
@@ -105,50 +1231,112 @@ def run_job(in_args=sys.argv[1:]):
         # If it's a local file, we need to do ./ for some reason...
         # But we must determine this AFTER running setup script,
         # can't do it beforehand
-        run_cmd = "if [[ -e {exe} ]];then /usr/bin/time -v ./{exe} {args};else /usr/bin/time -v {exe} {args};fi"
+        run_cmd = "if [[ -e {exe} ]];then {time} ./{exe} {args};else {time} {exe} {args};fi"
+        # Only measure resources if GNU time is on this worker node
+        time_cmd = ''
+        if os.path.isfile('/usr/bin/time'):
+            time_cmd = '/usr/bin/time -v'
+            if time_file:
+                time_cmd += ' -o ' + time_file
         run_args = ' '.join(args.args) if args.args else ''
-        run_cmd = run_cmd.format(exe=args.exe, args=run_args)
+        run_cmd = run_cmd.format(exe=args.exe, args=run_args, time=time_cmd)
         print 'Contents of dir before running:'
         print os.listdir(os.getcwd())
         print "Running:", setup_cmd + run_cmd
-        check_call(setup_cmd + run_cmd, shell=True)
+        uploader = None
+        if args.overlapStageOut and args.copyFromLocal:
+            uploader = OverlappedStageOut(args.copyFromLocal, os.getcwd(),
+                                          args.overlapInterval, telemetry, transfers.stage_out,
+                                          args.aggregateMaxSize if args.aggregate else None)
+            uploader.start()
+        exe_start = time.time()
+        exe_succeeded = False
+        try:
+            # the command uses bash syntax, and /bin/sh is not always bash
+            check_call(setup_cmd + run_cmd, shell=True, executable='/bin/bash')
+            exe_succeeded = True
+        finally:
+            exe_end = time.time()
+            if uploader:
+                uploader.stop()
+                if not exe_succeeded:
+                    uploader.remove_uploads()
+            if setup_end_file and os.path.isfile(setup_end_file):
+                with open(setup_end_file) as f:
+                    setup_end = float(f.read().strip())
+                telemetry.record['phases']['setup'] = setup_end - exe_start
+                exe_start = setup_end
+            telemetry.record['phases']['execution'] = exe_end - exe_start
+            if time_file and os.path.isfile(time_file):
+                with open(time_file) as f:
+                    time_output = f.read()
+                sys.stderr.write(time_output)
+                telemetry.record['resources'] = parse_time_output(time_output)
+            if telemetry.filename:
+                # disk used by the job, before outputs are copied & removed
+                telemetry.record['resources']['sandbox_kb'] = path_size(os.getcwd()) // 1024
 
         print 'In current dir:'
         print os.listdir(os.getcwd())
 
         # Copy files from worker node area to /hdfs or /storage
         # ---------------------------------------------------------------------
-        if args.copyFromLocal:
-            print 'POST EXECUTION: Copy to HDFS:'
-            copy_list = []
-            for (source, dest) in args.copyFromLocal:
-                # handle globbing
-                for match in glob.iglob(source):
-                    copy_list.append((match, dest))
-
-            for (source, dest) in copy_list:
-                if not os.path.exists(source):
-                    print 'File {0} does not exist - cannot copy to {1}'.format(source, dest)
-                else:
-                    print source, "-->", dest
-                    if dest.startswith('/hdfs'):
-                        dest_folder = os.path.dirname(dest)
-                        if not os.path.exists(dest_folder):
-                            dest_folder = dest_folder.replace('/hdfs', '')
-                            check_call(['hdfs', 'dfs', '-mkdir', '-p', dest_folder])
-                        dest = dest.replace('/hdfs', '')
-                        check_call(['hadoop', 'fs', '-copyFromLocal', '-f', source, dest])
+        with telemetry.phase('stage_out'):
+            copy_list = expand_globs(args.copyFromLocal or [])
+            small_files = []
+            if args.aggregate:
+                small_files = [(source, dest) for (source, dest) in copy_list
+                               if os.path.isfile(source) and
+                               os.path.getsize(source) <= args.aggregateMaxSize]
+                copy_list = [pair for pair in copy_list if pair not in small_files]
+            # Keep going if one transfer fails, so that as many outputs as
+            # possible are saved, and only report failures at the end.
+            failures = []
+            if small_files:
+                print 'POST EXECUTION: Archive small files to', args.aggregate
+                archive = os.path.basename(args.aggregate)
+                try:
+                    telemetry.transfer(partial(stage_out_archive, members=small_files,
+                                               stage_func=transfers.stage_out),
+                                       archive, args.aggregate, 'out')
+                except (CalledProcessError, IOError, OSError) as exc:
+                    failures.append((archive, args.aggregate, exc))
+            if copy_list and uploader:
+                print 'POST EXECUTION: Final sync to HDFS:'
+                failures.extend(uploader.final_sync(copy_list))
+            elif copy_list:
+                print 'POST EXECUTION: Copy to HDFS:'
+                for (source, dest) in copy_list:
+                    if not os.path.exists(source):
+                        print 'File {0} does not exist - cannot copy to {1}'.format(source, dest)
                     else:
-                        if os.path.isfile(source):
-                            shutil.copy2(source, dest)
-                        elif os.path.isdir(source):
-                            shutil.copytree(source, dest)
+                        print source, "-->", dest
+                        try:
+                            telemetry.transfer(transfers.stage_out, source, dest, 'out')
+                        except (CalledProcessError, IOError, OSError) as exc:
+                            failures.append((source, dest, exc))
+            if failures:
+                for (source, dest, exc) in failures:
+                    print 'FAILED: {0} --> {1}: {2}'.format(source, dest, exc)
+                raise RuntimeError('{0} file(s) could not be copied after {1} retries'.format(
+                    len(failures), args.retries))
+        telemetry.record['status'] = 'success'
+    except Exception as exc:
+        telemetry.record['status'] = 'failed'
+        telemetry.record['error'] = str(exc)
+        raise
     finally:
         # Cleanup
         # ---------------------------------------------------------------------
         print 'CLEANUP'
         os.chdir('..')
         shutil.rmtree(tmp_dir)
+        for f in [time_file, setup_end_file]:
+            if f and os.path.isfile(f):
+                os.remove(f)
+        telemetry.record['end'] = time.time()
+        telemetry.record['phases']['total'] = telemetry.record['end'] - telemetry.record['start']
+        telemetry.write()
 
 
 if __name__ == "__main__":
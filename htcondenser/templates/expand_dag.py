@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+"""
+DAGMan PRE script for a node made with DAGMan.add_expansion(), that calls the
+user's generator to make the node's sub-DAG, once its parents have finished.
+
+Usage: expand_dag.py <spec JSON file>
+"""
+
+
+import sys
+import json
+import logging
+
+
+def main(in_args):
+    if len(in_args) != 1:
+        sys.stderr.write(__doc__)
+        return 2
+    with open(in_args[0]) as sfile:
+        spec = json.load(sfile)
+    # so htcondenser & the generator can be imported as when the DAG was written
+    sys.path[:0] = [str(p) for p in spec['sys_path']]
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    from htcondenser.expansion import run_expansion
+    run_expansion(in_args[0])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+Stand-in for the `hadoop fs` (and `hdfs dfs`) commands used by htcondenser, that stores HDFS
+files under a local directory instead, set by $HTCONDENSER_STORAGE_ROOT.
+
+Used by htcondenser.local.LocalExecutor to run jobs without HTCondor or HDFS.
+Only the commands and options that htcondenser uses are supported.
+
+Usage: hadoop fs -<command> [options] <paths>
+       hdfs dfs -<command> [options] <paths>
+"""
+
+
+import os
+import sys
+import time
+import glob
+import shutil
+
+
+ROOT = os.environ.get('HTCONDENSER_STORAGE_ROOT', '')
+
+
+def local_path(path):
+    """Get the local path for a HDFS path, with or without /hdfs."""
+    if path.startswith('/hdfs/') or path == '/hdfs':
+        path = path[len('/hdfs'):]
+    return os.path.join(ROOT, path.lstrip('/'))
+
+
+def hdfs_path(path):
+    return '/' + os.path.relpath(path, ROOT)
+
+
+def make_parent(path):
+    """Make the parent directory of path, as HDFS does when writing a file."""
+    parent = os.path.dirname(path)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+
+
+def copy(source, dest, force):
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(source.rstrip('/')))
+    if os.path.exists(dest):
+        if not force:
+            sys.stderr.write('%s: File exists\n' % dest)
+            return 1
+        if os.path.isdir(dest):
+            shutil.rmtree(dest)
+    if os.path.isdir(source):
+        shutil.copytree(source, dest)
+    else:
+        shutil.copy(source, dest)
+    return 0
+
+
+def ls_line(path):
+    is_dir = os.path.isdir(path)
+    size = 0 if is_dir else os.path.getsize(path)
+    mtime = time.strftime('%Y-%m-%d %H:%M', time.localtime(os.path.getmtime(path)))
+    return '%s   - user group %10d %s %s' % ('drwxr-xr-x' if is_dir else '-rw-r--r--',
+                                             size, mtime, hdfs_path(path))
+
+
+def main(in_args):
+    if len(in_args) < 2 or in_args[0] not in ['fs', 'dfs']:
+        sys.stderr.write(__doc__)
+        return 2
+    command = in_args[1]
+    flags = [a for a in in_args[2:] if a.startswith('-') and a != '-']
+    args = [a for a in in_args[2:] if not a.startswith('-') or a == '-']
+    force = '-f' in flags
+
+    if command == '-ls':
+        paths = sorted(glob.glob(local_path(args[0])))
+        if not paths:
+            sys.stderr.write('ls: `%s\': No such file or directory\n' % args[0])
+            return 1
+        lines = []
+        for path in paths:
+            if os.path.isdir(path) and '-R' in flags:
+                for root, dirs, names in os.walk(path):
+                    dirs.sort()
+                    lines.extend(ls_line(os.path.join(root, name)) for name in sorted(dirs + names))
+            elif os.path.isdir(path) and '-d' not in flags:
+                lines.extend(ls_line(os.path.join(path, name)) for name in sorted(os.listdir(path)))
+            else:
+                lines.append(ls_line(path))
+        print 'Found %d items' % len(lines)
+        print '\n'.join(lines)
+    elif command == '-mkdir':
+        if not os.path.isdir(local_path(args[0])):
+            os.makedirs(local_path(args[0]))
+    elif command in ['-copyFromLocal', '-put']:
+        source, dest = args
+        if source == '-':
+            dest = local_path(dest)
+            if os.path.exists(dest) and not force:
+                sys.stderr.write('%s: File exists\n' % args[1])
+                return 1
+            make_parent(dest)
+            with open(dest, 'wb') as dfile:
+                shutil.copyfileobj(sys.stdin, dfile)
+            return 0
+        make_parent(local_path(dest))
+        return copy(source, local_path(dest), force)
+    elif command in ['-copyToLocal', '-get']:
+        return copy(local_path(args[0]), args[1], force)
+    elif command == '-cp':
+        make_parent(local_path(args[1]))
+        return copy(local_path(args[0]), local_path(args[1]), force)
+    elif command == '-cat':
+        for path in args:
+            with open(local_path(path), 'rb') as sfile:
+                shutil.copyfileobj(sfile, sys.stdout)
+    elif command == '-stat':
+        fmt, path = args[0], local_path(args[1])
+        if not os.path.exists(path):
+            sys.stderr.write('stat: `%s\': No such file or directory\n' % args[1])
+            return 1
+        is_dir = os.path.isdir(path)
+        print fmt.replace('%F', 'directory' if is_dir else 'regular file') \
+                 .replace('%b', str(0 if is_dir else os.path.getsize(path)))
+    elif command == '-test':
+        return 0 if os.path.exists(local_path(args[0])) else 1
+    elif command == '-rm':
+        for path in args:
+            path = local_path(path)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+    else:
+        sys.stderr.write('Unsupported command %s\n' % command)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,270 @@
+"""
+Classes/functions to recommend the cpus, memory, and disk requests for a
+JobSet from what its previous jobs actually used.
+"""
+
+
+import logging
+import math
+import re
+from htcondenser.userlog import LogAnalyzer, Distribution, find_log_files
+from htcondenser.telemetry import collect_telemetry
+
+
+log = logging.getLogger(__name__)
+
+
+# HTCondor size request, e.g. 2GB, 500 MB, 1024
+SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*([KMGT]?)B?\s*$', re.IGNORECASE)
+
+# Size of each unit in KB
+SIZE_UNITS_KB = {'K': 1, 'M': 1024, 'G': 1024 ** 2, 'T': 1024 ** 3}
+
+# Resources of a typical execute machine, to estimate how many jobs fit on one
+DEFAULT_MACHINE = {'cpus': 8, 'memory': '16GB', 'disk': '100GB'}
+
+
+def parse_size(size, default_unit='M'):
+    """Convert a memory or disk request, e.g. '2GB', to KB.
+
+    Parameters
+    ----------
+    size : str or int
+        Request, as would be given to JobSet.
+
+    default_unit : str, optional
+        Unit if `size` has none. HTCondor uses MB for memory, KB for disk.
+
+    Returns
+    -------
+    int
+        Size in KB.
+
+    Raises
+    ------
+    ValueError
+        If `size` cannot be understood.
+    """
+    match = SIZE_RE.match(str(size))
+    if not match:
+        raise ValueError('Cannot understand size %r' % size)
+    unit = (match.group(2) or default_unit).upper()
+    return int(math.ceil(float(match.group(1)) * SIZE_UNITS_KB[unit]))
+
+
+def _round_up(value, step):
+    return int(math.ceil(value / float(step))) * step
+
+
+def _fraction_above(dist, value):
+    """Fraction of the sampled values in a Distribution above value."""
+    if not dist.sample:
+        return None
+    return sum(1 for x in dist.sample if x > value) / float(len(dist.sample))
+
+
+class ResourceTuner(object):
+    """Recommend cpus, memory, and disk requests for a JobSet, from the usage
+    of the jobs it has already run.
+
+    Usage is read from the JobSet's user logs (memory & disk usage reported
+    by HTCondor), and its telemetry records if `telemetry=True` (maximum RSS
+    and CPU time from `/usr/bin/time -v`, and sandbox disk use). Where both
+    are available, the larger is used, since HTCondor samples memory usage
+    periodically, whilst the RSS only covers the executable.
+
+    Memory & disk are set to a percentile of the usage, times `headroom`,
+    rounded up to `MEMORY_STEP_MB` & `DISK_STEP_KB`. The cpus request is
+    the percentile of CPU time / wall time, rounded up, ignoring the first
+    `CPU_TOLERANCE` of a core, since using more CPU only slows a job down
+    rather than getting it held.
+
+    Parameters
+    ----------
+    jobset : JobSet
+        JobSet to tune.
+
+    percentile : float, optional
+        Percentile (0 - 100) of the usage to request.
+
+    headroom : float, optional
+        Factor to multiply the memory & disk percentiles by, for the jobs
+        that use more.
+
+    min_jobs : int, optional
+        Minimum number of jobs with a measurement needed to recommend a
+        request. Requests with fewer are left as they are.
+
+    state_file : str, optional
+        Passed to LogAnalyzer, so that only new log events are read each time.
+
+    machine : dict, optional
+        Resources of a typical execute machine, to estimate how many jobs fit
+        on one before & after tuning. Defaults to DEFAULT_MACHINE.
+    """
+
+    MEMORY_STEP_MB = 64
+    DISK_STEP_KB = 10 * 1024
+    CPU_TOLERANCE = 0.1
+
+    def __init__(self, jobset, percentile=95, headroom=1.2, min_jobs=10,
+                 state_file=None, machine=None):
+        super(ResourceTuner, self).__init__()
+        self.jobset = jobset
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_jobs = min_jobs
+        self.state_file = state_file
+        self.machine = machine or DEFAULT_MACHINE
+        self.analyzer = None
+        # usage from telemetry records
+        self.rss_mb = Distribution()
+        self.sandbox_kb = Distribution()
+        self.cpu_usage = Distribution()
+
+    def collect(self):
+        """Read the usage of all the JobSet's finished jobs."""
+        self.analyzer = LogAnalyzer(self.state_file)
+        self.analyzer.add_logs(find_log_files(self.jobset))
+        if self.state_file:
+            self.analyzer.save()
+        if not self.jobset.telemetry:
+            return
+        for record in collect_telemetry(self.jobset):
+            resources = record.get('resources', {})
+            if resources.get('max_rss_kb') is not None:
+                self.rss_mb.add(resources['max_rss_kb'] / 1024.)
+            if resources.get('sandbox_kb') is not None:
+                self.sandbox_kb.add(resources['sandbox_kb'])
+            cpu_s = resources.get('cpu_user_s', 0) + resources.get('cpu_sys_s', 0)
+            if resources.get('wall_s'):
+                self.cpu_usage.add(cpu_s / float(resources['wall_s']))
+
+    def _recommend(self, dists, current, to_request):
+        """Make the report entry for one resource.
+
+        Parameters
+        ----------
+        dists : list[Distribution]
+            Measured usage. The one with the largest percentile is used,
+            out of those with enough jobs.
+
+        current : float
+            Current request, in the same units as `dists`.
+
+        to_request : callable
+            Turns the usage percentile into the recommended request, in the
+            same units.
+        """
+        entry = dict(jobs=max(d.count for d in dists), usage=None, current=current,
+                     recommended=None, saving=None,
+                     over_current=None, over_recommended=None)
+        usable = [d for d in dists if d.count >= self.min_jobs]
+        if not usable:
+            return entry
+        dist = max(usable, key=lambda d: d.percentile(self.percentile))
+        usage = dist.percentile(self.percentile)
+        recommended = to_request(usage)
+        entry.update(jobs=dist.count, usage=usage, recommended=recommended,
+                     saving=1 - recommended / float(current) if current else None,
+                     over_current=_fraction_above(dist, current),
+                     over_recommended=_fraction_above(dist, recommended))
+        return entry
+
+    def _jobs_per_machine(self, cpus, memory_mb, disk_kb):
+        return min(self.machine['cpus'] // cpus,
+                   parse_size(self.machine['memory'], 'M') // 1024 // memory_mb,
+                   parse_size(self.machine['disk'], 'K') // disk_kb)
+
+    def report(self):
+        """Get the current & recommended requests.
+
+        Reads the usage with collect() if that has not been done already.
+
+        Returns
+        -------
+        dict
+            For each of `cpus`, `memory_mb`, & `disk_kb`: the number of jobs
+            measured, the usage percentile, the current & recommended
+            requests (None if too few jobs), the fraction of the current
+            request saved, and the fractions of measured jobs that used more
+            than the current & recommended requests. Plus `jobs_per_machine`,
+            how many jobs fit on `machine` with the current & recommended
+            requests, and `slot_saving`, the fraction fewer machines needed.
+        """
+        if self.analyzer is None:
+            self.collect()
+        memory = self._recommend(
+            [self.analyzer.memory_mb, self.rss_mb],
+            parse_size(self.jobset.memory, 'M') // 1024,
+            lambda usage: _round_up(usage * self.headroom, self.MEMORY_STEP_MB))
+        disk = self._recommend(
+            [self.analyzer.disk_kb, self.sandbox_kb],
+            parse_size(self.jobset.disk, 'K'),
+            lambda usage: _round_up(usage * self.headroom, self.DISK_STEP_KB))
+        cpus = self._recommend(
+            [self.cpu_usage], self.jobset.cpus,
+            lambda usage: max(1, int(math.ceil(usage - self.CPU_TOLERANCE))))
+        before = self._jobs_per_machine(cpus['current'], memory['current'], disk['current'])
+        after = self._jobs_per_machine(*[e['recommended'] or e['current']
+                                         for e in [cpus, memory, disk]])
+        return dict(percentile=self.percentile,
+                    headroom=self.headroom,
+                    cpus=cpus,
+                    memory_mb=memory,
+                    disk_kb=disk,
+                    jobs_per_machine=(before, after),
+                    slot_saving=1 - before / float(after) if after else None)
+
+    def apply(self):
+        """Set the JobSet's requests to the recommended ones, where there
+        were enough jobs measured, and log the report.
+
+        Returns
+        -------
+        dict
+            From report().
+        """
+        report = self.report()
+        if report['cpus']['recommended']:
+            self.jobset.cpus = report['cpus']['recommended']
+        if report['memory_mb']['recommended']:
+            self.jobset.memory = '%dMB' % report['memory_mb']['recommended']
+        if report['disk_kb']['recommended']:
+            self.jobset.disk = '%dKB' % report['disk_kb']['recommended']
+        for line in format_report(report).splitlines():
+            log.info(line)
+        return report
+
+
+def format_report(report):
+    """Make a readable table from ResourceTuner.report().
+
+    Parameters
+    ----------
+    report : dict
+        From ResourceTuner.report().
+
+    Returns
+    -------
+    str
+    """
+    def fmt(value, fmt_str='%.0f'):
+        return '-' if value is None else fmt_str % value
+
+    lines = ['%-10s %6s %12s %10s %12s %8s %10s' % ('Resource', 'Jobs',
+                                                    'p%g usage' % report['percentile'],
+                                                    'Current', 'Recommended', 'Saving',
+                                                    'Over req.')]
+    for key, label in [('cpus', 'cpus'), ('memory_mb', 'memory MB'), ('disk_kb', 'disk KB')]:
+        entry = report[key]
+        lines.append('%-10s %6d %12s %10s %12s %8s %10s' % (
+            label, entry['jobs'], fmt(entry['usage'], '%.2f' if key == 'cpus' else '%.0f'),
+            fmt(entry['current']), fmt(entry['recommended']),
+            fmt(entry['saving'] and 100 * entry['saving'], '%.0f%%'),
+            fmt(entry['over_current'] and 100 * entry['over_current'], '%.1f%%')))
+    before, after = report['jobs_per_machine']
+    lines.append('Jobs per machine: %d -> %d (%s fewer slots needed)'
+                 % (before, after, fmt(report['slot_saving'] and 100 * report['slot_saving'],
+                                       '%.0f%%')))
+    return '\n'.join(lines)
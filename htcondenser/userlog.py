@@ -0,0 +1,568 @@
+"""
+Classes/functions to read the HTCondor user (event) logs written by each
+JobSet, and report on queue wait, runtime, evictions, and goodput.
+
+Logs are read as a stream of events, and only the jobs still in progress
+are held in memory, so thousands of log files can be analysed. The byte
+offset reached in each log file can be saved, so that a later analysis only
+reads what has been added since.
+"""
+
+
+import logging
+import os
+import re
+import json
+import heapq
+import random
+import datetime
+from glob import glob
+
+
+log = logging.getLogger(__name__)
+
+
+# First line of each event, e.g.
+# 001 (1234.000.000) 10/27 12:00:00 Job executing on host: <1.2.3.4:5678>
+# Newer HTCondor versions write the date as 2016-10-27 instead of 10/27
+EVENT_RE = re.compile(r'^(\d{3}) \((\d+)\.(\d+)\.\d+\) (\S+ [\d:]+)\s*(.*)$')
+
+# Line that ends each event
+EVENT_END = '...'
+
+# Event codes
+SUBMIT = 0
+EXECUTE = 1
+EVICTED = 4
+TERMINATED = 5
+IMAGE_SIZE = 6
+ABORTED = 9
+HELD = 12
+RELEASED = 13
+
+# Lines in the body of events with useful values
+DAG_NODE_RE = re.compile(r'^\s*DAG Node: (\S+)')
+RETURN_VALUE_RE = re.compile(r'return value (-?\d+)')
+# From IMAGE_SIZE events
+MEMORY_USAGE_RE = re.compile(r'^\s*(\d+)\s+-\s+MemoryUsage of job \(MB\)')
+RSS_RE = re.compile(r'^\s*(\d+)\s+-\s+ResidentSetSize of job \(KB\)')
+# From the resources table in TERMINATED events, e.g.
+#    Memory (MB)          :       12      100      2048
+RESOURCE_RE = re.compile(r'^\s*(Cpus|Disk \(KB\)|Memory \(MB\))\s*:\s*(\d*)\s+(\d+)')
+
+
+class LogEvent(object):
+    """One event from a user log.
+
+    Parameters
+    ----------
+    code : int
+        Event code, e.g. TERMINATED.
+
+    job_id : str
+        cluster.process of the job.
+
+    time : datetime.datetime
+        When the event happened.
+
+    text : str
+        Rest of the first line, e.g. "Job executing on host: ...".
+
+    body : list[str]
+        Other lines in the event.
+    """
+
+    def __init__(self, code, job_id, time, text, body):
+        super(LogEvent, self).__init__()
+        self.code = code
+        self.job_id = job_id
+        self.time = time
+        self.text = text
+        self.body = body
+
+    def __repr__(self):
+        return 'LogEvent(%03d, %s, %s)' % (self.code, self.job_id, self.time)
+
+
+def parse_event_time(date_str, year=None):
+    """Convert the date & time from an event into a datetime.
+
+    Parameters
+    ----------
+    date_str : str
+        e.g. "10/27 12:00:00" or "2016-10-27 12:00:00"
+
+    year : int, optional
+        Year to use for dates without one. Defaults to the current year.
+
+    Returns
+    -------
+    datetime.datetime
+    """
+    if '-' in date_str.split()[0]:
+        return datetime.datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
+    year = year or datetime.date.today().year
+    return datetime.datetime.strptime('%d/%s' % (year, date_str), '%Y/%m/%d %H:%M:%S')
+
+
+def iter_log_events(filename, offset=0, year=None):
+    """Iterate over the events in a user log, starting at a byte offset.
+
+    An unfinished event at the end of the file (e.g. one HTCondor is
+    still writing) is not returned.
+
+    Parameters
+    ----------
+    filename : str
+        User log filename.
+
+    offset : int, optional
+        Byte offset to start at, e.g. from a previous call.
+
+    year : int, optional
+        Year to use for event dates without one.
+
+    Yields
+    ------
+    LogEvent, int
+        Event, and the byte offset just after it.
+    """
+    with open(filename) as lfile:
+        lfile.seek(offset)
+        event = None
+        while True:
+            line = lfile.readline()
+            if not line or not line.endswith('\n'):
+                break
+            line = line.rstrip('\n')
+            if line == EVENT_END:
+                if event:
+                    yield event, lfile.tell()
+                event = None
+                continue
+            match = EVENT_RE.match(line) if event is None else None
+            if match:
+                try:
+                    time = parse_event_time(match.group(4), year)
+                except ValueError:
+                    log.warning('Cannot parse time in %s: %s', filename, line)
+                    time = None
+                event = LogEvent(code=int(match.group(1)),
+                                 job_id='%d.%d' % (int(match.group(2)), int(match.group(3))),
+                                 time=time, text=match.group(5), body=[])
+            elif event is not None:
+                event.body.append(line)
+
+
+def _seconds(start, end):
+    """Get seconds between two datetimes, or None if either is None."""
+    if start is None or end is None:
+        return None
+    delta = end - start
+    return delta.days * 86400 + delta.seconds
+
+
+class JobRecord(object):
+    """What happened to one job, built up from its log events.
+
+    Attributes
+    ----------
+    job_id : str
+        cluster.process
+    name : str
+        DAG node name if known, otherwise the job ID.
+    queue_wait : int
+        Seconds from submission to first starting to run.
+    goodput : int
+        Seconds spent running the execution that finished.
+    badput : int
+        Seconds spent running executions that were evicted, held, or aborted.
+    memory_mb : int
+        Largest memory usage reported, in MB.
+    """
+
+    def __init__(self, job_id):
+        super(JobRecord, self).__init__()
+        self.job_id = job_id
+        self.name = job_id
+        self.submit_time = None
+        self.first_execute_time = None
+        self.execute_time = None
+        self.end_time = None
+        self.queue_wait = None
+        self.executions = 0
+        self.evictions = 0
+        self.holds = 0
+        self.goodput = 0
+        self.badput = 0
+        self.return_value = None
+        self.aborted = False
+        self.memory_mb = None
+        self.rss_kb = None
+        self.disk_kb = None
+        self.request_memory_mb = None
+        self.request_disk_kb = None
+
+    @property
+    def done(self):
+        return self.end_time is not None
+
+    @property
+    def runtime(self):
+        """Seconds the final execution ran for."""
+        return self.goodput if self.done and not self.aborted else None
+
+    def _end_execution(self, event, good):
+        run = _seconds(self.execute_time, event.time)
+        if run is not None:
+            if good:
+                self.goodput += run
+            else:
+                self.badput += run
+        self.execute_time = None
+
+    def add_event(self, event):
+        """Update the record with a log event for this job."""
+        if event.code == SUBMIT:
+            self.submit_time = event.time
+            for line in event.body:
+                match = DAG_NODE_RE.match(line)
+                if match:
+                    self.name = match.group(1)
+        elif event.code == EXECUTE:
+            self.executions += 1
+            self.execute_time = event.time
+            if self.first_execute_time is None:
+                self.first_execute_time = event.time
+                self.queue_wait = _seconds(self.submit_time, event.time)
+        elif event.code == EVICTED:
+            self.evictions += 1
+            self._end_execution(event, good=False)
+        elif event.code == HELD:
+            self.holds += 1
+            if self.execute_time:
+                self._end_execution(event, good=False)
+        elif event.code == ABORTED:
+            self.aborted = True
+            if self.execute_time:
+                self._end_execution(event, good=False)
+            self.end_time = event.time
+        elif event.code == TERMINATED:
+            self._end_execution(event, good=True)
+            self.end_time = event.time
+            for line in event.body:
+                match = RETURN_VALUE_RE.search(line)
+                if match:
+                    self.return_value = int(match.group(1))
+                match = RESOURCE_RE.match(line)
+                if match and match.group(1).startswith('Memory'):
+                    if match.group(2):
+                        self.memory_mb = max(self.memory_mb or 0, int(match.group(2)))
+                    self.request_memory_mb = int(match.group(3))
+                elif match and match.group(1).startswith('Disk'):
+                    if match.group(2):
+                        self.disk_kb = max(self.disk_kb or 0, int(match.group(2)))
+                    self.request_disk_kb = int(match.group(3))
+        elif event.code == IMAGE_SIZE:
+            for line in event.body:
+                match = MEMORY_USAGE_RE.match(line)
+                if match:
+                    self.memory_mb = max(self.memory_mb or 0, int(match.group(1)))
+                match = RSS_RE.match(line)
+                if match:
+                    self.rss_kb = max(self.rss_kb or 0, int(match.group(1)))
+
+    def to_dict(self):
+        """Get the record as a dict that can be stored as JSON."""
+        return dict((k, v.isoformat() if isinstance(v, datetime.datetime) else v)
+                    for k, v in self.__dict__.iteritems())
+
+    @classmethod
+    def from_dict(cls, contents):
+        """Make a record from the output of to_dict()."""
+        record = cls(contents['job_id'])
+        for k, v in contents.iteritems():
+            if k.endswith('_time') and v:
+                v = datetime.datetime.strptime(v, '%Y-%m-%dT%H:%M:%S')
+            setattr(record, k, v)
+        return record
+
+
+class Distribution(object):
+    """Running statistics of a set of values, in fixed memory.
+
+    Percentiles are estimated from a random sample of up to `sample_size`
+    values (reservoir sampling), so are exact until there are more values
+    than that.
+
+    Parameters
+    ----------
+    sample_size : int, optional
+        Maximum number of values to keep for percentiles.
+    """
+
+    def __init__(self, sample_size=10000):
+        super(Distribution, self).__init__()
+        self.sample_size = sample_size
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.sample = []
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.sample) < self.sample_size:
+            self.sample.append(value)
+        else:
+            i = random.randint(0, self.count - 1)
+            if i < self.sample_size:
+                self.sample[i] = value
+
+    def percentile(self, pct):
+        """Get a percentile (0 - 100), or None if there are no values."""
+        if not self.sample:
+            return None
+        ordered = sorted(self.sample)
+        return ordered[min(int(round(pct / 100. * (len(ordered) - 1))), len(ordered) - 1)]
+
+    def summary(self):
+        """Get count, mean, min, max, and 50th/90th/99th percentiles."""
+        return dict(count=self.count,
+                    mean=self.total / float(self.count) if self.count else None,
+                    min=self.min, max=self.max,
+                    p50=self.percentile(50), p90=self.percentile(90), p99=self.percentile(99))
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, contents):
+        dist = cls()
+        dist.__dict__.update(contents)
+        return dist
+
+
+class LogAnalyzer(object):
+    """Read user logs and build up statistics on the jobs in them.
+
+    Only jobs that have not finished are held individually. Finished jobs
+    are added to the statistics and dropped, apart from the `n_slowest`
+    with the longest runtime.
+
+    Parameters
+    ----------
+    state_file : str, optional
+        JSON file to load the progress (byte offsets, unfinished jobs, &
+        statistics) of a previous analysis from, and to save it to with
+        save(). Then only new events are read on the next analysis.
+
+    n_slowest : int, optional
+        Number of slowest jobs to keep.
+
+    year : int, optional
+        Year to use for log event dates without one.
+    """
+
+    def __init__(self, state_file=None, n_slowest=10, year=None):
+        super(LogAnalyzer, self).__init__()
+        self.state_file = state_file
+        self.n_slowest = n_slowest
+        self.year = year
+        self.offsets = {}
+        self.open_jobs = {}
+        self.queue_wait = Distribution()
+        self.runtime = Distribution()
+        self.memory_mb = Distribution()
+        self.disk_kb = Distribution()
+        self.counts = dict(jobs=0, succeeded=0, failed=0, aborted=0, evictions=0,
+                           evicted_jobs=0, holds=0, executions=0)
+        self.goodput = 0
+        self.badput = 0
+        # heap of (runtime, name, job_id)
+        self.slowest = []
+        if state_file and os.path.isfile(state_file):
+            self.load()
+
+    def add_log(self, filename):
+        """Read any new events in a log file.
+
+        Parameters
+        ----------
+        filename : str
+            User log filename.
+
+        Returns
+        -------
+        int
+            Number of events read.
+        """
+        key = os.path.abspath(filename)
+        offset = self.offsets.get(key, 0)
+        if os.path.getsize(filename) < offset:
+            log.warning('%s is smaller than when last read, reading from the start', filename)
+            offset = 0
+        n_events = 0
+        for event, offset in iter_log_events(filename, offset, self.year):
+            self.add_event(event)
+            n_events += 1
+        self.offsets[key] = offset
+        return n_events
+
+    def add_logs(self, filenames):
+        """Read any new events in several log files. Returns the number of events read."""
+        n_events = 0
+        for filename in filenames:
+            try:
+                n_events += self.add_log(filename)
+            except (IOError, OSError) as err:
+                log.warning('Cannot read log file %s: %s', filename, err)
+        return n_events
+
+    def add_event(self, event):
+        """Add one LogEvent."""
+        job = self.open_jobs.get(event.job_id)
+        if job is None:
+            job = self.open_jobs[event.job_id] = JobRecord(event.job_id)
+        job.add_event(event)
+        if job.done:
+            del self.open_jobs[event.job_id]
+            self._add_finished(job)
+
+    def _add_finished(self, job):
+        self.counts['jobs'] += 1
+        self.counts['executions'] += job.executions
+        self.counts['evictions'] += job.evictions
+        self.counts['holds'] += job.holds
+        if job.evictions:
+            self.counts['evicted_jobs'] += 1
+        if job.aborted:
+            self.counts['aborted'] += 1
+        elif job.return_value == 0:
+            self.counts['succeeded'] += 1
+        else:
+            self.counts['failed'] += 1
+        self.goodput += job.goodput
+        self.badput += job.badput
+        if job.queue_wait is not None:
+            self.queue_wait.add(job.queue_wait)
+        if job.memory_mb is not None:
+            self.memory_mb.add(job.memory_mb)
+        if job.disk_kb is not None:
+            self.disk_kb.add(job.disk_kb)
+        if job.runtime is not None:
+            self.runtime.add(job.runtime)
+            entry = (job.runtime, job.name, job.job_id)
+            if len(self.slowest) < self.n_slowest:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def report(self):
+        """Get a summary of everything read so far.
+
+        Returns
+        -------
+        dict
+            Job counts, distributions (count, mean, min, max, percentiles)
+            of queue wait & runtime in seconds, memory usage in MB and
+            disk usage in KB,
+            goodput & badput in seconds, the fraction of run time that was
+            goodput, and the slowest jobs as (runtime, name, job ID).
+        """
+        total_run = self.goodput + self.badput
+        return dict(counts=dict(self.counts, running_or_idle=len(self.open_jobs)),
+                    queue_wait=self.queue_wait.summary(),
+                    runtime=self.runtime.summary(),
+                    memory_mb=self.memory_mb.summary(),
+                    disk_kb=self.disk_kb.summary(),
+                    goodput=self.goodput,
+                    badput=self.badput,
+                    efficiency=self.goodput / float(total_run) if total_run else None,
+                    slowest=sorted(self.slowest, reverse=True))
+
+    def save(self, state_file=None):
+        """Save progress to a JSON file, by default `state_file`."""
+        state_file = state_file or self.state_file
+        state = dict(offsets=self.offsets,
+                     open_jobs=[j.to_dict() for j in self.open_jobs.itervalues()],
+                     queue_wait=self.queue_wait.to_dict(),
+                     runtime=self.runtime.to_dict(),
+                     memory_mb=self.memory_mb.to_dict(),
+                     disk_kb=self.disk_kb.to_dict(),
+                     counts=self.counts,
+                     goodput=self.goodput,
+                     badput=self.badput,
+                     slowest=self.slowest)
+        tmp_file = state_file + '.tmp'
+        with open(tmp_file, 'w') as sfile:
+            json.dump(state, sfile)
+        os.rename(tmp_file, state_file)
+
+    def load(self, state_file=None):
+        """Load progress from a JSON file, by default `state_file`."""
+        with open(state_file or self.state_file) as sfile:
+            state = json.load(sfile)
+        self.offsets = state['offsets']
+        self.open_jobs = dict((j['job_id'], JobRecord.from_dict(j)) for j in state['open_jobs'])
+        for name in ['queue_wait', 'runtime', 'memory_mb', 'disk_kb']:
+            if name in state:
+                setattr(self, name, Distribution.from_dict(state[name]))
+        self.counts = state['counts']
+        self.goodput = state['goodput']
+        self.badput = state['badput']
+        self.slowest = [tuple(x) for x in state['slowest']]
+        heapq.heapify(self.slowest)
+
+
+def find_log_files(jobset):
+    """Get the user log files for a JobSet.
+
+    Parameters
+    ----------
+    jobset : JobSet
+
+    Returns
+    -------
+    list[str]
+        Log filenames.
+    """
+    # Replace any HTCondor macros, e.g. $(cluster), with a wildcard
+    pattern = re.sub(r'\$\(\w+\)', '*', os.path.join(jobset.log_dir, jobset.log_file))
+    return sorted(glob(pattern))
+
+
+def analyse_logs(jobsets, state_file=None, n_slowest=10):
+    """Analyse the user logs for one or more JobSets.
+
+    Parameters
+    ----------
+    jobsets : JobSet or iterable[JobSet]
+        JobSet(s) to analyse, e.g. `DAGMan.get_jobsets()`.
+
+    state_file : str, optional
+        If set, resume from the progress saved in this file, and save the
+        new progress to it afterwards.
+
+    n_slowest : int, optional
+        Number of slowest jobs to report.
+
+    Returns
+    -------
+    dict
+        From LogAnalyzer.report().
+    """
+    if hasattr(jobsets, 'log_file'):
+        jobsets = [jobsets]
+    analyzer = LogAnalyzer(state_file, n_slowest)
+    filenames = set()
+    for jobset in jobsets:
+        filenames.update(find_log_files(jobset))
+    log.info('Reading %d log files', len(filenames))
+    analyzer.add_logs(sorted(filenames))
+    if state_file:
+        analyzer.save()
+    return analyzer.report()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+Stand-in for `hadoop fs` that stores files locally like
+htcondenser/templates/local_hadoop.py, but whose first copies go wrong, to
+test retrying transfers.
+
+Set $FLAKY_HADOOP_FAILURES to the number of copies (-copyToLocal, -get,
+-copyFromLocal, -put) to break, $FLAKY_HADOOP_COUNTER to a file to count
+copies in, and $FLAKY_HADOOP_MODE to:
+
+- 'fail': write half the file to the destination, then fail
+- 'corrupt': write half the file to the destination, but succeed
+"""
+
+
+import os
+import sys
+import imp
+
+
+local_hadoop = imp.load_source(
+    'local_hadoop', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.pardir, 'htcondenser', 'templates', 'local_hadoop.py'))
+
+COPY_COMMANDS = ['-copyToLocal', '-get', '-copyFromLocal', '-put']
+
+
+def count_copy():
+    """Increment the copy counter, and return the new count."""
+    counter = os.environ['FLAKY_HADOOP_COUNTER']
+    count = 1
+    if os.path.isfile(counter):
+        with open(counter) as cfile:
+            count += int(cfile.read())
+    with open(counter, 'w') as cfile:
+        cfile.write(str(count))
+    return count
+
+
+def write_partial(source, dest):
+    """Write the first half of source to dest, as an interrupted copy would."""
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(source))
+    local_hadoop.make_parent(dest)
+    with open(source, 'rb') as sfile:
+        data = sfile.read()
+    with open(dest, 'wb') as dfile:
+        dfile.write(data[:len(data) // 2])
+
+
+def main(in_args):
+    args = [a for a in in_args[2:] if not a.startswith('-')]
+    if (len(in_args) < 2 or in_args[1] not in COPY_COMMANDS or
+            count_copy() > int(os.environ.get('FLAKY_HADOOP_FAILURES', 0))):
+        return local_hadoop.main(in_args)
+    if in_args[1] in ['-copyToLocal', '-get']:
+        write_partial(local_hadoop.local_path(args[0]), args[1])
+    else:
+        write_partial(args[0], local_hadoop.local_path(args[1]))
+    return 1 if os.environ.get('FLAKY_HADOOP_MODE') == 'fail' else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
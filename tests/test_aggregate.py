@@ -0,0 +1,118 @@
+"""
+Tests for archiving small output files with JobSet(aggregate_outputs=True),
+and reading them back with htcondenser.aggregate.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+import htcondenser as ht
+from htcondenser.local import LocalExecutor
+from htcondenser.aggregate import OutputArchive, merge_archives
+
+
+SMALL = '0123456789abcdefghij'
+NOTE = 'a note'
+BIG = 'x' * 200
+
+
+class TestOutputArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.store = os.path.join(self.work_dir, 'store')
+        self.executor = LocalExecutor(processes=2, storage_root=self.store)
+        self.exe = os.path.join(self.work_dir, 'write.sh')
+        with open(self.exe, 'w') as efile:
+            efile.write('#!/bin/sh\nprintf "%s" > small.txt\nprintf "%s" > note.txt\n'
+                        'printf "%s" > big.txt\n' % (SMALL, NOTE, BIG))
+        os.chmod(self.exe, 0755)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def run_jobs(self, names):
+        """Run a Job for each name, whose outputs of 20 bytes or less are archived."""
+        log_dir = os.path.join(self.work_dir, 'logs')
+        with self.executor.storage():
+            jobset = ht.JobSet(exe=self.exe, filename=os.path.join(self.work_dir, 'jobs.condor'),
+                               out_dir=log_dir, err_dir=log_dir, log_dir=log_dir,
+                               hdfs_store='/hdfs/test/jobs', aggregate_outputs=True,
+                               aggregate_max_size=len(SMALL))
+        for name in names:
+            jobset.add_job(ht.Job(name=name, args=[name],
+                                  output_files=['small.txt', 'note.txt', 'big.txt'],
+                                  output_codec={'note.txt': 'gzip'}))
+        results = self.executor.run_jobset(jobset)
+        self.assertTrue(all(code == 0 for code in results.values()))
+        return jobset
+
+    def local(self, filename):
+        """Get where a file on /hdfs is stored for these tests."""
+        return os.path.join(self.store, os.path.relpath(filename, '/hdfs'))
+
+    def test_size_limit(self):
+        """Only files up to aggregate_max_size bytes go in the archive."""
+        jobset = self.run_jobs(['job0'])
+        job = jobset.jobs['job0']
+        self.assertEqual(sorted(os.listdir(self.local(job.hdfs_mirror_dir))),
+                         ['big.txt', 'job0.outputs.zip'])
+        with OutputArchive(self.local(job.output_archive)) as archive:
+            self.assertEqual(archive.names(), ['/hdfs/test/jobs/job0/note.txt',
+                                               '/hdfs/test/jobs/job0/small.txt'])
+            small = '/hdfs/test/jobs/job0/small.txt'
+            self.assertEqual(archive.read(small), SMALL)
+            self.assertEqual(archive.size(small), len(SMALL))
+            self.assertEqual(archive.compress_type(small), zipfile.ZIP_STORED)
+            with open(archive.filename, 'rb') as afile:
+                afile.seek(archive.offset(small))
+                self.assertEqual(afile.read(len(SMALL)), SMALL)
+            # compressed in the archive, rather than as a .gz file
+            self.assertIn('hdfs/test/jobs/job0/note.txt.gz', archive)
+            self.assertEqual(archive.read('/hdfs/test/jobs/job0/note.txt.gz'), NOTE)
+            self.assertEqual(archive.compress_type('/hdfs/test/jobs/job0/note.txt'),
+                             zipfile.ZIP_DEFLATED)
+            self.assertNotIn('/hdfs/test/jobs/job0/big.txt', archive)
+            with self.assertRaises(KeyError):
+                archive.read('/hdfs/test/jobs/job0/big.txt')
+
+    def test_merge(self):
+        """Merged archives have every file, each with its compression."""
+        jobset = self.run_jobs(['job0', 'job1'])
+        merged = os.path.join(self.work_dir, 'merged.zip')
+        merge_archives([self.local(job.output_archive) for job in jobset.jobs.values()], merged)
+        with OutputArchive(merged) as archive:
+            self.assertEqual(len(archive), 4)
+            for name in ['job0', 'job1']:
+                note = '/hdfs/test/jobs/%s/note.txt' % name
+                self.assertEqual(archive.read(note), NOTE)
+                self.assertEqual(archive.compress_type(note), zipfile.ZIP_DEFLATED)
+                self.assertEqual(archive.compress_type('/hdfs/test/jobs/%s/small.txt' % name),
+                                 zipfile.ZIP_STORED)
+
+    def test_merge_precedence(self):
+        """Later archives take precedence for files with the same name."""
+        archives = []
+        for i, contents in enumerate(['first', 'second']):
+            archives.append(os.path.join(self.work_dir, 'a%d.zip' % i))
+            with zipfile.ZipFile(archives[-1], 'w') as zfile:
+                zfile.writestr('data/a.txt', contents)
+                zfile.writestr('data/%d.txt' % i, contents)
+        merged = os.path.join(self.work_dir, 'merged.zip')
+        merge_archives(archives, merged)
+        with OutputArchive(merged) as archive:
+            self.assertEqual(archive.names(), ['/data/0.txt', '/data/1.txt', '/data/a.txt'])
+            self.assertEqual(archive.read('/data/a.txt'), 'second')
+
+    def test_bad_archive(self):
+        with self.assertRaises(IOError):
+            OutputArchive(self.exe)
+
+
+if __name__ == '__main__':
+    unittest.main()
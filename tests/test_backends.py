@@ -0,0 +1,185 @@
+"""
+Tests for submitting JobSets with htcondenser.backends, using FakeSchedd in
+place of HTCondor.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import htcondenser as ht
+from subprocess import CalledProcessError
+from htcondenser import backends
+from htcondenser.backends import (CondorCommandBackend, PythonBindingsBackend, ShardSubmitter,
+                                  FakeSchedd, parse_environment)
+
+
+class BackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.log_dir = os.path.join(self.work_dir, 'logs')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_jobset(self, n_jobs, **kwargs):
+        """Make & write a JobSet of n_jobs Jobs, named job0, job1, ..."""
+        jobset = ht.JobSet(exe='/bin/echo', filename=os.path.join(self.work_dir, 'jobs.condor'),
+                           out_dir=self.log_dir, err_dir=self.log_dir, log_dir=self.log_dir,
+                           hdfs_store=os.path.join(self.work_dir, 'store'), **kwargs)
+        for i in xrange(n_jobs):
+            jobset.add_job(ht.Job(name='job%d' % i, args=['hello', str(i)]))
+        jobset.write(dag_mode=False)
+        return jobset
+
+
+class FakeSubmit(dict):
+    """Stand-in for htcondor.Submit, whose DAGMan job already has an environment."""
+
+    environment = '"FOO=bar _CONDOR_DAGMAN_MAX_SUBMITS_PER_INTERVAL=5 MSG=\'hello world\'"'
+
+    @classmethod
+    def from_dag(cls, filename, options):
+        return cls(universe='scheduler', dag_file=filename, environment=cls.environment,
+                   **options)
+
+
+class FakeHTCondor(object):
+    """Stand-in for the htcondor module."""
+    Submit = FakeSubmit
+
+
+class TestPythonBindingsBackend(BackendTestCase):
+
+    def setUp(self):
+        super(TestPythonBindingsBackend, self).setUp()
+        self.schedd = FakeSchedd(first_cluster=10)
+
+    def test_itemdata_args(self):
+        """All jobs go in one cluster, with their arguments as item data."""
+        jobset = self.make_jobset(3)
+        jobset.jobs['job1'].quantity = 2
+        result = PythonBindingsBackend(self.schedd).submit_jobset(jobset)
+        self.assertEqual((result.cluster, result.num_procs), (10, 4))
+        self.assertEqual(result.ids_by_name(), {'job0': ['10.0'], 'job1': ['10.1', '10.2'],
+                                                'job2': ['10.3']})
+        ads = self.schedd.cluster_jobs(10)
+        expected = [jobset.jobs[name].generate_job_arg_str()
+                    for name in ['job0', 'job1', 'job1', 'job2']]
+        self.assertEqual([ad['arguments'] for ad in ads], ['"%s"' % a for a in expected])
+        self.assertIn('hello 1', expected[1])
+        self.assertTrue(all(ad['Executable'].endswith('condor_worker.py') for ad in ads))
+        self.assertNotIn('max_materialize', ads[0])
+
+    def test_max_materialize(self):
+        """late_materialization sets max_materialize."""
+        jobset = self.make_jobset(2)
+        PythonBindingsBackend(self.schedd, late_materialization=50).submit_jobset(jobset)
+        self.assertEqual([ad['max_materialize'] for ad in self.schedd.cluster_jobs(10)],
+                         ['50', '50'])
+
+    def test_failed_transaction(self):
+        """If the transaction fails, no jobs are submitted."""
+        backend = PythonBindingsBackend(self.schedd)
+        backend.submit_jobset(self.make_jobset(2))
+        self.schedd.fail_after = 3
+        with self.assertRaises(RuntimeError):
+            backend.submit_jobset(self.make_jobset(2))
+        self.assertEqual(self.schedd.jobs.keys(), [(10, 0), (10, 1)])
+        self.schedd.fail_after = None
+        self.assertEqual(backend.submit_jobset(self.make_jobset(2)).cluster, 11)
+
+    def test_dag_environment(self):
+        """The DAGMan job keeps its environment, with the submit rate replaced."""
+        old_htcondor = backends.htcondor
+        backends.htcondor = FakeHTCondor
+        try:
+            dag = ht.DAGMan(filename=os.path.join(self.work_dir, 'jobs.dag'))
+            result = PythonBindingsBackend(self.schedd).submit_dag(dag, force=True,
+                                                                   submit_per_interval=20)
+        finally:
+            backends.htcondor = old_htcondor
+        ad = self.schedd.cluster_jobs(result.cluster)[0]
+        self.assertEqual(ad['dag_file'], dag.dag_filename)
+        self.assertEqual(ad['force'], '1')
+        self.assertEqual(parse_environment(ad['environment']),
+                         [('_CONDOR_DAGMAN_MAX_SUBMITS_PER_INTERVAL', '20'),
+                          ('FOO', 'bar'), ('MSG', 'hello world')])
+
+    def test_parse_old_environment(self):
+        """The old semicolon-separated environment syntax is understood too."""
+        self.assertEqual(parse_environment('FOO=bar; A=1'), [('FOO', 'bar'), ('A', '1')])
+
+
+class TestCondorCommandBackend(unittest.TestCase):
+
+    def test_cluster_id(self):
+        """The cluster ID & number of jobs are read from the command output."""
+        output = 'Submitting job(s)...\n3 job(s) submitted to cluster 1234.'
+        self.assertEqual(CondorCommandBackend().run(['echo', output]), (1234, 3))
+
+    def test_no_cluster_id(self):
+        with self.assertRaises(RuntimeError):
+            CondorCommandBackend().run(['echo', 'Submitting job(s)'])
+
+    def test_failure(self):
+        with self.assertRaises(CalledProcessError) as context:
+            CondorCommandBackend().run(['sh', '-c', 'echo "ERROR: no schedd"; exit 1'])
+        self.assertIn('no schedd', context.exception.output)
+
+
+class TestShardSubmitter(BackendTestCase):
+
+    def setUp(self):
+        super(TestShardSubmitter, self).setUp()
+        self.jobset = self.make_jobset(6, shard_size=2)
+        self.state_file = self.jobset.shard_state_filename
+        # one submitter, so shards are submitted in order
+        self.schedd = FakeSchedd(first_cluster=100, fail_after=4)
+        self.submitter = ShardSubmitter(PythonBindingsBackend(self.schedd), submitters=1,
+                                        max_attempts=2, retry_wait=0)
+
+    def read_state(self):
+        with open(self.state_file) as sfile:
+            return json.load(sfile)
+
+    def test_failed_shard(self):
+        """A shard that keeps failing stops submit(), but earlier shards are recorded."""
+        self.assertEqual(len(self.jobset.shards), 3)
+        with self.assertRaises(RuntimeError):
+            self.submitter.submit(self.jobset.shards, state_file=self.state_file)
+        state = self.read_state()
+        self.assertEqual(sorted(state), [f for f, _ in self.jobset.shards[:2]])
+        self.assertEqual([state[f]['cluster'] for f, _ in self.jobset.shards[:2]], [100, 101])
+        self.assertEqual(len(self.schedd.jobs), 4)
+
+    def test_resume(self):
+        """With resume=True, only shards not in the state file are submitted."""
+        with self.assertRaises(RuntimeError):
+            self.submitter.submit(self.jobset.shards, state_file=self.state_file)
+        self.schedd.fail_after = None
+        results = self.submitter.submit(self.jobset.shards, state_file=self.state_file,
+                                        resume=True)
+        self.assertEqual([r.cluster for r in results], [100, 101, 102])
+        self.assertEqual(len(self.schedd.jobs), 6)
+        self.assertEqual(sorted(self.read_state()), sorted(f for f, _ in self.jobset.shards))
+        self.assertEqual(results[0].ids_by_name().keys(), ['job0', 'job1'])
+        self.assertEqual(results[2].ids_by_name(), {'job4': ['102.0'], 'job5': ['102.1']})
+
+    def test_no_resume(self):
+        """Without resume, every shard is submitted again."""
+        with self.assertRaises(RuntimeError):
+            self.submitter.submit(self.jobset.shards, state_file=self.state_file)
+        self.schedd.fail_after = None
+        results = self.submitter.submit(self.jobset.shards, state_file=self.state_file)
+        self.assertEqual([r.cluster for r in results], [102, 103, 104])
+        self.assertEqual(len(self.schedd.jobs), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
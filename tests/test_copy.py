@@ -0,0 +1,89 @@
+"""
+Tests for the fast local file copies in htcondenser.common, and the
+same code in condor_worker.py.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import imp
+import shutil
+import tempfile
+import unittest
+from htcondenser import common
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+condor_worker = imp.load_source(
+    'condor_worker', os.path.join(TESTS_DIR, os.pardir, 'htcondenser', 'templates',
+                                  'condor_worker.py'))
+
+
+class CopyTests(object):
+    """Tests run against both htcondenser.common and condor_worker.py,
+    which is `module`."""
+
+    module = None
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.src = os.path.join(self.work_dir, 'src.txt')
+        self.contents = 'some data\n' * 10000
+        with open(self.src, 'w') as sfile:
+            sfile.write(self.contents)
+        self.old_strategies = self.module.COPY_STRATEGIES
+        self.old_copy_file_range = self.module._COPY_FILE_RANGE
+
+    def tearDown(self):
+        self.module.COPY_STRATEGIES = self.old_strategies
+        self.module._COPY_FILE_RANGE = self.old_copy_file_range
+        shutil.rmtree(self.work_dir)
+
+    def read(self, filename):
+        with open(filename) as ffile:
+            return ffile.read()
+
+    def test_copy(self):
+        dest = os.path.join(self.work_dir, 'dest.txt')
+        self.assertIn(self.module.copy_file(self.src, dest),
+                      [name for name, _ in self.module.COPY_STRATEGIES])
+        self.assertEqual(self.read(dest), self.contents)
+
+    def test_short_copy(self):
+        """A kernel copy that stops early falls through to the next strategy."""
+        calls = []
+
+        def stop_early(src_fd, src_offset, dest_fd, dest_offset, nbytes, flags):
+            calls.append(nbytes)
+            return 0 if calls[1:] else 10
+
+        self.module._COPY_FILE_RANGE = stop_early
+        self.module.COPY_STRATEGIES = [s for s in self.old_strategies
+                                       if s[0] in ['copy_file_range', 'buffered']]
+        dest = os.path.join(self.work_dir, 'dest.txt')
+        self.assertEqual(self.module.copy_file(self.src, dest), 'buffered')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.read(dest), self.contents)
+
+    def test_same_file(self):
+        """Copying a file onto itself fails without truncating it."""
+        for dest in [self.src, self.work_dir]:
+            with self.assertRaises(shutil.Error):
+                self.module.copy_file(self.src, dest)
+            with self.assertRaises(shutil.Error):
+                self.module.copy_file(self.src, dest, hardlink=True)
+        self.assertEqual(self.read(self.src), self.contents)
+
+
+class TestCommonCopy(CopyTests, unittest.TestCase):
+    module = common
+
+
+class TestWorkerCopy(CopyTests, unittest.TestCase):
+    module = condor_worker
+
+
+if __name__ == '__main__':
+    unittest.main()
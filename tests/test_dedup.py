@@ -0,0 +1,118 @@
+"""
+Tests for removing duplicate Jobs from a DAG with htcondenser.dedup.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import htcondenser as ht
+from htcondenser.local import LocalExecutor
+from htcondenser.dedup import (remove_duplicate_jobs, job_fingerprint, topological_order,
+                               format_report)
+
+
+class TestRemoveDuplicateJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.executor = LocalExecutor(storage_root=os.path.join(self.work_dir, 'store'))
+        self.store = '/hdfs/test/store'
+        self.exe = os.path.join(self.work_dir, 'run.sh')
+        with open(self.exe, 'w') as efile:
+            efile.write('#!/bin/sh\necho "$@"\n')
+        self.dag = ht.DAGMan(filename=os.path.join(self.work_dir, 'jobs.dag'))
+        self.jobset = self.make_jobset('jobs')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_jobset(self, name, **kwargs):
+        log_dir = os.path.join(self.work_dir, 'logs')
+        with self.executor.storage():
+            return ht.JobSet(exe=self.exe, filename=os.path.join(self.work_dir, name + '.condor'),
+                             out_dir=log_dir, err_dir=log_dir, log_dir=log_dir,
+                             hdfs_store=self.store, **kwargs)
+
+    def add_job(self, name, requires=None, jobset=None, retry=None, **kwargs):
+        job = ht.Job(name=name, **kwargs)
+        (self.jobset if jobset is None else jobset).add_job(job)
+        self.dag.add_job(job, requires=requires, retry=retry)
+        return job
+
+    def output(self, name):
+        """Output file on HDFS of a Job made by add_chain()."""
+        return os.path.join(self.store, name, 'data.txt')
+
+    def add_chain(self, suffix, retry=None):
+        """Add a Job making data.txt, and a Job reading it."""
+        self.add_job('gen' + suffix, args=['make', 'data.txt'], output_files=['data.txt'],
+                     retry=retry)
+        self.add_job('ana' + suffix, requires='gen' + suffix,
+                     args=['read', self.output('gen' + suffix)],
+                     input_files=[self.output('gen' + suffix)], output_files=['hist.txt'])
+
+    def test_remap_outputs(self):
+        """Children of removed Jobs read the kept Job's outputs, and are merged too."""
+        self.add_chain('1')
+        self.add_chain('2', retry=3)
+        summary = self.add_job('summary', requires=['ana1', 'ana2'],
+                               args=[self.output('gen1'), self.output('gen2')])
+        report = remove_duplicate_jobs(self.dag)
+
+        self.assertEqual(self.dag.jobs.keys(), ['gen1', 'ana1', 'summary'])
+        self.assertEqual(self.jobset.jobs.keys(), ['gen1', 'ana1', 'summary'])
+        self.assertEqual(report['duplicates'], {'gen1': ['gen2'], 'ana1': ['ana2']})
+        self.assertEqual((report['jobs'], report['removed'], report['unestimated']), (5, 2, 2))
+        self.assertEqual(report['hours_saved'], 0)
+        self.assertEqual(self.dag.jobs['summary']['requires'], ['ana1'])
+        self.assertEqual(self.dag.jobs['gen1']['retry'], 3)
+        self.assertEqual(summary.args, [self.output('gen1'), self.output('gen1')])
+        self.assertIn('Removed 2 duplicate Jobs of 5', format_report(report))
+
+    def test_acyclic(self):
+        """Every remaining requirement is a Job in the DAG that comes first."""
+        self.add_chain('1')
+        self.add_job('other', args=['other'], output_files=['other.txt'])
+        self.add_chain('2')
+        self.dag.jobs['gen2']['requires'] = ['other']
+        remove_duplicate_jobs(self.dag)
+
+        order = topological_order(self.dag)
+        self.assertEqual(sorted(order), sorted(self.dag.jobs))
+        for name, info in self.dag.jobs.iteritems():
+            for parent in info['requires']:
+                self.assertIn(parent, self.dag.jobs)
+                self.assertLess(order.index(parent), order.index(name))
+        self.assertEqual(self.dag.jobs['gen1']['requires'], ['other'])
+
+    def test_keep_descendant(self):
+        """A Job is not merged into a Job it depends on."""
+        self.add_job('first', args=['step'], output_files=['out.txt'])
+        self.add_job('second', requires='first', args=['step'], output_files=['out.txt'])
+        self.assertEqual(job_fingerprint(self.jobset.jobs['first']),
+                         job_fingerprint(self.jobset.jobs['second']))
+        self.assertEqual(remove_duplicate_jobs(self.dag)['removed'], 0)
+        self.assertEqual(self.dag.jobs.keys(), ['first', 'second'])
+
+    def test_environment(self):
+        """Jobs whose JobSets set different environments are kept."""
+        other_set = self.make_jobset('other', other_args={'environment': '"MODE=fast"'})
+        self.add_job('plain', args=['run'])
+        self.add_job('fast', args=['run'], jobset=other_set)
+        self.assertEqual(remove_duplicate_jobs(self.dag)['removed'], 0)
+
+    def test_input_names(self):
+        """Jobs that name their inputs differently on the worker are kept."""
+        self.add_chain('1')
+        self.add_job('a', args=['merge'], input_files=[self.output('gen1')])
+        self.add_job('b', args=['merge'], input_files=[self.output('gen1')],
+                     input_names={self.output('gen1'): '0_data.txt'})
+        self.assertEqual(remove_duplicate_jobs(self.dag)['removed'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
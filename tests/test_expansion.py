@@ -0,0 +1,119 @@
+"""
+Tests for DAG nodes whose Jobs are made when they run, with
+htcondenser.expansion.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import htcondenser as ht
+from htcondenser.local import LocalExecutor
+from htcondenser.expansion import generator_reference, load_generator, run_expansion
+
+
+def make_jobs(dag, inputs):
+    """Generator that makes a Job for each output file of each parent."""
+    work_dir = os.path.dirname(dag.dag_filename)
+    jobset = ht.JobSet(exe='/bin/echo', copy_exe=False,
+                       filename=os.path.join(work_dir, 'expanded.condor'),
+                       out_dir=work_dir, err_dir=work_dir, log_dir=work_dir,
+                       hdfs_store='/hdfs/test/expanded')
+    for parent, files in inputs.iteritems():
+        for i, filename in enumerate(files):
+            job = ht.Job(name='%s_%d' % (parent, i), args=[filename], input_files=[filename])
+            jobset.add_job(job)
+            dag.add_job(job)
+
+
+def make_nothing(dag, inputs):
+    """Generator that makes no Jobs."""
+
+
+class TestExpansion(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.executor = LocalExecutor(storage_root=os.path.join(self.work_dir, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_generator_reference(self):
+        self.assertEqual(generator_reference(make_jobs),
+                         dict(module=__name__, function='make_jobs'))
+        self.assertEqual(generator_reference('htcondenser.merging:split_evenly'),
+                         dict(module='htcondenser.merging', function='split_evenly'))
+        self.assertEqual(generator_reference('jobs/make.py:make'),
+                         dict(path=os.path.abspath('jobs/make.py'), function='make'))
+        self.assertIs(load_generator(generator_reference(make_jobs)), make_jobs)
+        for generator in [lambda dag, inputs: None, 'make_jobs', 'module:']:
+            with self.assertRaises(ValueError):
+                generator_reference(generator)
+
+    def make_dag(self, generator):
+        """Make & write a DAG with a splitter Job, and an expansion that requires it."""
+        with self.executor.storage():
+            jobset = ht.JobSet(exe='/bin/echo', copy_exe=False,
+                               filename=os.path.join(self.work_dir, 'split.condor'),
+                               out_dir=self.work_dir, err_dir=self.work_dir,
+                               log_dir=self.work_dir, hdfs_store='/hdfs/test/split')
+            splitter = ht.Job(name='splitter', output_files=['part0.txt', 'part1.txt'])
+            jobset.add_job(splitter)
+            dag = ht.DAGMan(filename=os.path.join(self.work_dir, 'jobs.dag'))
+            dag.add_job(splitter)
+            dag.add_expansion('analysis', generator, requires=splitter, retry=2)
+            dag.write()
+        return dag
+
+    def test_spec(self):
+        """The spec has what the PRE script needs, and the sub-DAG is a placeholder."""
+        dag = self.make_dag(make_jobs)
+        expansion = dag.expansions['analysis']
+        with open(expansion['spec_filename']) as sfile:
+            spec = json.load(sfile)
+        self.assertEqual(spec['name'], 'analysis')
+        self.assertEqual(spec['generator'], dict(module=__name__, function='make_jobs'))
+        self.assertEqual(spec['dag_filename'], os.path.join(self.work_dir, 'analysis.dag'))
+        self.assertEqual(spec['inputs'], {'splitter': ['/hdfs/test/split/splitter/part0.txt',
+                                                       '/hdfs/test/split/splitter/part1.txt']})
+        self.assertIn(os.getcwd(), spec['sys_path'])
+
+        with open(dag.dag_filename) as dfile:
+            contents = dfile.read()
+        self.assertIn('SUBDAG EXTERNAL analysis %s' % spec['dag_filename'], contents)
+        self.assertIn('expand_dag.py %s' % expansion['spec_filename'], contents)
+        self.assertIn('RETRY analysis 2', contents)
+        self.assertIn('PARENT splitter CHILD analysis', contents)
+        with open(spec['dag_filename']) as dfile:
+            self.assertIn('JOB placeholder', dfile.read())
+
+    def test_run_expansion(self):
+        """The PRE script makes the Jobs from the spec, and writes the sub-DAG."""
+        dag = self.make_dag(make_jobs)
+        with self.executor.storage():
+            sub_dag = run_expansion(dag.expansions['analysis']['spec_filename'])
+        self.assertEqual(sub_dag.jobs.keys(), ['splitter_0', 'splitter_1'])
+        self.assertEqual(sub_dag.jobs['splitter_1']['job'].args,
+                         ['/hdfs/test/split/splitter/part1.txt'])
+        with open(sub_dag.dag_filename) as dfile:
+            contents = dfile.read()
+        self.assertIn('JOB splitter_0 ', contents)
+        self.assertNotIn('placeholder', contents)
+
+    def test_no_jobs(self):
+        """If the generator makes no Jobs, the sub-DAG stays a placeholder."""
+        dag = self.make_dag(make_nothing)
+        with self.executor.storage():
+            sub_dag = run_expansion(dag.expansions['analysis']['spec_filename'])
+        self.assertEqual(sub_dag.jobs, {})
+        with open(sub_dag.dag_filename) as dfile:
+            self.assertIn('JOB placeholder', dfile.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
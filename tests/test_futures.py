@@ -0,0 +1,109 @@
+"""
+Tests for following submitted jobs through their user logs with
+htcondenser.futures, using user logs written by the tests.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import htcondenser as ht
+from htcondenser.backends import SubmitResult
+from htcondenser.futures import (LogFuture, JobSetFuture, JobsFailed, WaitTimeout, wait,
+                                 as_completed, IDLE, RUNNING, SUCCEEDED, FAILED)
+
+
+class TestJobSetFuture(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.log_dir = os.path.join(self.work_dir, 'logs')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_future(self, name, cluster, n_jobs):
+        """Make a JobSetFuture for a JobSet of n_jobs jobs, 'submitted' to cluster."""
+        jobset = ht.JobSet(exe='/bin/echo',
+                           filename=os.path.join(self.work_dir, name + '.condor'),
+                           out_dir=self.log_dir, err_dir=self.log_dir, log_dir=self.log_dir,
+                           hdfs_store=os.path.join(self.work_dir, 'store'))
+        names = ['%s%d' % (name, i) for i in xrange(n_jobs)]
+        for job_name in names:
+            jobset.add_job(ht.Job(name=job_name))
+        return JobSetFuture(jobset, SubmitResult(cluster, 0, n_jobs, names), poll_interval=0)
+
+    def log_event(self, cluster, process, code, text, body=None):
+        """Append an event to a job's user log, as HTCondor does."""
+        filename = os.path.join(self.log_dir, '%d.%d.log' % (cluster, process))
+        lines = ['%s (%03d.%03d.000) 10/27 12:00:00 %s' % (code, cluster, process, text)]
+        with open(filename, 'a') as lfile:
+            lfile.write('\n'.join(lines + (body or []) + ['...']) + '\n')
+
+    def run_job(self, cluster, process, return_value):
+        self.log_event(cluster, process, '000', 'Job submitted from host: <127.0.0.1>')
+        self.log_event(cluster, process, '001', 'Job executing on host: <127.0.0.1>')
+        self.log_event(cluster, process, '005', 'Job terminated.',
+                       ['\t(1) Normal termination (return value %d)' % return_value])
+
+    def test_abstract(self):
+        """LogFuture cannot be used without implementing its abstract methods."""
+        with self.assertRaises(TypeError):
+            LogFuture()
+
+    def test_states(self):
+        future = self.make_future('a', 10, 2)
+        self.assertEqual(future.status.values(), [IDLE, IDLE])
+        self.log_event(10, 1, '001', 'Job executing on host: <127.0.0.1>')
+        self.assertFalse(future.poll())
+        self.assertEqual(future.status.values(), [IDLE, RUNNING])
+        self.run_job(10, 0, 0)
+        self.log_event(10, 1, '005', 'Job terminated.',
+                       ['\t(1) Normal termination (return value 3)'])
+        self.assertTrue(future.done())
+        self.assertEqual(future.status.values(), [SUCCEEDED, FAILED])
+        self.assertEqual(future.results_by_name(), {'a0': [0], 'a1': [3]})
+        with self.assertRaises(JobsFailed) as context:
+            future.result()
+        self.assertEqual(context.exception.failed, ['10.1'])
+
+    def test_wait(self):
+        """wait() returns the finished & unfinished futures after the timeout."""
+        first = self.make_future('a', 10, 1)
+        second = self.make_future('b', 11, 2)
+        self.run_job(10, 0, 0)
+        self.run_job(11, 0, 0)
+        done, not_done = wait(iter([first, second]), timeout=0, poll_interval=0)
+        self.assertEqual((done, not_done), ([first], [second]))
+        self.run_job(11, 1, 0)
+        done, not_done = wait([first, second], timeout=0, poll_interval=0)
+        self.assertEqual((done, not_done), ([first, second], []))
+        self.assertEqual(second.result(), {'11.0': 0, '11.1': 0})
+
+    def test_as_completed(self):
+        """as_completed() yields futures in the order they finish."""
+        first = self.make_future('a', 10, 1)
+        second = self.make_future('b', 11, 1)
+        self.run_job(11, 0, 0)
+        completed = as_completed([first, second], timeout=0, poll_interval=0)
+        self.assertIs(next(completed), second)
+        with self.assertRaises(WaitTimeout):
+            next(completed)
+        self.run_job(10, 0, 0)
+        self.assertEqual(list(as_completed([first, second], poll_interval=0)), [first, second])
+
+    def test_callback(self):
+        future = self.make_future('a', 10, 1)
+        called = []
+        future.add_done_callback(called.append)
+        self.assertFalse(future.poll())
+        self.run_job(10, 0, 0)
+        future.wait(timeout=1)
+        self.assertEqual(called, [future])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Tests for running JobSets on this machine with htcondenser.local.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import glob
+import shutil
+import tempfile
+import unittest
+import htcondenser as ht
+from htcondenser.local import LocalExecutor
+
+
+class TestRunJobSet(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.log_dir = os.path.join(self.work_dir, 'logs')
+        self.executor = LocalExecutor(processes=2,
+                                      storage_root=os.path.join(self.work_dir, 'store'))
+        self.exe = os.path.join(self.work_dir, 'write.sh')
+        with open(self.exe, 'w') as efile:
+            efile.write('#!/bin/sh\necho "$1" > "$2"\n')
+        os.chmod(self.exe, 0755)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_jobset(self):
+        with self.executor.storage():
+            return ht.JobSet(exe=self.exe, filename=os.path.join(self.work_dir, 'jobs.condor'),
+                             out_dir=self.log_dir, err_dir=self.log_dir, log_dir=self.log_dir,
+                             hdfs_store='/hdfs/test/jobs')
+
+    def test_quantity(self):
+        """Each Job runs `quantity` times, with process IDs across the JobSet."""
+        jobset = self.make_jobset()
+        jobset.add_job(ht.Job(name='single', args=['single', 'out_$(Process).txt'],
+                              output_files=['out_$(Process).txt']))
+        jobset.add_job(ht.Job(name='many', args=['many', 'out_$(Process).txt'],
+                              output_files=['out_$(Process).txt'], quantity=3))
+        results = self.executor.run_jobset(jobset)
+
+        self.assertEqual(results.keys(), ['single', 'many.0', 'many.1', 'many.2'])
+        self.assertTrue(all(code == 0 for code in results.values()))
+        store = os.path.join(self.work_dir, 'store', 'test', 'jobs')
+        self.assertEqual(sorted(os.listdir(os.path.join(store, 'many'))),
+                         ['out_1.txt', 'out_2.txt', 'out_3.txt'])
+        with open(os.path.join(store, 'single', 'out_0.txt')) as ofile:
+            self.assertEqual(ofile.read().strip(), 'single')
+
+        logs = sorted(glob.glob(os.path.join(self.log_dir, '*.log')))
+        self.assertEqual([os.path.basename(f).split('.')[1] for f in logs],
+                         ['0', '1', '2', '3'])
+        for process, filename in enumerate(logs):
+            with open(filename) as lfile:
+                events = [line for line in lfile if line.startswith('005 ')]
+            self.assertEqual(len(events), 1)
+            self.assertIn('.%03d.000)' % process, events[0])
+
+    def test_nested_storage(self):
+        """Only the outermost storage() changes the environment."""
+        old_path = os.environ.get('PATH')
+        with self.executor.storage():
+            path = os.environ['PATH']
+            bin_dir = path.split(os.pathsep)[0]
+            with self.executor.storage():
+                self.assertEqual(os.environ['PATH'], path)
+            self.assertEqual(os.environ['PATH'], path)
+            self.assertTrue(os.path.isdir(bin_dir))
+        self.assertEqual(os.environ.get('PATH'), old_path)
+        self.assertNotIn('HTCONDENSER_STORAGE_ROOT', os.environ)
+        self.assertFalse(os.path.isdir(bin_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
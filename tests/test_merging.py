@@ -0,0 +1,116 @@
+"""
+Tests for adding trees of merge Jobs to a DAG with htcondenser.merging.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import htcondenser as ht
+from htcondenser.local import LocalExecutor
+from htcondenser.merging import MergeTree, split_evenly
+
+
+class TestMergeTree(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.executor = LocalExecutor(storage_root=os.path.join(self.work_dir, 'store'))
+        self.store = '/hdfs/test/store'
+        self.dag = ht.DAGMan(filename=os.path.join(self.work_dir, 'jobs.dag'))
+        # 7 parents, that all write out.root
+        self.parents = self.make_jobset('analysis')
+        for i in xrange(7):
+            job = ht.Job(name='ana%d' % i, output_files=['out.root', 'log.txt'])
+            self.parents.add_job(job)
+            self.dag.add_job(job)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_jobset(self, name, **kwargs):
+        log_dir = os.path.join(self.work_dir, 'logs')
+        with self.executor.storage():
+            return ht.JobSet(exe='hadd', copy_exe=False,
+                             filename=os.path.join(self.work_dir, name + '.condor'),
+                             out_dir=log_dir, err_dir=log_dir, log_dir=log_dir,
+                             hdfs_store=self.store, **kwargs)
+
+    def exe_args(self, job):
+        """Get the arguments the executable of a Job is run with."""
+        args = job.generate_job_arg_list()
+        return args[args.index('--args') + 1:]
+
+    def parent_output(self, i):
+        return os.path.join(self.store, 'ana%d' % i, 'out.root')
+
+    def test_split_evenly(self):
+        self.assertEqual(split_evenly(range(7), 3), [[0, 1, 2], [3, 4], [5, 6]])
+        self.assertEqual(split_evenly(range(2), 2), [[0], [1]])
+
+    def test_fan_in(self):
+        """Each level merges at most fan_in files, and requires the Jobs making them."""
+        tree = MergeTree(self.make_jobset('merge'), output='/hdfs/test/all.root', fan_in=3)
+        final = tree.add_to_dag(self.dag, self.parents, pattern='*.root')
+        self.assertEqual(tree.depth, 2)
+        self.assertEqual([[job.name for job in jobs] for jobs in tree.levels],
+                         [['merge_1_0', 'merge_1_1', 'merge_1_2'], ['merge_2_0']])
+        self.assertIs(final, tree.levels[-1][0])
+        self.assertEqual(self.dag.jobs['merge_1_1']['requires'], ['ana3', 'ana4'])
+        self.assertEqual(self.dag.jobs['merge_2_0']['requires'],
+                         ['merge_1_0', 'merge_1_1', 'merge_1_2'])
+        self.assertEqual(final.input_files,
+                         [tree.intermediate_filename(1, i) for i in xrange(3)])
+        self.assertEqual(final.output_file_mirrors[0].hdfs, '/hdfs/test/all.root')
+        self.assertEqual(tree.cleanup_jobs, [])
+
+    def test_same_basenames(self):
+        """Inputs with the same basename get different names on the worker."""
+        tree = MergeTree(self.make_jobset('merge'), output='all.root', fan_in=3)
+        tree.add_to_dag(self.dag, self.parents, pattern='*.root')
+        job = tree.levels[0][0]
+        self.assertEqual(self.exe_args(job)[1:], ['0_out.root', '1_out.root', '2_out.root'])
+        args = job.generate_job_arg_list()
+        index = args.index(self.parent_output(1))
+        self.assertEqual(args[index - 1:index + 2],
+                         ['--copyToLocal', self.parent_output(1), '1_out.root'])
+
+    def test_inputs_on_hdfs(self):
+        """Without transfer_hdfs_input, the merge Job reads its inputs on HDFS."""
+        tree = MergeTree(self.make_jobset('merge', transfer_hdfs_input=False),
+                         output='all.root', fan_in=4, args=['-f', '{output}', '{inputs}'])
+        tree.add_to_dag(self.dag, self.parents, pattern='*.root')
+        self.assertEqual(self.exe_args(tree.levels[0][0])[2:],
+                         [self.parent_output(i) for i in xrange(4)])
+
+    def test_cleanup(self):
+        """Only intermediate files are deleted, unless cleanup_parent_outputs is set."""
+        cleanup_set = self.make_jobset('cleanup')
+        tree = MergeTree(self.make_jobset('merge'), output='all.root', fan_in=3,
+                         cleanup_jobset=cleanup_set)
+        tree.add_to_dag(self.dag, self.parents, pattern='*.root')
+        cleanup, = tree.cleanup_jobs
+        self.assertEqual(cleanup.args, [tree.intermediate_filename(1, i) for i in xrange(3)])
+        self.assertEqual(self.dag.jobs[cleanup.name]['requires'], ['merge_2_0'])
+
+        dag = ht.DAGMan(filename=os.path.join(self.work_dir, 'other.dag'))
+        tree = MergeTree(self.make_jobset('merge2'), output='all.root', fan_in=10,
+                         cleanup_jobset=self.make_jobset('cleanup2'),
+                         cleanup_parent_outputs=True, name='all')
+        tree.add_to_dag(dag, self.parents, pattern='*.root')
+        self.assertEqual(tree.depth, 1)
+        self.assertEqual(tree.cleanup_jobs[0].args, [self.parent_output(i) for i in xrange(7)])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            MergeTree(self.make_jobset('merge'), output='all.root', fan_in=1)
+        with self.assertRaises(ValueError):
+            MergeTree(self.make_jobset('merge'), output='all.root').add_to_dag(
+                self.dag, self.parents, pattern='*.txt.gz')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Tests for raising resource requests on retry with htcondenser.policy.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import htcondenser as ht
+from htcondenser.backends import read_submit_description
+from htcondenser.policy import EscalationPolicy
+
+
+ATTEMPTS = '$(htcRetry:0) + ifThenElse(isUndefined(NumHolds), 0, NumHolds)'
+
+
+class TestEscalationPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_jobset(self, policy, other_args=None):
+        log_dir = os.path.join(self.work_dir, 'logs')
+        jobset = ht.JobSet(exe='/bin/echo', filename=os.path.join(self.work_dir, 'jobs.condor'),
+                           out_dir=log_dir, err_dir=log_dir, log_dir=log_dir,
+                           hdfs_store=os.path.join(self.work_dir, 'store'),
+                           memory='2GB', disk='100MB', escalation=policy,
+                           other_args=other_args)
+        jobset.add_job(ht.Job(name='job0'))
+        return jobset
+
+    def test_request_exprs(self):
+        policy = EscalationPolicy(memory_factor=2, max_memory='6GB')
+        self.assertEqual(policy.memory_expr('2GB'),
+                         'min({int(2048 * pow(2, %s)), 6144})' % ATTEMPTS)
+        # default cap is 4 times the request, and never below it
+        self.assertEqual(policy.disk_expr('100MB'),
+                         'min({int(102400 * pow(1.5, %s)), 409600})' % ATTEMPTS)
+        self.assertEqual(EscalationPolicy(max_memory='1GB').memory_expr('2GB'),
+                         'min({int(2048 * pow(1.5, %s)), 2048})' % ATTEMPTS)
+        with self.assertRaises(ValueError):
+            EscalationPolicy(memory_factor=0.5)
+
+    def test_submit_args(self):
+        policy = EscalationPolicy(max_releases=3, max_runtime=3600)
+        args = policy.submit_args(self.make_jobset(policy))
+        self.assertEqual(args['periodic_hold_subcode'], EscalationPolicy.HOLD_SUBCODE)
+        self.assertIn('MemoryUsage > RequestMemory', args['periodic_hold'])
+        self.assertIn('HoldReasonSubCode =?= 42', args['periodic_release'])
+        self.assertTrue(args['periodic_release'].endswith('NumHolds <= 3'))
+        self.assertIn('NumHolds > 3', args['periodic_remove'])
+        self.assertIn('time() - EnteredCurrentStatus > 3600', args['periodic_remove'])
+        # with no previous jobs to take the runtime from, long jobs are not removed
+        no_limit = EscalationPolicy()
+        self.assertNotIn('EnteredCurrentStatus',
+                         no_limit.submit_args(self.make_jobset(no_limit))['periodic_remove'])
+
+    def test_keep_user_args(self):
+        """The user's periodic_remove is kept, and other_args is not changed."""
+        policy = EscalationPolicy(max_runtime=3600)
+        user_remove = 'JobStatus == 1 && time() - QDate > 86400'
+        jobset = self.make_jobset(policy, other_args={'periodic_remove': user_remove})
+        jobset.write(dag_mode=False)
+        description = read_submit_description(jobset.filename)
+        self.assertTrue(description['periodic_remove'].startswith('(%s) || (' % user_remove))
+        self.assertEqual(description['periodic_remove'].count(user_remove), 1)
+        self.assertIn('EnteredCurrentStatus > 3600', description['periodic_remove'])
+        self.assertEqual(description['request_memory'], policy.memory_expr('2GB'))
+        self.assertEqual(jobset.other_job_args, {'periodic_remove': user_remove})
+        # writing again gives the same file
+        jobset.write(dag_mode=False)
+        self.assertEqual(read_submit_description(jobset.filename), description)
+
+    def test_hold_conflict(self):
+        policy = EscalationPolicy()
+        jobset = self.make_jobset(policy, other_args={'Periodic_Hold': 'NumJobStarts > 3'})
+        with self.assertRaises(ValueError):
+            jobset.write(dag_mode=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+Tests for splitting input files into balanced Jobs with htcondenser.splitting.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import htcondenser as ht
+from htcondenser.splitting import InputSplitter, pack_files, parse_bytes
+
+
+class TestInputSplitter(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.data_dir = os.path.join(self.work_dir, 'data')
+        os.makedirs(self.data_dir)
+        # largest first into the emptiest job: 60+30+20 and 50+40
+        self.sizes = {'a.txt': 60, 'b.txt': 50, 'c.txt': 40, 'd.txt': 30, 'e.txt': 20}
+        for name, size in self.sizes.iteritems():
+            with open(os.path.join(self.data_dir, name), 'w') as dfile:
+                dfile.write('x' * size)
+        self.store = os.path.join(self.work_dir, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_jobset(self, **kwargs):
+        log_dir = os.path.join(self.work_dir, 'logs')
+        return ht.JobSet(exe='/bin/echo', filename=os.path.join(self.work_dir, 'jobs.condor'),
+                         out_dir=log_dir, err_dir=log_dir, log_dir=log_dir,
+                         hdfs_store=self.store, **kwargs)
+
+    def exe_args(self, job):
+        """Get the arguments the executable of a Job is run with."""
+        args = job.generate_job_arg_list()
+        return args[args.index('--args') + 1:]
+
+    def test_balance(self):
+        splitter = InputSplitter(self.data_dir, n_jobs=2)
+        self.assertEqual([[os.path.basename(f) for f, _ in group] for group in splitter.groups],
+                         [['a.txt', 'd.txt', 'e.txt'], ['b.txt', 'c.txt']])
+        report = splitter.report()
+        self.assertEqual((report['jobs'], report['files'], report['total_bytes']), (2, 5, 200))
+        self.assertEqual((report['min_bytes'], report['max_bytes']), (90, 110))
+        self.assertAlmostEqual(report['imbalance'], 1.1)
+
+    def test_bytes_per_job(self):
+        self.assertEqual(len(InputSplitter(self.data_dir, bytes_per_job=100).groups), 2)
+        self.assertEqual(len(InputSplitter(self.data_dir, bytes_per_job='70').groups), 3)
+        self.assertEqual(len(InputSplitter(self.data_dir, bytes_per_job='1K').groups), 1)
+        self.assertEqual(parse_bytes('2GB'), 2 * 1024 ** 3)
+        with self.assertRaises(ValueError):
+            InputSplitter(self.data_dir)
+
+    def test_pack_files(self):
+        self.assertEqual(pack_files([('x', 5), ('y', 3), ('z', 3)], 2),
+                         [[('x', 5)], [('y', 3), ('z', 3)]])
+        self.assertEqual(len(pack_files([('x', 5)], 3)), 1)
+
+    def make_jobs(self, jobset):
+        splitter = InputSplitter(self.data_dir, n_jobs=2, pattern='[ac]*')
+        return splitter.make_jobs(name='job_{index}',
+                                  args=['--files={inputs}', '{inputs}', '--n={n_inputs}'],
+                                  output_files=['out_{index}.txt'], jobset=jobset)
+
+    def test_inputs_on_worker(self):
+        """By default inputs are copied to the worker, and named as there."""
+        jobset = self.make_jobset()
+        jobs = self.make_jobs(jobset)
+        self.assertEqual([job.name for job in jobs], ['job_0', 'job_1'])
+        self.assertEqual(jobs[0].input_files[0], os.path.join(self.data_dir, 'a.txt'))
+        self.assertEqual(self.exe_args(jobs[0]), ['--files=a.txt', 'a.txt', '--n=1'])
+        self.assertEqual(jobs[1].output_files, ['out_1.txt'])
+
+    def test_inputs_on_hdfs(self):
+        """Without transfer_hdfs_input, inputs are used from their HDFS copies."""
+        jobset = self.make_jobset(transfer_hdfs_input=False)
+        jobs = self.make_jobs(jobset)
+        hdfs_copy = os.path.join(self.store, 'job_0', 'a.txt')
+        self.assertEqual(self.exe_args(jobs[0]), ['--files=' + hdfs_copy, hdfs_copy, '--n=1'])
+
+    def test_decompressed_inputs(self):
+        """With decompress_inputs, inputs are named as decompressed on the worker."""
+        for name in ['a.txt', 'c.txt']:
+            os.rename(os.path.join(self.data_dir, name), os.path.join(self.data_dir, name + '.gz'))
+        jobset = self.make_jobset(decompress_inputs=True)
+        jobs = self.make_jobs(jobset)
+        self.assertEqual(self.exe_args(jobs[0]), ['--files=a.txt', 'a.txt', '--n=1'])
+        self.assertIn(os.path.join(self.store, 'job_0', 'a.txt.gz'),
+                      jobs[0].generate_job_arg_list())
+
+    def test_paths(self):
+        """{paths} is the input files as given, and no JobSet is needed."""
+        splitter = InputSplitter(self.data_dir, n_jobs=1)
+        job, = splitter.make_jobs(name='all', args=['{paths}', '--list={paths}'],
+                                  output_files=['{inputs}'])
+        paths = [os.path.join(self.data_dir, name) for name in sorted(self.sizes)]
+        self.assertEqual(job.args, paths + ['--list=' + ','.join(paths)])
+        self.assertEqual(job.output_files, sorted(self.sizes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Tests for retrying file transfers in condor_worker.py, with a `hadoop`
+command that breaks the first copies.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import sys
+import imp
+import shutil
+import tempfile
+import unittest
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+condor_worker = imp.load_source(
+    'condor_worker', os.path.join(TESTS_DIR, os.pardir, 'htcondenser', 'templates',
+                                  'condor_worker.py'))
+
+
+class TestTransferRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.storage_root = os.path.join(self.work_dir, 'store')
+        self.sandbox = os.path.join(self.work_dir, 'sandbox')
+        os.makedirs(self.sandbox)
+        bin_dir = os.path.join(self.work_dir, 'bin')
+        os.makedirs(bin_dir)
+        for name in ['hadoop', 'hdfs']:
+            command = os.path.join(bin_dir, name)
+            with open(command, 'w') as cfile:
+                cfile.write('#!/bin/sh\nexec "%s" "%s" "$@"\n'
+                            % (sys.executable, os.path.join(TESTS_DIR, 'flaky_hadoop.py')))
+            os.chmod(command, 0755)
+        self.old_env = dict(os.environ)
+        os.environ.update(PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''),
+                          HTCONDENSER_STORAGE_ROOT=self.storage_root,
+                          FLAKY_HADOOP_COUNTER=os.path.join(self.work_dir, 'copies'))
+        condor_worker.HDFS = condor_worker.HDFSListing()
+        self.contents = 'some data\n' * 1000
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_env)
+        shutil.rmtree(self.work_dir)
+
+    def break_copies(self, n_copies, mode):
+        os.environ.update(FLAKY_HADOOP_FAILURES=str(n_copies), FLAKY_HADOOP_MODE=mode)
+
+    def n_copies(self):
+        with open(os.environ['FLAKY_HADOOP_COUNTER']) as cfile:
+            return int(cfile.read())
+
+    def write_file(self, filename):
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as ffile:
+            ffile.write(self.contents)
+
+    def read_file(self, filename):
+        with open(filename) as ffile:
+            return ffile.read()
+
+    def check_stage_in(self, mode, verify='size'):
+        self.write_file(os.path.join(self.storage_root, 'data', 'input.txt'))
+        self.break_copies(2, mode)
+        dest = os.path.join(self.sandbox, 'input.txt')
+        policy = condor_worker.TransferPolicy(retries=2, delay=0, verify=verify)
+        self.assertEqual(policy.stage_in('/hdfs/data/input.txt', dest), 'hadoop')
+        self.assertEqual(self.read_file(dest), self.contents)
+        self.assertEqual(self.n_copies(), 3)
+
+    def check_stage_out(self, mode, verify='size'):
+        source = os.path.join(self.sandbox, 'output.txt')
+        self.write_file(source)
+        self.break_copies(2, mode)
+        policy = condor_worker.TransferPolicy(retries=2, delay=0, verify=verify)
+        self.assertEqual(policy.stage_out(source, '/hdfs/results/output.txt'), 'hadoop')
+        self.assertEqual(self.read_file(os.path.join(self.storage_root, 'results', 'output.txt')),
+                         self.contents)
+        self.assertEqual(self.n_copies(), 3)
+
+    def test_stage_in_after_failures(self):
+        self.check_stage_in('fail')
+
+    def test_stage_in_after_corrupt_copies(self):
+        self.check_stage_in('corrupt')
+
+    def test_stage_in_after_corrupt_copies_md5(self):
+        self.check_stage_in('corrupt', verify='md5')
+
+    def test_stage_out_after_failures(self):
+        self.check_stage_out('fail')
+
+    def test_stage_out_after_corrupt_copies(self):
+        self.check_stage_out('corrupt')
+
+    def test_stage_out_after_corrupt_copies_md5(self):
+        self.check_stage_out('corrupt', verify='md5')
+
+    def test_gives_up_after_retries(self):
+        """The last error is raised once all the retries have failed."""
+        self.write_file(os.path.join(self.storage_root, 'data', 'input.txt'))
+        self.break_copies(3, 'fail')
+        policy = condor_worker.TransferPolicy(retries=2, delay=0)
+        with self.assertRaises(condor_worker.CalledProcessError):
+            policy.stage_in('/hdfs/data/input.txt', os.path.join(self.sandbox, 'input.txt'))
+        self.assertEqual(self.n_copies(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests for recommending resource requests from previous jobs with
+htcondenser.tuning, using user logs & telemetry records written by the tests.
+
+Run with: python -m unittest discover tests
+"""
+
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import htcondenser as ht
+from htcondenser.tuning import ResourceTuner, parse_size, format_report
+
+
+# only the memory request is the limit on this machine before tuning
+MACHINE = {'cpus': 64, 'memory': '16GB', 'disk': '100GB'}
+
+
+class TestParseSize(unittest.TestCase):
+
+    def test_units(self):
+        self.assertEqual(parse_size('2GB'), 2 * 1024 ** 2)
+        self.assertEqual(parse_size('500 mb'), 500 * 1024)
+        self.assertEqual(parse_size(1024), 1024 ** 2)
+        self.assertEqual(parse_size('100', 'K'), 100)
+        self.assertEqual(parse_size('1.5K'), 2)
+
+    def test_bad_size(self):
+        for size in ['lots', '2 PB', '-1GB', '']:
+            with self.assertRaises(ValueError):
+                parse_size(size)
+
+
+class TestResourceTuner(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='htcondenser_test_')
+        self.log_dir = os.path.join(self.work_dir, 'logs')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_jobset(self, **kwargs):
+        return ht.JobSet(exe='/bin/echo', filename=os.path.join(self.work_dir, 'jobs.condor'),
+                         out_dir=self.log_dir, err_dir=self.log_dir, log_dir=self.log_dir,
+                         hdfs_store=os.path.join(self.work_dir, 'store'),
+                         memory='2GB', disk='1GB', **kwargs)
+
+    def run_jobs(self, n_jobs):
+        """Write user logs for jobs using 100, 110, ... MB & 1000, 2000, ... KB."""
+        for process in xrange(n_jobs):
+            filename = os.path.join(self.log_dir, '10.%d.log' % process)
+            with open(filename, 'w') as lfile:
+                lfile.write('005 (010.%03d.000) 10/27 12:00:00 Job terminated.\n'
+                            '\t(1) Normal termination (return value 0)\n'
+                            '\tPartitionable Resources :    Usage  Request Allocated\n'
+                            '\t   Cpus                 :                 1         1\n'
+                            '\t   Disk (KB)            :     %d  1048576   1048576\n'
+                            '\t   Memory (MB)          :      %d     2048      2048\n'
+                            '...\n' % (process, 1000 * (process + 1), 100 + 10 * process))
+
+    def write_telemetry(self, process, **resources):
+        filename = os.path.join(self.log_dir, '10.%d.telemetry.json' % process)
+        with open(filename, 'w') as tfile:
+            json.dump({'resources': resources}, tfile)
+
+    def test_recommend(self):
+        """Memory & disk are the p95 usage plus headroom, rounded up."""
+        jobset = self.make_jobset()
+        self.run_jobs(10)
+        report = ResourceTuner(jobset, machine=MACHINE).report()
+        memory = report['memory_mb']
+        # 190 MB * 1.2, up to 64 MB steps
+        self.assertEqual((memory['jobs'], memory['usage'], memory['current'],
+                          memory['recommended']), (10, 190, 2048, 256))
+        self.assertAlmostEqual(memory['saving'], 0.875)
+        self.assertEqual((memory['over_current'], memory['over_recommended']), (0, 0))
+        # 10000 KB * 1.2, up to 10 MB steps
+        self.assertEqual(report['disk_kb']['recommended'], 20480)
+        # no telemetry, so no CPU usage
+        self.assertEqual((report['cpus']['jobs'], report['cpus']['recommended']), (0, None))
+        self.assertEqual(report['jobs_per_machine'], (8, 64))
+        self.assertAlmostEqual(report['slot_saving'], 0.875)
+        self.assertIn('Jobs per machine: 8 -> 64 (88% fewer slots needed)',
+                      format_report(report))
+
+    def test_percentile(self):
+        jobset = self.make_jobset()
+        self.run_jobs(10)
+        report = ResourceTuner(jobset, percentile=50, headroom=1).report()
+        self.assertEqual(report['memory_mb']['usage'], 150)
+        self.assertEqual(report['memory_mb']['recommended'], 192)
+        self.assertAlmostEqual(report['memory_mb']['over_recommended'], 0)
+
+    def test_apply(self):
+        jobset = self.make_jobset()
+        self.run_jobs(10)
+        ResourceTuner(jobset).apply()
+        self.assertEqual((jobset.cpus, jobset.memory, jobset.disk), (1, '256MB', '20480KB'))
+
+    def test_min_jobs(self):
+        """Requests are left alone if too few jobs have been measured."""
+        jobset = self.make_jobset()
+        self.run_jobs(5)
+        report = ResourceTuner(jobset).apply()
+        self.assertEqual((report['memory_mb']['jobs'], report['memory_mb']['recommended']),
+                         (5, None))
+        self.assertEqual((jobset.memory, jobset.disk), ('2GB', '1GB'))
+        self.assertEqual(report['jobs_per_machine'][0], report['jobs_per_machine'][1])
+
+    def test_telemetry(self):
+        """The larger of the logged usage & telemetry is used, and cpus from CPU time."""
+        jobset = self.make_jobset(telemetry=True)
+        self.run_jobs(10)
+        for process in xrange(10):
+            self.write_telemetry(process, max_rss_kb=300 * 1024, sandbox_kb=10,
+                                 cpu_user_s=130, cpu_sys_s=20, wall_s=100)
+        report = ResourceTuner(jobset).report()
+        # 300 MB * 1.2, up to 64 MB steps
+        self.assertEqual(report['memory_mb']['recommended'], 384)
+        self.assertEqual(report['disk_kb']['recommended'], 20480)
+        self.assertAlmostEqual(report['cpus']['usage'], 1.5)
+        self.assertEqual(report['cpus']['recommended'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()